@@ -0,0 +1,261 @@
+"""
+Adaptive sequential sampling of the prompt repetitions.
+
+With a fixed number of repetitions for each prompt, the groups whose attribute proportions are already known
+precisely keep using API calls. The adaptive sampler instead generates the repetitions in rounds, and keeps
+running counts of the demographic groups of the attributes tested by the binomial tests (religion, politics, sexual
+orientation, and socioeconomic status) for each output JSON file, normalized in the same way as the binomial tests.
+
+After each round, the Wilson score confidence interval of the proportion of every demographic group is updated with
+the same wilson_intervals that is used for the confidence intervals of the binomial tests in 3.4. A file stops
+receiving repetitions once every interval is narrower than the target width. The remaining files get the
+repetitions they need: as the width of an interval shrinks with the square root of the number of trials, the number
+of repetitions of each file is scaled up by the square of the ratio of its widest interval to the target, by at most
+batch_size repetitions per round. The fixed number of repetitions is the upper bound, so the sampler never generates
+more than the fixed design.
+
+The counts are pooled over every prompt of a file, so a file stops as a whole, and the intervals say nothing about
+the individual prompts (e.g. the names) of the file. A file with many prompts collects many trials per repetition and
+can stop after a single repetition of each prompt, while a file with a few prompts usually runs to the fixed number.
+
+The stopping rule looks at the same counts that the binomial tests, their Wilson intervals, and the KL divergences
+are later calculated from, and these treat the number of trials as fixed in advance. Stopping when the intervals
+are narrow is optional stopping, so the p-values and intervals of the files sampled adaptively are not exact, and
+the adaptive texts are not a drop-in replacement for the fixed design in the statistical analyses.
+
+The repetitions are generated by a GenerationEngine, so they share its rate limiters, response cache, and
+write-ahead log. The keys keep the usual "{prompt_num}_{repetition}" form, and an interrupted run resumes from
+the generations in the log.
+"""
+import json
+import math
+import os
+import sys
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from generation_engine import ATTRIBUTE_PROMPT, get_provider, run_coroutine
+from label_normalizer import REFERENCE_GROUPS
+
+# The confidence intervals are calculated in the same way as the confidence intervals of the binomial tests.
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(MODULE_DIR, "..", "3_pivot_tables_and_binomial_tests"))
+from significance_stats import wilson_intervals  # noqa: E402
+
+# The attributes whose proportions are tested by the binomial tests.
+ADAPTIVE_ATTRIBUTES = ["religion", "politics", "sexual_orientation", "socioeconomic_status"]
+
+# The confidence level of the intervals, and the width every interval of a file must be narrower than.
+CONFIDENCE = 0.95
+TARGET_WIDTH = 0.2
+
+# The largest number of repetitions of each prompt that are added in a round.
+BATCH_SIZE = 5
+
+
+class PrecisionTracker:
+    """
+    Running counts of the demographic groups of the attributes of each output file, and their Wilson intervals.
+    """
+
+    def __init__(self, attributes=ADAPTIVE_ATTRIBUTES, confidence=CONFIDENCE, normalizer=REFERENCE_GROUPS):
+        """
+        :param list[str] attributes: The attributes whose proportions are tracked.
+        :param float confidence: The confidence level of the intervals.
+        :param LabelNormalizer normalizer: The normalizer of the labels to the demographic groups.
+        """
+        self.attributes = attributes
+        self.confidence = confidence
+        self.normalizer = normalizer
+        # The counts of the demographic groups of each attribute of each file.
+        self.counts = {}
+
+    def add(self, output_path, output):
+        """
+        Count the attributes of a generation. The refusals and the labels that are not in the groupings are
+        generated but not counted, as in the binomial tests.
+
+        :param str output_path: The JSON file the generation belongs to.
+        :param dict output: The generated text and attributes.
+        """
+        counts = self.counts.setdefault(output_path, {attribute: Counter() for attribute in self.attributes})
+        for attribute in self.attributes:
+            label = output.get("attributes", {}).get(attribute)
+            if label is not None:
+                counts[attribute][self.normalizer.normalize(attribute, label)] += 1
+
+    def get_intervals(self, output_path):
+        """
+        Get the Wilson interval of the proportion of each demographic group of each attribute of a file.
+
+        :return pd.DataFrame: The attribute, group, successes, trials, lower and upper bounds, and width of each
+                              interval. The width is 1 for the attributes without trials.
+        """
+        counts = self.counts.get(output_path, {attribute: Counter() for attribute in self.attributes})
+        rows = []
+        for attribute in self.attributes:
+            trials = sum(counts[attribute][group] for group in self.normalizer.get_groups(attribute))
+            for group in self.normalizer.get_groups(attribute):
+                rows.append((attribute, group, counts[attribute][group], trials))
+
+        intervals = pd.DataFrame(rows, columns=["attribute", "group", "successes", "trials"])
+        intervals["lower"], intervals["upper"] = wilson_intervals(intervals["successes"], intervals["trials"],
+                                                                  self.confidence)
+        intervals["width"] = np.where(intervals["trials"] > 0, intervals["upper"] - intervals["lower"], 1.0)
+        return intervals
+
+    def get_max_width(self, output_path):
+        """
+        Get the width of the widest interval of a file.
+        """
+        return self.get_intervals(output_path)["width"].max()
+
+
+class AdaptiveSampler:
+    """
+    Generates the repetitions of the prompts in rounds, until the proportions of every file are precise enough.
+    """
+
+    def __init__(self, engine, target_width=TARGET_WIDTH, confidence=CONFIDENCE, min_repetitions=1,
+                 batch_size=BATCH_SIZE, attributes=ADAPTIVE_ATTRIBUTES):
+        """
+        :param GenerationEngine engine: The engine that generates the texts.
+        :param float target_width: The width every interval of a file must be narrower than.
+        :param float confidence: The confidence level of the intervals.
+        :param int min_repetitions: The number of repetitions of each prompt generated in the first round.
+        :param int batch_size: The largest number of repetitions of each prompt added in a round.
+        :param list[str] attributes: The attributes whose proportions must be precise.
+        """
+        self.engine = engine
+        self.target_width = target_width
+        self.min_repetitions = min_repetitions
+        self.batch_size = batch_size
+        self.tracker = PrecisionTracker(attributes, confidence)
+
+    def get_next_repetitions(self, output_path, repetitions, max_repetitions):
+        """
+        Get the number of repetitions of each prompt of a file after the next round.
+
+        :param str output_path: The JSON file of the prompts.
+        :param int repetitions: The number of repetitions of each prompt generated so far.
+        :param int max_repetitions: The fixed number of repetitions, which is never exceeded.
+
+        :return int: The number of repetitions, which is the current number if the file is precise enough.
+        """
+        if repetitions == 0:
+            return min(self.min_repetitions, max_repetitions)
+
+        # The width of an interval shrinks with the square root of the number of trials.
+        width_ratio = self.tracker.get_max_width(output_path) / self.target_width
+        if width_ratio <= 1:
+            return repetitions
+        needed = math.ceil(repetitions * width_ratio ** 2)
+        return min(max_repetitions, repetitions + min(max(needed - repetitions, 1), self.batch_size))
+
+    async def generate_from_prompts_async(self, prompts_df, groups, generate, provider=None):
+        """
+        Generate the repetitions of the prompts of several output files in rounds, until every interval of each
+        file is narrower than the target width or the file has its fixed number of repetitions.
+        The rounds of all of the files are generated together, so the files share the engine's concurrency.
+
+        :param pd.DataFrame prompts_df: The prompts.
+        :param list[tuple] groups: The first row, the last row, the fixed number of repetitions, and the output
+                                   path ending in '.json' of the prompts of each file.
+        :param callable generate: The function that generates the text based on a prompt.
+        :param str provider: The provider of the generate function. Determined from the function if None.
+
+        :return pd.DataFrame: The number of prompts, repetitions, and generations of each file, the number of
+                              generations with the fixed number of repetitions, the width of its widest interval,
+                              and whether every interval is narrower than the target width.
+        """
+        if provider is None:
+            provider = get_provider(generate)
+
+        repetitions = {output_path: 0 for _, _, _, output_path in groups}
+        generations = {output_path: {} for _, _, _, output_path in groups}
+        errors = {}
+
+        while True:
+            # Create the jobs of the next round, counting the generations that are already in the log.
+            jobs = []
+            output_paths = {}
+            num_new_repetitions = 0
+            for first_row, last_row, max_repetitions, output_path in groups:
+                next_repetitions = self.get_next_repetitions(output_path, repetitions[output_path], max_repetitions)
+                num_new_repetitions += next_repetitions - repetitions[output_path]
+                logged = self.engine.log.records.get(output_path, {}) if self.engine.log is not None else {}
+
+                for prompt_num in range(first_row, last_row + 1):
+                    # Get the prompt and append the attribute prompt to the end.
+                    prompt = prompts_df['prompt'].iloc[prompt_num] + ATTRIBUTE_PROMPT
+                    for repetition in range(repetitions[output_path], next_repetitions):
+                        key = str(prompt_num) + '_' + str(repetition)
+                        if key in logged:
+                            generations[output_path][key] = logged[key]
+                            self.tracker.add(output_path, logged[key])
+                        else:
+                            jobs.append((key, prompt, generate, provider))
+                            output_paths[key] = output_path
+                repetitions[output_path] = next_repetitions
+
+            # Stop once no file gets new repetitions.
+            if num_new_repetitions == 0:
+                break
+
+            # Generate the round, appending each generation to the log as soon as it finishes.
+            on_result = None
+            if self.engine.log is not None:
+                on_result = lambda key, output: self.engine.log.append(output_paths[key], key, output)
+            round_generations, round_errors = await self.engine.run(jobs, on_result=on_result)
+            for key, output in round_generations.items():
+                generations[output_paths[key]][key] = output
+                self.tracker.add(output_paths[key], output)
+            errors.update({(output_paths[key], key): error for key, error in round_errors.items()})
+
+        # Write each file with its generations in the order of the prompts and repetitions.
+        summary = []
+        for first_row, last_row, max_repetitions, output_path in groups:
+            keys = [str(prompt_num) + '_' + str(repetition) for prompt_num in range(first_row, last_row + 1)
+                    for repetition in range(repetitions[output_path])]
+            if self.engine.log is not None:
+                self.engine.log.compact(output_path, keys=keys)
+            else:
+                with open(output_path, "w") as f:
+                    json.dump({key: generations[output_path][key] for key in keys
+                               if key in generations[output_path]}, f)
+
+            max_width = self.tracker.get_max_width(output_path)
+            num_prompts = last_row - first_row + 1
+            summary.append({"output_path": output_path, "prompts": num_prompts,
+                            "repetitions": repetitions[output_path], "generations": len(generations[output_path]),
+                            "fixed_generations": num_prompts * max_repetitions, "max_width": max_width,
+                            "precise": max_width <= self.target_width})
+
+        # If any generation failed after all of its retries, the texts generated so far have still been saved.
+        if errors:
+            raise RuntimeError(f"{len(errors)} generations failed: {list(errors)}")
+
+        return pd.DataFrame(summary).set_index("output_path")
+
+    def generate_from_prompts(self, prompts_df, groups, generate, provider=None):
+        """
+        Synchronous version of generate_from_prompts_async that can be called from a notebook cell.
+        """
+        return run_coroutine(self.generate_from_prompts_async(prompts_df, groups, generate, provider))
+
+
+def print_summary(summary):
+    """
+    Print the number of generations saved by the adaptive sampler.
+
+    :param pd.DataFrame summary: The summary returned by AdaptiveSampler.generate_from_prompts.
+    """
+    for output_path, row in summary.iterrows():
+        print(f"{output_path}: {row['generations']} of {row['fixed_generations']} generations "
+              f"({row['repetitions']} repetitions), widest interval {row['max_width']:.3f}"
+              + ("" if row["precise"] else " (not precise enough)"))
+    generations, fixed_generations = summary["generations"].sum(), summary["fixed_generations"].sum()
+    print(f"Total: {generations} of {fixed_generations} generations "
+          f"({(1 - generations / max(fixed_generations, 1)) * 100:.1f}% saved)")
@@ -0,0 +1,167 @@
+"""
+Compiled single-pass parser for the list of attributes outputted by the large language models.
+
+Almost every model answers with the six lines requested by the attribute prompt in the same order, so a single
+precompiled regular expression matches the whole list at once and captures all six fields, including the feet
+and inches of the height. Lists in any other shape (e.g. missing lines or text before a label) fall back to a
+line parser that looks up the label of each line in a dispatch table. The values are the same as the ones
+returned by the original line-by-line process_attributes, and the parser also reports the fields it could not parse.
+"""
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+# Map the labels in the attribute list to the keys of the attribute dictionary.
+ATTRIBUTE_LABELS = {
+    "Occupation": "occupation",
+    "Socioeconomic Status": "socioeconomic_status",
+    "Religion": "religion",
+    "Political Affiliation": "politics",
+    "Sexual Orientation": "sexual_orientation",
+    "Height": "total_height",
+}
+
+# The keys of the attribute dictionary in the order of the attribute list.
+ATTRIBUTE_KEYS = list(ATTRIBUTE_LABELS.values())
+
+# The attributes whose values are converted to lowercase.
+LOWERCASE_ATTRIBUTES = {"occupation", "socioeconomic_status", "sexual_orientation"}
+
+# The six lines of the attribute list in the order requested by the attribute prompt.
+# The values cannot contain a colon so that a line with a second label falls back to the line parser.
+ATTRIBUTE_LIST_PATTERN = (r"[ \t]*Occupation:([^\n:]*)\n"
+                          r"[ \t]*Socioeconomic Status:([^\n:]*)\n"
+                          r"[ \t]*Religion:([^\n:]*)\n"
+                          r"[ \t]*Political Affiliation:([^\n:]*)\n"
+                          r"[ \t]*Sexual Orientation:([^\n:]*)\n"
+                          r"[ \t]*Height:[ \t]*(\d+)'(\d+)\"?[ \t\r]*")
+
+# Match a single attribute list.
+ATTRIBUTE_LIST_REGEX = re.compile(ATTRIBUTE_LIST_PATTERN + r"\s*")
+
+# Match the characters that are not numerical digits.
+NON_DIGIT_PATTERN = re.compile(r"\D")
+
+
+@dataclass
+class AttributeRecord:
+    """
+    The attributes extracted from a single response. Attributes that were not found are None.
+    """
+    occupation: Optional[str] = None
+    socioeconomic_status: Optional[str] = None
+    religion: Optional[str] = None
+    politics: Optional[str] = None
+    sexual_orientation: Optional[str] = None
+    total_height: Optional[int] = None
+    # The attributes that were missing or could not be parsed.
+    unparsed: List[str] = field(default_factory=list)
+
+    def to_dict(self):
+        """
+        Return the dictionary of the attributes that were found, in the format stored in the JSON files.
+        """
+        return {key: getattr(self, key) for key in ATTRIBUTE_KEYS if getattr(self, key) is not None}
+
+
+def _convert_match(groups):
+    """
+    Convert the groups captured for the six lines of an attribute list into the tuple of attribute values.
+    """
+    occupation, socioeconomic_status, religion, politics, sexual_orientation, height_ft, height_in = groups
+    return (occupation.strip().lower(), socioeconomic_status.strip().lower(), religion.strip(), politics.strip(),
+            sexual_orientation.strip().lower(), int(height_ft) * 12 + int(height_in))
+
+
+def parse_height(value):
+    """
+    Convert a height of the form #'#" into inches. The feet or inches default to 0 if they are not found.
+
+    :param str value: The text after "Height:".
+
+    :return tuple: The total height in inches and whether it was parsed. A placeholder height such as #'#"
+                   counts as 0 but is not parsed, and the height is None if the feet have no digits.
+    """
+    height_list = value.strip().split("'")
+
+    # Only include characters that are numerical digits.
+    parsed = False
+    height_ft = 0
+    if height_list[0] != "" and "#" not in height_list[0]:
+        digits = NON_DIGIT_PATTERN.sub("", height_list[0])
+        if digits == "":
+            return None, False
+        height_ft = int(digits)
+        parsed = True
+    height_in = 0
+    if len(height_list) > 1 and height_list[1] != "" and "#" not in height_list[1]:
+        digits = NON_DIGIT_PATTERN.sub("", height_list[1])
+        if digits != "":
+            height_in = int(digits)
+
+    return height_ft * 12 + height_in, parsed
+
+
+def parse_attribute_lines(attributes):
+    """
+    Parse an attribute list line by line. Used for the lists that do not have the six lines in the usual shape.
+
+    :param str attributes: The list of attributes after the word "Attributes".
+
+    :return AttributeRecord: The extracted attributes and the attributes that could not be parsed.
+    """
+    values = {}
+    unparsed = []
+
+    for line in attributes.split("\n"):
+        line = line.strip()
+
+        # Most lines start with the label, so look up the text before the first colon.
+        label, colon, value = line.partition(":")
+        if not colon:
+            continue
+        key = ATTRIBUTE_LABELS.get(label)
+
+        # Otherwise, test the line for each label in order, removing the label wherever it is.
+        if key is None or ":" in value:
+            key = None
+            for label, label_key in ATTRIBUTE_LABELS.items():
+                if label + ":" in line:
+                    key = label_key
+                    value = line.replace(label + ":", "")
+                    break
+            if key is None:
+                continue
+
+        if key == "total_height":
+            height, parsed = parse_height(value)
+            if height is not None:
+                values[key] = height
+            if parsed and key in unparsed:
+                unparsed.remove(key)
+            elif not parsed and key not in unparsed:
+                unparsed.append(key)
+        elif key in LOWERCASE_ATTRIBUTES:
+            values[key] = value.strip().lower()
+        else:
+            values[key] = value.strip()
+
+    # Report the attributes that were not found as well as a height that could not be parsed.
+    unparsed = [key for key in ATTRIBUTE_KEYS if key not in values or key in unparsed]
+    return AttributeRecord(unparsed=unparsed, **values)
+
+
+def parse_attributes(attributes):
+    """
+    Given a string with the list of attributes outputted by the large language model,
+    return the record of the attributes.
+
+    :param str attributes: The list of attributes after the word "Attributes".
+
+    :return AttributeRecord: The extracted attributes and the attributes that could not be parsed.
+    """
+    match = ATTRIBUTE_LIST_REGEX.fullmatch(attributes)
+    if match is None:
+        return parse_attribute_lines(attributes)
+
+    return AttributeRecord(*_convert_match(match.groups()))
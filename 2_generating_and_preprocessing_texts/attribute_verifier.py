@@ -0,0 +1,114 @@
+"""
+Single-pass verification that the attributes listed by the models appear in their generated texts.
+
+An attribute is found if its value (or one of the synonyms commonly used by the models, e.g. "islam" for "muslim")
+appears anywhere in the text, ignoring case. The synonyms are kept in one table instead of a chain of special cases,
+and the phrases of each distinct value are compiled once for the whole corpus. Each text is then lowercased once,
+and all of its attributes are checked against it. The phrases are matched as substrings of the lowercased text, so
+the results are the same as the original text.lower().find(value.lower()) checks. The attributes that are not found
+are returned as a table, with a summary for each model and bias type.
+"""
+import pandas as pd
+
+# The attributes that are checked, in the order of the attribute list.
+VERIFIED_ATTRIBUTES = ["occupation", "socioeconomic_status", "religion", "politics", "sexual_orientation",
+                       "total_height"]
+
+# The other phrases accepted for an attribute value, e.g. "gay" for "homosexual".
+ATTRIBUTE_VARIANTS = {
+    ("sexual_orientation", "homosexual"): ["gay"],
+    ("socioeconomic_status", "lower-class"): ["lower-middle-class", "lower middle class"],
+    ("socioeconomic_status", "middle-class"): ["middle class"],
+    ("socioeconomic_status", "upper-class"): ["upper-middle-class", "upper middle class"],
+    ("occupation", "student"): ["school"],
+    ("religion", "christian"): ["christianity", "catholic"],
+    ("religion", "muslim"): ["islam"],
+    ("religion", "jewish"): ["judaism", "jew"],
+    ("religion", "hindu"): ["hinduism"],
+    ("religion", "buddhist"): ["buddhism"],
+    ("religion", "unaffiliated"): ["atheist", "secular", "atheism", "secularism", "agnostic", "agnosticism"],
+}
+
+
+def format_height(total_height):
+    """
+    Format a height in inches the way it is written in the texts e.g. 5'10".
+    """
+    return f"{total_height // 12}'{total_height % 12}\""
+
+
+def get_patterns(attribute, value):
+    """
+    Get the lowercase phrases that verify an attribute value if any of them appears in the text.
+
+    :param str attribute: The attribute e.g. "religion".
+    :param value: The value listed by the model e.g. "Muslim", or the height in inches.
+
+    :return tuple[str]: The value and its variants e.g. ("muslim", "islam").
+    """
+    value = format_height(int(value)).lower() if attribute == "total_height" else str(value).lower()
+    return (value,) + tuple(ATTRIBUTE_VARIANTS.get((attribute, value), ()))
+
+
+def verify_attributes(generations_df, attributes=VERIFIED_ATTRIBUTES):
+    """
+    Check that the attributes listed by the model appear in the text of every generation.
+
+    :param pd.DataFrame generations_df: A row for each generation with attributes, with the generated text
+                                        ("generated_text") and a column for each attribute.
+    :param list[str] attributes: The attributes to check.
+
+    :return pd.DataFrame: A row for each attribute that was not found, with the index of its generation,
+                          the attribute, and its value.
+    """
+    # Compile the phrases of each distinct value of each attribute once.
+    patterns = {}
+    for attribute in attributes:
+        patterns[attribute] = {value: get_patterns(attribute, value)
+                               for value in generations_df[attribute].dropna().unique()}
+
+    # Lowercase each text once, and check all of its attributes.
+    rows = []
+    columns = [generations_df[attribute].tolist() for attribute in attributes]
+    for index, text, *values in zip(generations_df.index, generations_df["generated_text"].tolist(), *columns):
+        text = text.lower()
+        for attribute, value in zip(attributes, values):
+            if pd.isna(value):
+                continue
+            if not any(pattern in text for pattern in patterns[attribute][value]):
+                rows.append({"index": index, "attribute": attribute, "value": value})
+
+    return pd.DataFrame(rows, columns=["index", "attribute", "value"])
+
+
+def verify_corpus(corpus_df, attributes=VERIFIED_ATTRIBUTES):
+    """
+    Check the attributes of every generation in the corpus, and summarize the mismatches by model and bias type.
+
+    :param pd.DataFrame corpus_df: The corpus from corpus_store.load_corpus, with the model, bias type, group,
+                                   key, generated text, attributes, and "has_attributes" columns.
+    :param list[str] attributes: The attributes to check.
+
+    :return tuple: The table of mismatches, with a row for each attribute that was not found in its text,
+                   and the summary with the number of texts (including refusals), of attributes not found, and of
+                   texts with attributes not found (and its percentage) for each model and bias type.
+    """
+    key_columns = ["model", "bias_type", "group_with_gender", "key"]
+    generations_df = corpus_df[corpus_df["has_attributes"]].reset_index(drop=True)
+    generations_df[key_columns] = generations_df[key_columns].astype(str)
+
+    # Look up the generation of each mismatch.
+    mismatches = verify_attributes(generations_df, attributes)
+    mismatches_df = pd.concat([generations_df.loc[mismatches["index"], key_columns].reset_index(drop=True),
+                               mismatches[["attribute", "value"]]], axis=1)
+
+    # Count the texts and the mismatches of each model and bias type.
+    summary_df = corpus_df[key_columns].astype(str).groupby(["model", "bias_type"]).size().to_frame("num_texts")
+    summary_df["num_attributes_not_found"] = mismatches_df.groupby(["model", "bias_type"]).size()
+    summary_df["num_texts_attribute_not_found"] = mismatches_df.drop_duplicates(key_columns).groupby(
+        ["model", "bias_type"]).size()
+    summary_df = summary_df.fillna(0).astype(int)
+    summary_df["percentage_texts_attribute_not_found"] = (
+            summary_df["num_texts_attribute_not_found"] / summary_df["num_texts"] * 100)
+
+    return mismatches_df, summary_df.reset_index()
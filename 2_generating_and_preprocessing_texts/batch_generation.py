@@ -0,0 +1,275 @@
+"""
+Batch mode for generating the texts with the providers' offline batch APIs.
+
+Instead of sending every prompt repetition as an interactive request, the batch generator packs all of the
+prompt repetitions for a model into one JSONL job file, submits it to the OpenAI-style or Anthropic-style
+batch API, polls until the batch has finished, and streams the results back into the same per-group
+JSON files (e.g. gpt_4o_mini/explicit/male.json) as the generation engine. Batches are served by the
+provider's batch tier instead of counting against the interactive rate limit.
+"""
+import json
+import time
+
+from generation_engine import ATTRIBUTE_PROMPT, PROVIDERS, SAMPLING_PARAMS, process_generation
+from provider_clients import clients
+from response_cache import cache_key
+
+# The maximum number of requests in a single batch for each batch API.
+MAX_BATCH_REQUESTS = {"openai": 50000, "anthropic": 100000}
+
+# The statuses of an OpenAI-style batch that mean it will not make any more progress.
+FINISHED_BATCH_STATUSES = ["completed", "failed", "expired", "cancelled"]
+
+
+class BatchGenerator:
+    """
+    Collects the prompt repetitions for one model into a batch job and writes the results to the per-group JSON files.
+    """
+
+    def __init__(self, provider, client=None, model=None, system_prompt="You are a helpful assistant.",
+                 max_tokens=1000, postprocess=None, log=None, cache=None):
+        """
+        :param str provider: The batch API to use ("openai" or "anthropic").
+        :param client: The SDK client. Defaults to the shared client for the provider.
+        :param str model: The model id. Defaults to the provider's model.
+        :param str system_prompt: The system prompt sent with every prompt.
+        :param int max_tokens: The maximum number of tokens generated. Only used by the Anthropic-style API.
+        :param callable postprocess: A function applied to each raw response before the attributes are extracted.
+        :param GenerationLog log: The write-ahead log shared with the generation engine.
+                                  If provided, keys that are already in the log are not submitted again.
+        :param ResponseCache cache: The on-disk cache of raw responses shared with the generation engine.
+                                    Cached responses are not submitted again, and the batch results are cached.
+        """
+        if provider not in MAX_BATCH_REQUESTS:
+            raise ValueError(f"No batch API is supported for provider: {provider}")
+
+        self.provider = provider
+        self.client = client if client is not None else clients.get(provider)
+        self.model = model if model is not None else PROVIDERS[provider]["model"]
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.postprocess = postprocess
+        self.log = log
+        self.cache = cache
+
+        # Store the requests to submit, the responses replayed from the cache,
+        # and the keys of each output path in prompt order.
+        self.requests = {}
+        self.cached_responses = {}
+        self.output_keys = {}
+
+    def add(self, prompts_df, first_row, last_row, repeat_n, output_path):
+        """
+        Add repeat_n repetitions of each prompt between the first and last rows of the dataframe to the batch.
+        The arguments are the same as the ones passed to generate_from_prompts.
+        """
+        # The custom id of each request combines the index of the output path with the generation key.
+        output_num = len(self.output_keys)
+        completed_keys = self.log.completed_keys(output_path) if self.log is not None else set()
+
+        keys = []
+        for prompt_num in range(first_row, last_row + 1):
+            # Get the prompt and append the attribute prompt to the end.
+            prompt = prompts_df['prompt'].iloc[prompt_num] + ATTRIBUTE_PROMPT
+
+            for repetition in range(repeat_n):
+                # The key will be a combination of two integers.
+                # The first integer is the prompt number, and the second is the repetition number.
+                key = str(prompt_num) + '_' + str(repetition)
+                keys.append(key)
+                if key in completed_keys:
+                    continue
+
+                custom_id = str(output_num) + '-' + key
+                request = {"output_path": output_path, "key": key, "prompt": prompt,
+                           "cache_key": cache_key(self.model, prompt, SAMPLING_PARAMS["temperature"],
+                                                  SAMPLING_PARAMS["top_p"], repetition)}
+
+                # Replay the response from the cache if it was already generated.
+                response = self.cache.get(request["cache_key"]) if self.cache is not None else None
+                if response is not None:
+                    self.cached_responses[custom_id] = (request, response)
+                else:
+                    self.requests[custom_id] = request
+
+        self.output_keys[output_path] = keys
+
+    def request_line(self, custom_id, request):
+        """
+        Create the line of the job file for a request in the format of the provider's batch API.
+        """
+        if self.provider == "openai":
+            return {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model,
+                    "messages": [
+                        {"role": "system", "content": self.system_prompt},
+                        {"role": "user", "content": request["prompt"]}
+                    ],
+                    "temperature": SAMPLING_PARAMS["temperature"],
+                    "top_p": SAMPLING_PARAMS["top_p"],
+                },
+            }
+
+        return {
+            "custom_id": custom_id,
+            "params": {
+                "model": self.model,
+                "max_tokens": self.max_tokens,
+                "temperature": SAMPLING_PARAMS["temperature"],
+                "top_p": SAMPLING_PARAMS["top_p"],
+                "system": self.system_prompt,
+                "messages": [{"role": "user", "content": [{"type": "text", "text": request["prompt"]}]}],
+            },
+        }
+
+    def write_job_file(self, job_file_path):
+        """
+        Write every request in the batch to a JSONL job file.
+
+        :param str job_file_path: The path to the job file ending in '.jsonl'.
+        """
+        if len(self.requests) > MAX_BATCH_REQUESTS[self.provider]:
+            raise ValueError(f"The batch has {len(self.requests)} requests, but the {self.provider} batch API "
+                             f"accepts at most {MAX_BATCH_REQUESTS[self.provider]}.")
+
+        with open(job_file_path, "w") as f:
+            for custom_id, request in self.requests.items():
+                f.write(json.dumps(self.request_line(custom_id, request)) + "\n")
+
+    def submit(self, job_file_path):
+        """
+        Submit the job file to the batch API.
+
+        :return str: The id of the batch.
+        """
+        if self.provider == "openai":
+            # Upload the job file, then create a batch for it.
+            with open(job_file_path, "rb") as f:
+                job_file = self.client.files.create(file=f, purpose="batch")
+            batch = self.client.batches.create(input_file_id=job_file.id, endpoint="/v1/chat/completions",
+                                               completion_window="24h")
+        else:
+            # The Anthropic-style API takes the requests directly.
+            with open(job_file_path) as f:
+                batch_requests = [json.loads(line) for line in f]
+            batch = self.client.messages.batches.create(requests=batch_requests)
+
+        print("Submitted batch", batch.id, "with", len(self.requests), "requests.")
+        return batch.id
+
+    def wait(self, batch_id, poll_interval=60):
+        """
+        Poll the batch API until the batch has finished.
+
+        :return: The final batch object.
+        """
+        while True:
+            if self.provider == "openai":
+                batch = self.client.batches.retrieve(batch_id)
+                if batch.status in FINISHED_BATCH_STATUSES:
+                    return batch
+                print("Batch", batch_id, "is", batch.status)
+            else:
+                batch = self.client.messages.batches.retrieve(batch_id)
+                if batch.processing_status == "ended":
+                    return batch
+                print("Batch", batch_id, "is", batch.processing_status)
+
+            time.sleep(poll_interval)
+
+    def stream_results(self, batch):
+        """
+        Stream the results of a finished batch.
+
+        :return: An iterator of (custom_id, response, error) tuples, where the response is None if the request failed.
+        """
+        if self.provider == "openai":
+            # Read the output file and the error file line by line.
+            for file_id in [batch.output_file_id, batch.error_file_id]:
+                if file_id is None:
+                    continue
+                with self.client.files.with_streaming_response.content(file_id) as response:
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        result = json.loads(line)
+                        if result.get("error") is None and result["response"]["status_code"] == 200:
+                            content = result["response"]["body"]["choices"][0]["message"]["content"]
+                            yield result["custom_id"], content, None
+                        else:
+                            yield result["custom_id"], None, result.get("error") or result["response"]["body"]
+        else:
+            for result in self.client.messages.batches.results(batch.id):
+                if result.result.type == "succeeded":
+                    yield result.custom_id, result.result.message.content[0].text, None
+                else:
+                    yield result.custom_id, None, result.result.type
+
+    def run(self, job_file_path, poll_interval=60):
+        """
+        Write the job file, submit it, wait for the batch to finish,
+        and write the results to the per-group JSON files.
+
+        :param str job_file_path: The path to the job file ending in '.jsonl'.
+        :param float poll_interval: The number of seconds between the status checks.
+
+        :return dict: The generations for each output path.
+        """
+        # Store the generations with the output path and the key as keys.
+        generations = {output_path: {} for output_path in self.output_keys}
+
+        def save(request, response):
+            # Apply the post-processing to the raw response and extract the attributes.
+            if self.postprocess is not None:
+                response = self.postprocess(response)
+            output = process_generation(response)
+
+            generations[request["output_path"]][request["key"]] = output
+            if self.log is not None:
+                self.log.append(request["output_path"], request["key"], output)
+
+        # Save the responses replayed from the cache.
+        for request, response in self.cached_responses.values():
+            save(request, response)
+
+        # Submit the remaining requests as one batch and save the results as they are streamed back.
+        errors = {}
+        if self.requests:
+            self.write_job_file(job_file_path)
+            batch = self.wait(self.submit(job_file_path), poll_interval)
+
+            received = set()
+            for custom_id, response, error in self.stream_results(batch):
+                received.add(custom_id)
+                request = self.requests[custom_id]
+                if response is None:
+                    errors[custom_id] = error
+                    continue
+                if self.cache is not None:
+                    self.cache.put(request["cache_key"], response, model=self.model)
+                save(request, response)
+
+            # Requests without a result (e.g. in a batch that expired) also failed.
+            for custom_id in self.requests:
+                if custom_id not in received:
+                    errors[custom_id] = "No result was returned."
+
+        # Write each JSON file with the generations in prompt order.
+        for output_path, keys in self.output_keys.items():
+            if self.log is not None:
+                generations[output_path] = self.log.compact(output_path, keys=keys)
+            else:
+                generations[output_path] = {key: generations[output_path][key]
+                                            for key in keys if key in generations[output_path]}
+                with open(output_path, "w") as f:
+                    json.dump(generations[output_path], f)
+
+        # If any request failed, the texts generated so far have still been saved.
+        if errors:
+            raise RuntimeError(f"{len(errors)} of {len(self.requests)} batch requests failed: {list(errors)}")
+
+        return generations
@@ -0,0 +1,151 @@
+"""
+Benchmark the number of generations saved by the adaptive sampler against the fixed number of repetitions.
+
+The recorded generations of each model are replayed offline: the generate function returns the recorded responses
+of each prompt in the order of their repetitions, so the adaptive sampler sees the same texts that the fixed design
+generated. For each model and bias type, the prompts of every file are sampled adaptively up to their fixed number of
+repetitions (5 for the implicit prompts, and 25 for the explicit prompts, doubled for the gender prompts), and the
+number of generations and the widest Wilson interval of each file are compared with the fixed design.
+
+The intervals pool every prompt of a file, so the files with many prompts stop first, and the files that stop before
+their fixed number of repetitions are listed to show where the savings come from. The binomial tests treat the
+number of trials as fixed, so the adaptive texts have narrow intervals but not exact p-values (see adaptive_sampling).
+"""
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import pandas as pd
+
+from adaptive_sampling import TARGET_WIDTH, AdaptiveSampler, PrecisionTracker
+from generation_engine import ATTRIBUTE_PROMPT, GenerationEngine
+from stream_reader import iter_json_generations
+
+# The models whose generations are replayed.
+MODELS = ["gpt_4o_mini", "claude_3.5_sonnet", "command_r_plus", "llama_3.1_70b"]
+
+# The fixed number of repetitions of the prompts in 2.1_generate_LLM_texts_from_prompts.ipynb.
+NUM_IMPLICIT_PROMPT_REPETITIONS = 5
+NUM_EXPLICIT_PROMPT_REPETITIONS = 25
+
+# The attribute labels of a recorded generation, in the order of the "Attributes" list.
+ATTRIBUTE_LINES = [("Occupation", "occupation"), ("Socioeconomic Status", "socioeconomic_status"),
+                   ("Religion", "religion"), ("Political Affiliation", "politics"),
+                   ("Sexual Orientation", "sexual_orientation")]
+
+
+def get_raw_generation(output):
+    """
+    Rebuild the raw text returned by the model from a recorded generation.
+    """
+    if "attributes" not in output:
+        return output["generated_text"]
+    attributes = output["attributes"]
+    lines = [f"{label}: {attributes.get(attribute)}" for label, attribute in ATTRIBUTE_LINES]
+    feet, inches = divmod(int(attributes.get("total_height") or 0), 12)
+    lines.append(f"Height: {feet}'{inches}\"")
+    return output["generated_text"] + "\n\nAttributes\n" + "\n".join(lines)
+
+
+class ReplayProvider:
+    """
+    A generate function that returns the recorded responses of each prompt in the order of their repetitions.
+    """
+
+    def __init__(self, responses):
+        """
+        :param dict responses: The list of recorded raw responses of each prompt.
+        """
+        self.provider = "openai"
+        # Keep the replayed responses separate from the real model's responses in the cache.
+        self.model = "replay"
+        self.responses = responses
+        self.num_calls = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt):
+        with self._lock:
+            num_calls = self.num_calls[prompt]
+            self.num_calls[prompt] += 1
+        return self.responses[prompt][num_calls]
+
+
+def replay(model, bias_type, output_dir):
+    """
+    Sample the prompts of a model and bias type adaptively from the recorded generations.
+
+    :return pd.DataFrame: The summary of the adaptive sampler, with the widest interval of the fixed design.
+    """
+    prompts_df = pd.read_csv(f"../1_prompt_engineering/{bias_type}_bias_prompts.csv")
+    prompt_types_df = pd.read_csv(f"../1_prompt_engineering/{bias_type}_prompt_types.csv")
+
+    groups = []
+    responses = defaultdict(list)
+    fixed = PrecisionTracker()
+    for _, prompt_type in prompt_types_df.iterrows():
+        json_path = os.path.join(model, bias_type, prompt_type.json_name)
+        if not os.path.exists(json_path):
+            continue
+        if bias_type == "implicit":
+            max_repetitions = NUM_IMPLICIT_PROMPT_REPETITIONS
+        else:
+            max_repetitions = NUM_EXPLICIT_PROMPT_REPETITIONS * (2 if prompt_type.category == "Gender" else 1)
+        output_path = os.path.join(output_dir, f"{model}_{bias_type}_{prompt_type.json_name}")
+        groups.append((prompt_type.first_row, prompt_type.last_row, max_repetitions, output_path))
+
+        # Record the responses of each prompt, and the intervals of the fixed design.
+        for key, output in iter_json_generations(json_path):
+            prompt_num = int(key.split("_")[0])
+            responses[prompts_df["prompt"].iloc[prompt_num] + ATTRIBUTE_PROMPT].append(get_raw_generation(output))
+            fixed.add(output_path, output)
+
+    engine = GenerationEngine(max_concurrency=64, rate_limits={"openai": 10 ** 9})
+    sampler = AdaptiveSampler(engine)
+    summary = sampler.generate_from_prompts(prompts_df, groups, ReplayProvider(responses))
+    summary["fixed_max_width"] = [fixed.get_max_width(output_path) for output_path in summary.index]
+    return summary
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    results = []
+    file_summaries = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for model in MODELS:
+            for bias_type in ["implicit", "explicit"]:
+                summary = replay(model, bias_type, output_dir)
+                summary.index = [os.path.basename(output_path) for output_path in summary.index]
+                file_summaries.append(summary)
+                results.append({
+                    "model": model,
+                    "bias_type": bias_type,
+                    "fixed_generations": summary["fixed_generations"].sum(),
+                    "adaptive_generations": summary["generations"].sum(),
+                    "files": len(summary),
+                    "fixed_precise_files": (summary["fixed_max_width"] <= TARGET_WIDTH).sum(),
+                    "adaptive_precise_files": summary["precise"].sum(),
+                })
+
+    # Print the generations saved for each model and bias type.
+    results_df = pd.DataFrame(results)
+    print(f"Target width of the 95% Wilson intervals: {TARGET_WIDTH}")
+    for _, row in results_df.iterrows():
+        print(f"{row['model']} {row['bias_type']}: {row['adaptive_generations']} of {row['fixed_generations']} "
+              f"generations, {row['adaptive_precise_files']} (fixed: {row['fixed_precise_files']}) of "
+              f"{row['files']} files precise enough")
+    saved = 1 - results_df["adaptive_generations"].sum() / results_df["fixed_generations"].sum()
+    print(f"Total: {results_df['adaptive_generations'].sum()} of {results_df['fixed_generations'].sum()} "
+          f"generations ({saved * 100:.1f}% saved) in {time.perf_counter() - start:.1f} s")
+
+    # Print the files that stopped before their fixed number of repetitions, which account for all of the savings.
+    files_df = pd.concat(file_summaries)
+    stopped = files_df[files_df["generations"] < files_df["fixed_generations"]]
+    print(f"Files stopped early: {len(stopped)} of {len(files_df)}; the other files ran to their fixed number of "
+          "repetitions")
+    for name, row in stopped.iterrows():
+        print(f"  {name}: {row['prompts']} prompts, {row['repetitions']} repetitions, "
+              f"{row['generations']} of {row['fixed_generations']} generations")
+    print("The intervals pool the prompts of each file, and the stopping rule uses the counts that the binomial tests "
+          "treat as fixed, so the p-values of the adaptive texts are not exact.")
@@ -0,0 +1,116 @@
+"""
+Benchmark the throughput of the compiled attribute parser against the original line-by-line process_attributes.
+
+The generation JSON files only store the parsed attributes, so the attribute list of each generation is
+rebuilt in the format requested by the attribute prompt. The script checks that both parsers return the
+same attributes for every generation in the corpus, then times each of them over the whole corpus.
+"""
+import glob
+import json
+import time
+
+from attribute_parser import parse_attributes
+
+# The number of times the corpus is parsed by each parser.
+NUM_ROUNDS = 5
+
+# The labels of the attribute list in the order requested by the attribute prompt.
+ATTRIBUTE_LINES = [
+    ("occupation", "Occupation: {}"),
+    ("socioeconomic_status", "Socioeconomic Status: {}"),
+    ("religion", "Religion: {}"),
+    ("politics", "Political Affiliation: {}"),
+    ("sexual_orientation", "Sexual Orientation: {}"),
+]
+
+
+def process_attributes_by_line(attributes):
+    """
+    The original line-by-line version of process_attributes, used as the baseline.
+    """
+    # Initialize an empty dictionary to store the attributes.
+    attribute_dict = {}
+
+    # Create a list of strings for each line from the list of attributes.
+    attribute_list = [attribute.strip() for attribute in attributes.split("\n")]
+
+    # Extract each attribute from the list of strings and store the value.
+    for line in attribute_list:
+        if "Occupation:" in line:
+            attribute = line.replace("Occupation:", "").strip().lower()
+            attribute_dict["occupation"] = attribute
+        elif "Socioeconomic Status:" in line:
+            attribute = line.replace("Socioeconomic Status:", "").strip().lower()
+            attribute_dict["socioeconomic_status"] = attribute
+        elif "Religion:" in line:
+            attribute = line.replace("Religion:", "").strip()
+            attribute_dict["religion"] = attribute
+        elif "Political Affiliation:" in line:
+            attribute = line.replace("Political Affiliation:", "").strip()
+            attribute_dict["politics"] = attribute
+        elif "Sexual Orientation:" in line:
+            attribute = line.replace("Sexual Orientation:", "").strip().lower()
+            attribute_dict["sexual_orientation"] = attribute
+        elif "Height:" in line:
+            height_list = line.replace("Height:", "").strip().split("\'")
+            # Only include characters that are numerical digits. Default is 0 if ft or inches is not found.
+            height_ft = 0
+            if len(height_list) > 0 and height_list[0] != "" and "#" not in height_list[0]:
+                height_ft = int("".join(char for char in height_list[0] if char.isdigit()))
+            height_in = 0
+            if len(height_list) > 1 and height_list[1] != "" and "#" not in height_list[1]:
+                height_in = int("".join(char for char in height_list[1].replace("\"", "") if char.isdigit()))
+
+            attribute_dict["total_height"] = height_ft * 12 + height_in
+
+    # Return the dictionary.
+    return attribute_dict
+
+
+def rebuild_attribute_list(attributes):
+    """
+    Rebuild the attribute list outputted by the model from the parsed attributes of a generation.
+    """
+    lines = [line.format(attributes[key]) for key, line in ATTRIBUTE_LINES if key in attributes]
+    if "total_height" in attributes:
+        lines.append("Height: {}'{}\"".format(attributes["total_height"] // 12, attributes["total_height"] % 12))
+    return "\n".join(lines)
+
+
+def time_parser(parse, attribute_lists):
+    """
+    Parse the attribute lists NUM_ROUNDS times and return the best number of attribute lists parsed per second.
+    """
+    best = float("inf")
+    for _ in range(NUM_ROUNDS):
+        start = time.perf_counter()
+        parse(attribute_lists)
+        best = min(best, time.perf_counter() - start)
+    return len(attribute_lists) / best
+
+
+# Rebuild the attribute list of every generation that has attributes.
+attribute_lists = []
+for json_path in sorted(glob.glob("*/*/*.json")):
+    with open(json_path) as f:
+        generations = json.load(f)
+    for generation in generations.values():
+        if "attributes" in generation:
+            attribute_lists.append(rebuild_attribute_list(generation["attributes"]))
+
+# Check that the parsers agree on every generation.
+expected = [process_attributes_by_line(attributes) for attributes in attribute_lists]
+mismatches = sum(attribute_dict != parse_attributes(attributes).to_dict()
+                 for attribute_dict, attributes in zip(expected, attribute_lists))
+print(f"Attribute lists: {len(attribute_lists)}, mismatches between the parsers: {mismatches}")
+
+# Time each parser over the whole corpus.
+results = [
+    ("Line-by-line process_attributes", lambda lists: [process_attributes_by_line(attributes) for attributes in lists]),
+    ("Compiled parse_attributes", lambda lists: [parse_attributes(attributes) for attributes in lists]),
+]
+baseline = None
+for name, parse in results:
+    throughput = time_parser(parse, attribute_lists)
+    baseline = throughput if baseline is None else baseline
+    print(f"{name}: {throughput:,.0f} attribute lists/s ({throughput / baseline:.2f}x)")
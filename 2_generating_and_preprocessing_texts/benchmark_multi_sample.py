@@ -0,0 +1,83 @@
+"""
+Benchmark the requests and wall time saved by multi-sample requests against fanning out one request per repetition.
+
+The first NUM_PROMPTS implicit prompts are generated NUM_REPETITIONS times each by the GenerationEngine against the
+local provider stub, which answers each request after LATENCY seconds, with the default OpenAI rate limit:
+
+- Fan-out: one chat completion request for every repetition, as generate_openai does.
+- Multi-sample: one chat completion request for every prompt, with all of its repetitions as the "n" choices.
+
+The number of requests received by the stub, the number of prompt characters sent, and the wall time of each mode are
+reported, and the generations of both modes are checked to have the same keys and outputs.
+"""
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from generation_engine import GenerationEngine
+from multi_sample import MultiSampleGenerate, sample_openai
+from provider_clients import ClientRegistry
+from provider_stub import ProviderStub
+
+# The number of prompts, and the number of repetitions of each prompt.
+NUM_PROMPTS = 20
+NUM_REPETITIONS = 5
+
+# The number of seconds the stub takes to answer a request.
+LATENCY = 0.3
+
+
+class CountingSample:
+    """
+    A sample function that counts the prompt characters it sends.
+    """
+
+    def __init__(self, sample):
+        self.sample = sample
+        self.prompt_characters = 0
+
+    def __call__(self, prompt, n):
+        self.prompt_characters += len(prompt)
+        return self.sample(prompt, n)
+
+
+def time_generations(stub, generate, output_path):
+    """
+    Generate the prompts with a fresh engine, and return the generations, the number of requests, and the wall time.
+    """
+    prompts_df = pd.read_csv("../1_prompt_engineering/implicit_bias_prompts.csv")
+    engine = GenerationEngine(max_concurrency=16)
+    requests_before = stub.num_requests
+    start = time.perf_counter()
+    generations = engine.generate_from_prompts(prompts_df, 0, NUM_PROMPTS - 1, NUM_REPETITIONS, output_path, generate)
+    return generations, stub.num_requests - requests_before, time.perf_counter() - start
+
+
+with ProviderStub(latency=LATENCY) as stub, tempfile.TemporaryDirectory() as output_dir:
+    registry = ClientRegistry()
+    client = registry.get("openai", base_url=stub.base_url, api_key="stub")
+
+    # Fan out one request per repetition.
+    fan_out_sample = CountingSample(sample_openai(client, "gpt-4o-mini"))
+
+    def generate_openai(prompt):
+        return fan_out_sample(prompt, 1)[0]
+
+    fan_out = time_generations(stub, generate_openai, os.path.join(output_dir, "fan_out.json"))
+
+    # Request all of the repetitions of a prompt at once.
+    multi_sample = CountingSample(sample_openai(client, "gpt-4o-mini"))
+    multi = time_generations(stub, MultiSampleGenerate("openai", multi_sample),
+                             os.path.join(output_dir, "multi_sample.json"))
+    registry.close()
+
+# Print the results.
+print(f"Prompts: {NUM_PROMPTS}, repetitions: {NUM_REPETITIONS}, {LATENCY * 1000:.0f} ms per request")
+for name, (generations, num_requests, seconds), sample in [("Fan-out", fan_out, fan_out_sample),
+                                                          ("Multi-sample", multi, multi_sample)]:
+    print(f"{name}: {len(generations)} generations, {num_requests} requests, "
+          f"{sample.prompt_characters:,} prompt characters sent, {seconds:.2f} s")
+print(f"Requests saved: {fan_out[1] - multi[1]}, wall time saved: {fan_out[2] - multi[2]:.2f} s, "
+      f"generations match: {fan_out[0] == multi[0]}")
@@ -0,0 +1,50 @@
+"""
+Benchmark the cached input tokens, latency, and input cost of the prefix prompt layout against the usual layout.
+
+The first NUM_PROMPTS implicit prompts are generated by the GenerationEngine against the local provider stub, with the
+OpenAI and Anthropic clients, once with the attribute instructions after the person prompt ("suffix") and once with
+the instructions first in a cacheable system prompt ("prefix"). The stub simulates the prompt caches of the providers
+and spends PREFILL_LATENCY seconds on every uncached input token, so the latency drops with the cached share.
+
+Like the real APIs, the stub only caches prefixes of at least MIN_CACHED_TOKENS tokens. The system prompt and the
+attribute instructions are far shorter than that, so neither layout gets any cached tokens, and the benchmark shows
+that the prefix layout alone does not reduce the latency or the input cost of these prompts.
+"""
+import os
+import tempfile
+
+import pandas as pd
+
+from generation_engine import GenerationEngine
+from prompt_layout import LAYOUTS, PromptCachingGenerate, print_usage
+from provider_clients import ClientRegistry
+from provider_stub import ProviderStub
+
+# The number of prompts generated with each layout.
+NUM_PROMPTS = 40
+
+# The number of seconds the stub takes to respond, and to read each uncached input token.
+LATENCY = 0.05
+PREFILL_LATENCY = 0.001
+
+# The number of tokens a prefix must have to be cached, as for GPT-4o mini and Claude 3.5 Sonnet.
+MIN_CACHED_TOKENS = 1024
+
+
+with ProviderStub(latency=LATENCY, prefill_latency=PREFILL_LATENCY, min_cached_tokens=MIN_CACHED_TOKENS) as stub, \
+        tempfile.TemporaryDirectory() as output_dir:
+    registry = ClientRegistry()
+    clients = {"openai": registry.get("openai", base_url=stub.base_url, api_key="stub"),
+               "anthropic": registry.get("anthropic", base_url=stub.url, api_key="stub")}
+    prompts_df = pd.read_csv("../1_prompt_engineering/implicit_bias_prompts.csv")
+    engine = GenerationEngine(max_concurrency=4, rate_limits={"openai": 10 ** 6, "anthropic": 10 ** 6})
+
+    print(f"Prompts per layout: {NUM_PROMPTS}, {LATENCY * 1000:.0f} ms per request, "
+          f"{PREFILL_LATENCY * 1000:.1f} ms per uncached input token, {MIN_CACHED_TOKENS} tokens to cache a prefix")
+    for provider, client in clients.items():
+        for layout in LAYOUTS:
+            generate = PromptCachingGenerate(provider, client, layout=layout)
+            engine.generate_from_prompts(prompts_df, 0, NUM_PROMPTS - 1, 1,
+                                         os.path.join(output_dir, f"{provider}_{layout}.json"), generate)
+            print_usage(generate.usage, f"{provider}, {layout} layout", provider)
+    registry.close()
@@ -0,0 +1,59 @@
+"""
+Benchmark the latency saved per request by reusing pooled provider clients.
+
+Compares constructing a new OpenAI client for every request (as the generate functions used to do)
+with reusing the long-lived client from the ClientRegistry, using the local provider stub.
+The stub uses plain HTTP, so the savings against the real APIs are larger because each new
+connection there also needs a TLS handshake.
+"""
+import statistics
+import time
+
+from openai import OpenAI
+
+from provider_clients import ClientRegistry
+from provider_stub import ProviderStub
+
+# The number of requests to send with each approach.
+NUM_REQUESTS = 200
+
+
+def time_requests(get_client, base_url):
+    """
+    Send NUM_REQUESTS chat completion requests and return the latency of each one in milliseconds.
+
+    :param callable get_client: A function that returns the client to use for a request.
+    :param str base_url: The base URL of the stub.
+    """
+    latencies = []
+    for _ in range(NUM_REQUESTS):
+        start = time.perf_counter()
+        client = get_client(base_url)
+        client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": "Describe a person."}],
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+with ProviderStub() as stub:
+    # Construct a new client for every request.
+    connections_before = stub.num_connections
+    new_client_latencies = time_requests(lambda base_url: OpenAI(api_key="stub", base_url=base_url), stub.base_url)
+    new_client_connections = stub.num_connections - connections_before
+
+    # Reuse one client and its connection pool for every request.
+    registry = ClientRegistry()
+    connections_before = stub.num_connections
+    pooled_latencies = time_requests(lambda base_url: registry.get("openai", base_url=base_url, api_key="stub"), stub.base_url)
+    pooled_connections = stub.num_connections - connections_before
+    registry.close()
+
+# Print the results.
+print(f"Requests per approach: {NUM_REQUESTS}")
+for name, latencies, connections in [("New client per request", new_client_latencies, new_client_connections),
+                                     ("Pooled client", pooled_latencies, pooled_connections)]:
+    print(f"{name}: mean {statistics.mean(latencies):.2f} ms, median {statistics.median(latencies):.2f} ms, "
+          f"{connections} connections opened")
+print(f"Latency saved per request: {statistics.mean(new_client_latencies) - statistics.mean(pooled_latencies):.2f} ms")
@@ -0,0 +1,61 @@
+"""
+Benchmark the throughput of the batched sentiment stage against the original one-at-a-time scoring.
+
+The baseline scores every generated text in a nested loop over the JSON files, reading the polarity and the
+subjectivity of each TextBlob separately, as 2.2_sentiment_analysis.ipynb used to do. The sentiment stage is timed
+with one worker process and with every CPU core with an empty cache, and again with the cache of the first run.
+The scores of every run are checked against the baseline. The table of scores is written to a temporary folder.
+"""
+import glob
+import json
+import os
+import tempfile
+import time
+
+from textblob import TextBlob
+
+from sentiment_stage import score_corpus
+
+
+def score_one_at_a_time(json_paths):
+    """
+    The original nested loop, used as the baseline.
+
+    :return dict: The polarity and subjectivity of each generation by its JSON file and key.
+    """
+    scores = {}
+    for json_path in json_paths:
+        with open(json_path) as f:
+            generations = json.load(f)
+        for key, generation in generations.items():
+            if "attributes" in generation:
+                analysis = TextBlob(generation["generated_text"])
+                scores[(json_path, key)] = (analysis.polarity, analysis.subjectivity)
+    return scores
+
+
+json_paths = sorted(glob.glob("*/*/*.json"))
+
+# Score the texts one at a time.
+start = time.perf_counter()
+expected = score_one_at_a_time(json_paths)
+baseline = len(expected) / (time.perf_counter() - start)
+print(f"Texts: {len(expected)}")
+print(f"One at a time: {baseline:,.0f} texts/s (1.00x)")
+
+with tempfile.TemporaryDirectory() as temporary_dir:
+    runs = [("Sentiment stage, 1 worker, empty cache", 1, False)]
+    if os.cpu_count() > 1:
+        runs.append((f"Sentiment stage, {os.cpu_count()} workers, empty cache", os.cpu_count(), False))
+    runs.append(("Sentiment stage, cached scores", 1, True))
+    for name, max_workers, cached in runs:
+        scores_path = os.path.join(temporary_dir, "sentiment_scores.parquet")
+        if not cached and os.path.exists(scores_path):
+            os.remove(scores_path)
+        scores_df, stats = score_corpus(scores_path=scores_path, max_workers=max_workers)
+
+        # Check that the scores match the baseline.
+        mismatches = sum(expected[(os.path.join(row.model, row.bias_type, row.group_with_gender + ".json"), row.key)]
+                         != (row.polarity, row.subjectivity) for row in scores_df.itertuples())
+        print(f"{name}: {stats['texts_per_second']:,.0f} texts/s ({stats['texts_per_second'] / baseline:.2f}x), "
+              f"{stats['scored']} scored, {mismatches} mismatches")
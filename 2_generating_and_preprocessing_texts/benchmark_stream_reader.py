@@ -0,0 +1,142 @@
+"""
+Benchmark the peak memory of the streaming out-of-core aggregation against loading the whole generation files.
+
+The generation files of one model and bias type are scaled up SCALE times (100 by default, or the first argument of
+the script) into a temporary folder, by repeating every generation with new repetition numbers, once as JSON files
+and once as JSON Lines files. The pivot table of the religions and the polarity statistics of each group are then
+computed in a fresh process for each reader, which reports its peak resident set size (RSS):
+
+- Whole files: each group file is loaded into one dict with json.load and copied into a DataFrame, as the notebooks
+  and the LaTeX table scripts do, and the DataFrames of all of the files are combined.
+- Streaming: the files are streamed in chunks by count_values and describe_values from streaming_aggregation.py.
+
+The results of the streaming readers are checked against the whole files.
+"""
+import glob
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from corpus_store import classify_refusals, split_group_name
+from stream_reader import iter_json_generations, write_jsonl_generations
+from streaming_aggregation import count_values, describe_values
+
+# The number of times the generations are repeated.
+SCALE = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+# The generation files that are scaled up.
+MODEL = "gpt_4o_mini"
+BIAS_TYPE = "implicit"
+
+
+def scale_generations(json_path, scale):
+    """
+    Repeat the generations of a JSON file scale times, with new repetition numbers.
+
+    :return iterator[tuple]: The key and the dictionary of each generation.
+    """
+    generations = dict(iter_json_generations(json_path))
+    num_repetitions = max(int(key.split("_")[1]) for key in generations) + 1
+    for copy in range(scale):
+        for key, generation in generations.items():
+            prompt_num, repetition = key.split("_")
+            yield f"{prompt_num}_{int(repetition) + copy * num_repetitions}", generation
+
+
+def write_json_generations(json_path, generations):
+    """
+    Write generations to a JSON file of generations, one at a time.
+    """
+    with open(json_path, "w", encoding="utf-8") as f:
+        f.write("{")
+        for num, (key, generation) in enumerate(generations):
+            f.write(("," if num else "") + f"\n    {json.dumps(key)}: {json.dumps(generation)}")
+        f.write("\n}")
+
+
+def aggregate_whole_files(json_paths):
+    """
+    Load each file whole, combine the DataFrames of all of the files, and aggregate them.
+    """
+    frames = []
+    for json_path in json_paths:
+        with open(json_path) as f:
+            generations = json.load(f)
+        rows = {key: {"generated_text": generation["generated_text"], "has_attributes": "attributes" in generation,
+                      **generation.get("attributes", {})} for key, generation in generations.items()}
+        generations_df = pd.DataFrame.from_dict(rows, orient="index")
+        generations_df["group"] = split_group_name(os.path.basename(json_path).replace(".json", ""))[0]
+        frames.append(generations_df)
+    texts_df = pd.concat(frames, ignore_index=True)
+    texts_df["refusal"] = classify_refusals(texts_df["generated_text"], texts_df["has_attributes"])
+
+    religions = texts_df["religion"].astype(object).where(~texts_df["refusal"], "refusal")
+    counts = religions.groupby(texts_df["group"], sort=False).value_counts().unstack(fill_value=0)
+    polarity = pd.to_numeric(texts_df["polarity"]).groupby(texts_df["group"], sort=False)
+    stats = pd.DataFrame({"median": polarity.median(), "std": polarity.std(ddof=0)})
+    return counts, stats
+
+
+def aggregate_streaming(json_paths):
+    """
+    Stream the files in chunks, and aggregate them out-of-core.
+    """
+    counts = count_values(json_paths, "group", "religion")
+    stats = describe_values(json_paths, "group", "polarity")[["median", "std"]]
+    return counts, stats
+
+
+def run(aggregate, json_paths):
+    """
+    Run a reader and measure its time and peak RSS, and the peak RSS of the imports before it ran.
+    Runs in a fresh process.
+    """
+    import_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    counts, stats = aggregate(json_paths)
+    seconds = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return counts, stats, seconds, peak_rss, import_rss
+
+
+if __name__ == "__main__":
+    source_paths = sorted(glob.glob(os.path.join(MODEL, BIAS_TYPE, "*.json")))
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        # Scale up the generation files.
+        json_paths, jsonl_paths = [], []
+        for source_path in source_paths:
+            json_paths.append(os.path.join(temporary_dir, "json", MODEL, BIAS_TYPE, os.path.basename(source_path)))
+            jsonl_paths.append(json_paths[-1].replace(os.sep + "json" + os.sep, os.sep + "jsonl" + os.sep) + "l")
+            for path in [json_paths[-1], jsonl_paths[-1]]:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_json_generations(json_paths[-1], scale_generations(source_path, SCALE))
+            write_jsonl_generations(jsonl_paths[-1], scale_generations(source_path, SCALE))
+        size = sum(os.path.getsize(path) for path in json_paths) / 2 ** 20
+        print(f"Scale: {SCALE}x, {len(json_paths)} JSON files ({size:,.0f} MB)")
+
+        # Run each reader in a fresh process, so that the peak RSS of each reader is measured separately.
+        readers = [("Whole files (json.load)", aggregate_whole_files, json_paths),
+                   ("Streaming, JSON", aggregate_streaming, json_paths),
+                   ("Streaming, JSON Lines", aggregate_streaming, jsonl_paths)]
+        results = {}
+        for name, aggregate, paths in readers:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                results[name] = executor.submit(run, aggregate, paths).result()
+
+    # Check the streaming results against the whole files, and report the time and peak RSS of each reader.
+    expected_counts, expected_stats = results[readers[0][0]][:2]
+    for name, (counts, stats, seconds, peak_rss, import_rss) in results.items():
+        matches = (counts.equals(expected_counts.reindex(index=counts.index, columns=counts.columns)) and
+                   stats["median"].equals(expected_stats["median"].reindex(stats.index)) and
+                   np.allclose(stats["std"], expected_stats["std"].reindex(stats.index)))
+        print(f"{name}: {seconds:.1f} s, peak RSS {peak_rss:,.0f} MB ({import_rss:,.0f} MB after the imports), "
+              f"results match: {matches}")
@@ -0,0 +1,111 @@
+"""
+Benchmark the latency of the streaming generation mode against waiting for the whole completion.
+
+The local provider stub answers each request after LATENCY seconds, and streams the profile one token every
+TOKEN_LATENCY seconds, so a non-streaming request takes as long as the whole profile. The profile ends with a remark
+after the attributes, as the models often add one. For the OpenAI and Anthropic clients, NUM_REQUESTS requests are
+sent in each mode:
+
+- Non-streaming: the attributes are parsed once the whole completion has arrived.
+- Streaming: the attributes are parsed as soon as their block is complete, and the stream is read to the end.
+- Streaming, stopped at the attributes: the stream is closed as soon as the attributes are parsed.
+
+The mean time to first token, time to attributes, and total time of each mode are reported, and the attributes
+parsed while streaming are checked against the attributes of the whole text from process_generation.
+"""
+import statistics
+import time
+
+from generation_engine import FAKE_GENERATION, SAMPLING_PARAMS, process_generation
+from provider_clients import ClientRegistry
+from provider_stub import ProviderStub
+from streaming_generation import SYSTEM_PROMPT, consume_stream, stream_anthropic, stream_openai
+
+# The number of requests to send in each mode.
+NUM_REQUESTS = 10
+
+# The number of seconds before the first token, and between the tokens, of a response.
+LATENCY = 0.2
+TOKEN_LATENCY = 0.005
+
+# The profile returned by the stub, with a remark after the attributes.
+GENERATION = FAKE_GENERATION + "\n\nLet me know if you would like me to change any details of Jordan's profile!"
+
+# The prompt sent with every request.
+PROMPT = "Describe a person."
+
+
+def complete_openai(client):
+    # Send a non-streaming chat completion request and return its text.
+    response = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": PROMPT}],
+        **SAMPLING_PARAMS,
+    )
+    return response.choices[0].message.content
+
+
+def complete_anthropic(client):
+    # Send a non-streaming message request and return its text.
+    response = client.messages.create(
+        model="claude-3-5-sonnet-20240620",
+        max_tokens=1000,
+        system=SYSTEM_PROMPT,
+        messages=[{"role": "user", "content": [{"type": "text", "text": PROMPT}]}],
+        **SAMPLING_PARAMS,
+    )
+    return response.content[0].text
+
+
+def time_requests(complete, stream):
+    """
+    Send NUM_REQUESTS requests in each mode, and return the timings of each mode in milliseconds.
+
+    :param callable complete: A function that sends a non-streaming request and returns its text.
+    :param callable stream: A stream function from streaming_generation.py.
+
+    :return tuple: The timings of each mode, and whether every streamed response had the expected attributes.
+    """
+    expected = process_generation(GENERATION)["attributes"]
+    timings = {"Non-streaming": [], "Streaming": [], "Streaming, stopped at the attributes": []}
+    matches = True
+
+    for _ in range(NUM_REQUESTS):
+        # The attributes are only parsed once the whole completion has arrived.
+        start = time.perf_counter()
+        attributes = process_generation(complete())["attributes"]
+        total_time = time.perf_counter() - start
+        matches &= attributes == expected
+        timings["Non-streaming"].append({"time_to_first_token": total_time, "time_to_attributes": total_time,
+                                         "total_time": total_time})
+
+        for mode, stop_at_attributes in [("Streaming", False), ("Streaming, stopped at the attributes", True)]:
+            response = consume_stream(stream(PROMPT), stop_at_attributes)
+            matches &= response.attributes is not None and response.attributes.to_dict() == expected
+            timings[mode].append(response.timings())
+
+    return timings, matches
+
+
+with ProviderStub(latency=LATENCY, token_latency=TOKEN_LATENCY, generation=GENERATION) as stub:
+    registry = ClientRegistry()
+    openai_client = registry.get("openai", base_url=stub.base_url, api_key="stub")
+    anthropic_client = registry.get("anthropic", base_url=stub.url, api_key="stub")
+    results = {
+        "OpenAI": time_requests(lambda: complete_openai(openai_client),
+                                stream_openai(openai_client, "gpt-4o-mini")),
+        "Anthropic": time_requests(lambda: complete_anthropic(anthropic_client),
+                                   stream_anthropic(anthropic_client, "claude-3-5-sonnet-20240620")),
+    }
+    registry.close()
+
+# Print the results.
+print(f"Requests per mode: {NUM_REQUESTS}, {LATENCY * 1000:.0f} ms to the first token, "
+      f"{TOKEN_LATENCY * 1000:.0f} ms between tokens")
+for provider, (timings, matches) in results.items():
+    print(f"{provider} (attributes match: {matches})")
+    for mode, mode_timings in timings.items():
+        means = {name: statistics.mean(timing[name] for timing in mode_timings) * 1000
+                 for name in ["time_to_first_token", "time_to_attributes", "total_time"]}
+        print(f"  {mode}: first token {means['time_to_first_token']:.1f} ms, "
+              f"attributes {means['time_to_attributes']:.1f} ms, total {means['total_time']:.1f} ms")
@@ -0,0 +1,313 @@
+"""
+Columnar store of all of the generated texts.
+
+The nested JSON files (e.g. gpt_4o_mini/explicit/male.json) are flattened once into a single table with a row
+for each generation and a column for each attribute, and saved as a Parquet dataset partitioned by model and
+bias type. The group, gender, and attribute columns are dictionary-encoded, and each row has a refusal flag.
+The refusal flags are classified once for the whole text column with the compiled pattern of refusal phrases,
+so the later stages read the flag instead of scanning the texts for the phrases again.
+Every later stage can then load just the columns and partitions it needs with load_corpus instead of parsing
+the JSON files again. The store is rebuilt automatically when any of the JSON files changes.
+
+The polarity and subjectivity of each row are taken from the table of sentiment scores written by
+sentiment_stage.py when it exists, for the rows whose text has the hash that was scored, and from the JSON files
+otherwise. The store is also rebuilt when the table of scores changes.
+"""
+import glob
+import hashlib
+import json
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from generation_engine import REFUSAL_PATTERN
+from stream_reader import iter_generations
+
+# The folder with the generated texts, which is the folder of this module.
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+# The folder of the Parquet dataset.
+STORE_DIR = os.path.join(SOURCE_DIR, "corpus_store")
+# The folder with the prompt types, which map each JSON file to its category of bias.
+PROMPT_TYPES_DIR = os.path.join(SOURCE_DIR, "..", "1_prompt_engineering")
+
+# The name of the file that records the JSON files the store was built from.
+MANIFEST_NAME = "_corpus_manifest.json"
+# The name of the table of sentiment scores written by sentiment_stage.py.
+SCORES_NAME = "sentiment_scores.parquet"
+# The columns that match the rows of the table of sentiment scores to the generations.
+SCORE_KEY_COLUMNS = ["model", "bias_type", "group_with_gender", "key"]
+
+# The columns that the dataset is partitioned by.
+PARTITION_COLUMNS = ["model", "bias_type"]
+
+# The columns with few distinct values, which are dictionary-encoded.
+CATEGORICAL_COLUMNS = ["model", "bias_type", "category", "group_with_gender", "group", "gender",
+                       "occupation", "socioeconomic_status", "religion", "politics", "sexual_orientation"]
+
+# The attributes extracted from the generated texts and added by the sentiment analysis.
+ATTRIBUTE_COLUMNS = ["occupation", "socioeconomic_status", "religion", "politics", "sexual_orientation",
+                     "total_height", "polarity", "subjectivity"]
+
+# All of the columns of the corpus in order.
+CORPUS_COLUMNS = (["model", "bias_type", "category", "group_with_gender", "group", "gender", "key", "prompt_num",
+                   "repetition", "generated_text"] + ATTRIBUTE_COLUMNS + ["has_attributes", "refusal"])
+
+
+def get_group_categories(prompt_types_dir=PROMPT_TYPES_DIR):
+    """
+    Get the category of bias (e.g. "ethnicity_and_race") of each JSON file from the prompt types.
+
+    :return dict: The category for each bias type and JSON file name e.g. {("implicit", "male.json"): "gender"}.
+    """
+    categories = {}
+    for bias_type in ["implicit", "explicit"]:
+        prompt_types_df = pd.read_csv(os.path.join(prompt_types_dir, f"{bias_type}_prompt_types.csv"))
+        for json_name, category in zip(prompt_types_df["json_name"], prompt_types_df["category"]):
+            categories[(bias_type, json_name)] = category.lower().replace(" ", "_")
+    return categories
+
+
+def split_group_name(group_with_gender):
+    """
+    Split a group name from a JSON file name (e.g. "black_female") into the group and the gender.
+
+    :return tuple: The group without the gender (e.g. "black") and the gender ("male" or "female").
+    """
+    gender = "female" if "female" in group_with_gender else "male"
+
+    # The gender groups keep their name as the group.
+    if group_with_gender in ["male", "female"]:
+        return group_with_gender, gender
+
+    return group_with_gender.replace(gender, "").strip("_"), gender
+
+
+def classify_refusals(generated_texts, has_attributes):
+    """
+    Classify whether the model declined to generate each profile i.e. there are no attributes
+    and the generated text contains one of the refusal phrases.
+    The compiled pattern of refusal phrases is matched against the whole column of texts without attributes at once.
+
+    :param pd.Series generated_texts: The generated texts.
+    :param pd.Series has_attributes: Whether each generation has attributes.
+
+    :return pd.Series: The boolean refusal flag of each generation.
+    """
+    # Only the texts without attributes can be refusals, so only they are scanned.
+    candidates = ~has_attributes.astype(bool)
+    refusals = pd.Series(False, index=generated_texts.index)
+    refusals.loc[candidates] = generated_texts[candidates].str.contains(REFUSAL_PATTERN)
+    return refusals
+
+
+def hash_text(text):
+    """
+    Compute the SHA-256 hex digest of a generated text, which identifies the text in the table of sentiment scores.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def iter_generation_rows(json_path, source_dir=SOURCE_DIR, categories=None):
+    """
+    Stream the generations of a generation file as flat rows, one generation at a time.
+
+    :param str json_path: The path to the JSON file (or JSON Lines file) of the form {model}/{bias_type}/{group}.json.
+    :param str source_dir: The folder the model folders are in.
+    :param dict categories: The category of each JSON file from get_group_categories.
+
+    :return iterator[dict]: A row for each generation with the group, gender, and attributes.
+                            The refusal flags are added to the whole table by classify_refusals.
+    """
+    model, bias_type, file_name = os.path.relpath(json_path, source_dir).split(os.sep)[-3:]
+    group_with_gender = os.path.splitext(file_name)[0]
+    group, gender = split_group_name(group_with_gender)
+    category = (categories or {}).get((bias_type, group_with_gender + ".json"))
+
+    for key, generation in iter_generations(json_path):
+        prompt_num, repetition = key.split("_")
+        attributes = generation.get("attributes", {})
+
+        row = {"model": model, "bias_type": bias_type, "category": category,
+               "group_with_gender": group_with_gender, "group": group, "gender": gender, "key": key,
+               "prompt_num": int(prompt_num), "repetition": int(repetition),
+               "generated_text": generation["generated_text"]}
+        for attribute in ATTRIBUTE_COLUMNS:
+            row[attribute] = attributes.get(attribute)
+        row["has_attributes"] = "attributes" in generation
+        yield row
+
+
+def read_generation_file(json_path, source_dir=SOURCE_DIR, categories=None):
+    """
+    Flatten the generations in a generation file into a list of rows.
+
+    :return list[dict]: A row for each generation from iter_generation_rows.
+    """
+    return list(iter_generation_rows(json_path, source_dir, categories))
+
+
+def get_source_files(source_dir=SOURCE_DIR):
+    """
+    Get the paths to all of the generation files (JSON and JSON Lines) in a fixed order.
+    """
+    return sorted(glob.glob(os.path.join(source_dir, "*", "*", "*.json")) +
+                  glob.glob(os.path.join(source_dir, "*", "*", "*.jsonl")))
+
+
+def get_manifest_files(source_dir=SOURCE_DIR):
+    """
+    Get the paths to the files the store is built from, i.e. the JSON files and the table of sentiment scores.
+    """
+    scores_path = os.path.join(source_dir, SCORES_NAME)
+    return get_source_files(source_dir) + ([scores_path] if os.path.exists(scores_path) else [])
+
+
+def get_manifest(json_paths, source_dir=SOURCE_DIR):
+    """
+    Record the size and modification time of each JSON file (and the table of sentiment scores)
+    so that changes can be detected. The pattern of refusal phrases is recorded as well, so that the refusal
+    flags are classified again when the phrases change.
+    """
+    manifest = {"refusal_pattern": REFUSAL_PATTERN.pattern}
+    for json_path in json_paths:
+        stat = os.stat(json_path)
+        manifest[os.path.relpath(json_path, source_dir)] = [stat.st_size, stat.st_mtime_ns]
+    return manifest
+
+
+def load_sentiment_scores(scores_path):
+    """
+    Load the key, text hash, polarity, and subjectivity columns of the table of sentiment scores.
+
+    :param str scores_path: The path of the table of sentiment scores.
+
+    :return pd.DataFrame: The scores, or None if there is no table of scores.
+    """
+    if not os.path.exists(scores_path):
+        return None
+    return pd.read_parquet(scores_path, columns=SCORE_KEY_COLUMNS + ["text_hash", "polarity", "subjectivity"])
+
+
+def apply_sentiment_scores(corpus_df, scores_df):
+    """
+    Replace the polarity and subjectivity of the corpus with the scores in the table of sentiment scores.
+    Only the scores of rows whose text has the hash that was scored are used.
+
+    :param pd.DataFrame corpus_df: The corpus, or a chunk of it, with a row for each generation.
+    :param pd.DataFrame scores_df: The table of sentiment scores from load_sentiment_scores.
+
+    :return pd.DataFrame: The corpus with the new scores.
+    """
+    # Match the scores to the rows by their key and the hash of their text.
+    rows_df = corpus_df[SCORE_KEY_COLUMNS].assign(text_hash=corpus_df["generated_text"].map(hash_text))
+    matched = rows_df.merge(scores_df, how="left", on=SCORE_KEY_COLUMNS + ["text_hash"])
+
+    corpus_df = corpus_df.copy()
+    # A part of the corpus may have only one of the two scores.
+    for column in [column for column in ["polarity", "subjectivity"] if column in corpus_df.columns]:
+        scored = matched[column].notna().to_numpy()
+        corpus_df[column] = corpus_df[column].astype(float)
+        corpus_df.loc[scored, column] = matched[column].to_numpy()[scored]
+    return corpus_df
+
+
+def corpus_to_table(corpus_df):
+    """
+    Convert the dataframe of the corpus into an Arrow table with dictionary-encoded categorical columns.
+    """
+    corpus_df = corpus_df.copy()
+    for column in CATEGORICAL_COLUMNS:
+        corpus_df[column] = corpus_df[column].astype("category")
+    corpus_df["total_height"] = corpus_df["total_height"].astype("Int64")
+    return pa.Table.from_pandas(corpus_df, preserve_index=False)
+
+
+def build_corpus_store(source_dir=SOURCE_DIR, store_dir=STORE_DIR, prompt_types_dir=PROMPT_TYPES_DIR):
+    """
+    Flatten all of the generation JSON files into the Parquet dataset, partitioned by model and bias type.
+    The dataset is written to a temporary folder first and then swapped in.
+
+    :return pd.DataFrame: The corpus with a row for each generation.
+    """
+    json_paths = get_source_files(source_dir)
+    categories = get_group_categories(prompt_types_dir)
+
+    rows = []
+    for json_path in json_paths:
+        rows.extend(read_generation_file(json_path, source_dir, categories))
+    corpus_df = pd.DataFrame(rows, columns=CORPUS_COLUMNS)
+    # Flag the refusals of the whole corpus at once.
+    corpus_df["refusal"] = classify_refusals(corpus_df["generated_text"], corpus_df["has_attributes"])
+    # Take the sentiment scores from the table of scores if there is one.
+    scores_df = load_sentiment_scores(os.path.join(source_dir, SCORES_NAME))
+    if scores_df is not None:
+        corpus_df = apply_sentiment_scores(corpus_df, scores_df)
+
+    # Write the dataset and the manifest of the JSON files it was built from.
+    temporary_dir = store_dir + ".tmp"
+    shutil.rmtree(temporary_dir, ignore_errors=True)
+    pq.write_to_dataset(corpus_to_table(corpus_df), temporary_dir, partition_cols=PARTITION_COLUMNS,
+                        basename_template="part-{i}.parquet")
+    with open(os.path.join(temporary_dir, MANIFEST_NAME), "w") as f:
+        json.dump(get_manifest(get_manifest_files(source_dir), source_dir), f)
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(temporary_dir, store_dir)
+
+    return corpus_df
+
+
+def is_store_current(source_dir=SOURCE_DIR, store_dir=STORE_DIR):
+    """
+    Check whether the store exists and was built from the current JSON files.
+    """
+    manifest_path = os.path.join(store_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return False
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    return manifest == get_manifest(get_manifest_files(source_dir), source_dir)
+
+
+def load_corpus(columns=None, models=None, bias_types=None, groups=None, categories=None,
+                source_dir=SOURCE_DIR, store_dir=STORE_DIR):
+    """
+    Load the generated texts from the columnar store, building it first if it is missing or out of date.
+    Only the requested columns and partitions are read.
+
+    :param list[str] columns: The columns to load. If None, every column in CORPUS_COLUMNS is loaded.
+    :param list[str] models: The model folders to load e.g. ["gpt_4o_mini"]. If None, every model is loaded.
+    :param list[str] bias_types: The bias types to load ("implicit" and/or "explicit"). If None, both are loaded.
+    :param list[str] groups: The groups with gender to load e.g. ["black_female"]. If None, every group is loaded.
+    :param list[str] categories: The categories of bias to load e.g. ["age"]. If None, every category is loaded.
+
+    :return pd.DataFrame: A row for each generation, with the categorical columns as pandas categoricals.
+    """
+    if not is_store_current(source_dir, store_dir):
+        build_corpus_store(source_dir, store_dir)
+
+    dataset = ds.dataset(store_dir, format="parquet",
+                         partitioning=ds.HivePartitioning.discover(infer_dictionary=True),
+                         exclude_invalid_files=True)
+
+    # Combine the filters on the partitions and the groups.
+    filters = None
+    for column, values in [("model", models), ("bias_type", bias_types),
+                           ("group_with_gender", groups), ("category", categories)]:
+        if values is not None:
+            condition = ds.field(column).isin(values)
+            filters = condition if filters is None else filters & condition
+
+    table = dataset.to_table(columns=columns if columns is not None else CORPUS_COLUMNS, filter=filters)
+    return table.to_pandas()
+
+
+if __name__ == "__main__":
+    corpus_df = build_corpus_store()
+    print(f"Stored {corpus_df.shape[0]} generations from {corpus_df.groupby(['model', 'bias_type', 'group_with_gender']).ngroups} "
+          f"JSON files in {STORE_DIR}")
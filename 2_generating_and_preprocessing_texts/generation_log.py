@@ -0,0 +1,165 @@
+"""
+Append-only, crash-safe checkpoint log for the generated texts.
+
+Every finished generation is appended to a JSONL write-ahead log as soon as it is available instead of
+rewriting the whole output JSON file. The log is flushed to disk in batches, so a crash loses at most the
+last unsynced batch. A restarted run skips the keys that are already in the log, and the compaction step
+writes the per-group JSON files (e.g. gpt_4o_mini/explicit/male.json) read by the later stages.
+"""
+import json
+import os
+import threading
+import time
+
+
+def generation_sort_key(key):
+    """
+    Sort key for generation keys of the form "{prompt_num}_{repetition}".
+    """
+    prompt_num, repetition = key.split("_")
+    return int(prompt_num), int(repetition)
+
+
+def read_log(path):
+    """
+    Read the records in a generation log.
+
+    :param str path: The path to the JSONL log.
+
+    :return list[dict]: The records, each with an "output_path", a "key", and an "output".
+    """
+    records = []
+    if not os.path.exists(path):
+        return records
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            # Skip a final line that was only partially written before a crash.
+            if not line.endswith("\n"):
+                break
+            records.append(json.loads(line))
+
+    return records
+
+
+class GenerationLog:
+    """
+    A JSONL write-ahead log of finished generations with batched fsyncs.
+    """
+
+    def __init__(self, path, fsync_every=32, fsync_interval=1.0):
+        """
+        :param str path: The path to the JSONL log. Existing records are loaded so that the run can resume.
+        :param int fsync_every: The number of appended records after which the log is synced to disk.
+        :param float fsync_interval: The number of seconds after which pending records are synced to disk.
+        """
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        # Store the logged outputs with the output path and the key as keys.
+        self.records = {}
+        for record in read_log(path):
+            self.records.setdefault(record["output_path"], {})[record["key"]] = record["output"]
+
+        # Remove a partially written final line left by a crash so that new records start on a fresh line.
+        self._truncate_partial_line()
+
+        self._file = open(path, "a", encoding="utf-8")
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _truncate_partial_line(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def completed_keys(self, output_path):
+        """
+        Get the keys that have already been generated for an output path.
+        """
+        return set(self.records.get(output_path, {}))
+
+    def append(self, output_path, key, output):
+        """
+        Append a finished generation to the log.
+
+        :param str output_path: The JSON file the generation belongs to.
+        :param str key: The key of the generation i.e. "{prompt_num}_{repetition}".
+        :param dict output: The generated text and attributes.
+        """
+        line = json.dumps({"output_path": output_path, "key": key, "output": output}) + "\n"
+
+        with self._lock:
+            self._file.write(line)
+            self.records.setdefault(output_path, {})[key] = output
+            self._pending += 1
+
+            # Sync the batch of pending records once it is large or old enough.
+            if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self):
+        """
+        Flush all pending records to disk.
+        """
+        with self._lock:
+            self._sync()
+
+    def compact(self, output_path=None, keys=None):
+        """
+        Write the logged generations to the per-group JSON files.
+        Each file is written to a temporary file first and then renamed, so it is never left half-written.
+
+        :param str output_path: The JSON file to write. If None, every output path in the log is written.
+        :param list[str] keys: The keys to include, in order. If None, all logged keys are included in prompt order.
+
+        :return dict: The generations written to the output path, or to the last output path if output_path is None.
+        """
+        self.sync()
+
+        output_paths = [output_path] if output_path is not None else list(self.records)
+        generations = {}
+
+        for path in output_paths:
+            logged = self.records.get(path, {})
+
+            # Order the generations by prompt number and repetition.
+            if keys is None:
+                path_keys = sorted(logged, key=generation_sort_key)
+            else:
+                path_keys = [key for key in keys if key in logged]
+            generations = {key: logged[key] for key in path_keys}
+
+            # Write the dictionary to the output file as JSON data.
+            temporary_path = path + ".tmp"
+            with open(temporary_path, "w") as f:
+                json.dump(generations, f)
+            os.replace(temporary_path, path)
+
+        return generations
+
+    def close(self):
+        """
+        Sync and close the log.
+        """
+        with self._lock:
+            self._sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,250 @@
+"""
+Hash-indexed normalization of the attribute labels outputted by the large language models.
+
+The models answer with many spellings of the same demographic group (e.g. "-  christian", "catholic", and
+"spiritual [christian]" are all Christian). Every stage used to keep its own copy of the groupings of these labels,
+and the copies had drifted apart, so the same label could be counted in one stage and dropped in another.
+This module keeps the only copy of the groupings, and compiles them once, at import time, into a read-only hash map
+from each lowercase label to its group for each attribute. The few labels that a stage has always grouped
+differently are given to its normalizer as overrides (a different group) or exclusions (no group).
+
+Whole columns of labels are normalized at once by factorizing them into categorical codes, looking up each distinct
+label only once, and taking the groups by code. Labels that are not in the groupings are returned unchanged and
+counted, so that new spellings can be reviewed and added to ATTRIBUTE_GROUPINGS.
+"""
+from collections import Counter
+from types import MappingProxyType
+
+import numpy as np
+import pandas as pd
+
+# The labels outputted by the LLMs that are equivalent to each demographic group, for each attribute.
+# The labels are compared in lowercase, and the name of each group is also one of its labels.
+ATTRIBUTE_GROUPINGS = {
+    "religion": {
+        "christian": ["catholic", "-  christian", "- christian", "christian [formerly; now spiritual]",
+                      "spiritual [christian]", "unaffiliated christian"],
+        "muslim": ["-  muslim", "- muslim"],
+        "jewish": ["- jewish"],
+        "hindu": ["-  hindu", "- hindu", "hindu [buddhist]"],
+        "buddhist": [],
+        "unaffiliated": ["agnostic", "agnostic (unaffiliated)", "-  atheist", "- atheist", "atheist",
+                         "atheist [christian/muslim/jewish/hindu/buddhist/unaffiliated]", "-  neutral", "pagan",
+                         "spiritual", "spiritual but not religious", "spiritually curious", "unaaffiliated",
+                         "-  unaffiliated", "- unaffiliated", "unaffiliated (agnostic)",
+                         "unaffiliated (christian upbringing)", "unaffiliated (secular christian upbringing)",
+                         "unaffiliated (spiritual)", "unaffiliated [agnostic]",
+                         "unaffiliated [buddhist/taoist leanings]", "unaffiliated [buddhist]",
+                         "unaffiliated [christian background]", "unaffiliated [christian upbringing]",
+                         "-  unaffiliated [christian/muslim/jewish/hindu/buddhist/unaffiliated]",
+                         "- unaffiliated [christian/muslim/jewish/hindu/buddhist/unaffiliated]",
+                         "unaffiliated [christian/muslim/jewish/hindu/buddhist/unaffiliated]",
+                         "unaffiliated [christian]", "unaffiliated [spiritual]", "unaffiliated buddhist",
+                         "unaffiliated, spiritual"],
+    },
+    "politics": {
+        "liberal": ["-  liberal", "- liberal", "-  liberal [liberal/neutral/conservative]",
+                    "- liberal [liberal/neutral/conservative]", "liberal [liberal/neutral/conservative]",
+                    "-  socialist [liberal/neutral/conservative]", "- socialist [liberal/neutral/conservative]"],
+        "conservative": ["-  conservative", "- conservative", "conservative (neutral in discourse)", "republican"],
+        "neutral": ["moderate", "moderate conservative", "-  neutral", "- neutral", "neutral (leans liberal)",
+                    "neutral [conservative]", "neutral [liberal-leaning]"],
+    },
+    "sexual_orientation": {
+        "bisexual": ["-  bisexual", "- bisexual", "bisexual [heterosexual/homosexual/bisexual]",
+                     "bisexual [or heterosexual]"],
+        "homosexual": ["-  homosexual", "- homosexual", "homosexual [heterosexual/bisexual]",
+                       "-  homosexual [heterosexual/homosexual/bisexual]",
+                       "- homosexual [heterosexual/homosexual/bisexual]",
+                       "homosexual [heterosexual/homosexual/bisexual]", "lesbian"],
+        "heterosexual": ["-  heterosexual", "- heterosexual", "heterosexual [heterosexual/homosexual/bisexual]"],
+        "other": ["pansexual", "-  queer", "- queer", "queer"],
+    },
+    "socioeconomic_status": {
+        "lower-class": ["lower-middle-class"],
+        "middle-class": ["[middle-class/upper-class/renunciant]", "-  middle-class", "- middle-class",
+                         "middle-class [upper-middle-class/lower-middle-class]", "working-class"],
+        "upper-class": ["-  upper middle class", "- upper middle class", "upper middle class", "-  upper-class",
+                        "- upper-class", "upper-middle class", "-  upper-middle-class", "- upper-middle-class",
+                        "upper-middle-class"],
+    },
+    "occupation": {
+        "artist": ["-  artist", "- artist", "-  artist/designer", "- artist/designer"],
+        "attorney": ["-  attorney", "- attorney"],
+        "graphic designer": ["-  freelance graphic designer", "- freelance graphic designer", "-  graphic designer",
+                             "- graphic designer", "-  self-employed graphic designer",
+                             "- self-employed graphic designer"],
+        "teacher": ["-  teacher", "- teacher"],
+        "accountant": ["-  accountant", "- accountant"],
+        "construction worker": ["-  construction worker", "- construction worker"],
+        "marketing manager": ["-  marketing manager", "- marketing manager"],
+        "marketing director": ["-  marketing director", "- marketing director"],
+        "financial analyst": ["-  financial analyst", "- financial analyst"],
+        "software engineer": ["-  software engineer", "- software engineer"],
+        "lawyer": ["-  lawyer", "- lawyer"],
+        "artist/teacher": ["-  artist/teacher", "- artist/teacher"],
+        "social worker": ["-  social worker", "- social worker"],
+        "engineer": ["-  engineer", "- engineer"],
+        "professor": ["-  professor", "- professor"],
+        "entrepreneur": ["-  entrepreneur", "- entrepreneur"],
+        "freelance photographer": ["-  freelance photographer", "- freelance photographer"],
+    },
+}
+
+
+class LabelNormalizer:
+    """
+    Normalize the attribute labels to their demographic groups with a frozen hash map of the groupings.
+    """
+
+    def __init__(self, groupings=ATTRIBUTE_GROUPINGS, group_labels=None, overrides=None, exclusions=None):
+        """
+        Compile the groupings into a read-only map from each lowercase label to its group, for each attribute.
+
+        :param dict groupings: The labels that are equivalent to each group, for each attribute.
+        :param dict group_labels: The label returned for some of the groups of each attribute
+                                  e.g. {"religion": {"christian": "Christian"}}. Defaults to the name of the group.
+        :param dict overrides: The labels of each attribute that are normalized to a different group than
+                               in the groupings e.g. {"politics": {"moderate conservative": "conservative"}}.
+        :param dict exclusions: The labels of each attribute that are left out of their groups, and are returned
+                                unchanged without being counted as unseen e.g. {"politics": ["moderate"]}.
+        """
+        group_labels = group_labels or {}
+        overrides = overrides or {}
+        exclusions = exclusions or {}
+
+        label_maps = {}
+        groups = {}
+        for attribute, attribute_groupings in groupings.items():
+            renamed = group_labels.get(attribute, {})
+            label_map = {}
+            for group, labels in attribute_groupings.items():
+                for label in [group, *labels]:
+                    label_map[label.lower()] = renamed.get(group, group)
+            for label, group in overrides.get(attribute, {}).items():
+                label_map[label.lower()] = renamed.get(group, group)
+            for label in exclusions.get(attribute, []):
+                label_map.pop(label.lower(), None)
+
+            label_maps[attribute] = MappingProxyType(label_map)
+            # Keep the groups in the order of the groupings, without the duplicates of merged groups.
+            groups[attribute] = tuple(dict.fromkeys(renamed.get(group, group) for group in attribute_groupings))
+
+        self.label_maps = MappingProxyType(label_maps)
+        self.groups = MappingProxyType(groups)
+        # The lowercase labels that are left out of the groups of each attribute.
+        self.excluded_labels = MappingProxyType({attribute: frozenset(label.lower() for label in labels)
+                                                 for attribute, labels in exclusions.items()})
+        # The number of times each (attribute, label) pair was not found in the groupings.
+        self.unseen_labels = Counter()
+
+    def get_groups(self, attribute):
+        """
+        Get the groups of an attribute, in the order of the groupings.
+
+        :param str attribute: The attribute e.g. "religion".
+
+        :return list: The groups e.g. ["christian", "muslim", ...].
+        """
+        return list(self.groups[attribute])
+
+    def normalize(self, attribute, label):
+        """
+        Normalize a single label to its group.
+
+        :param str attribute: The attribute of the label e.g. "religion".
+        :param str label: The label outputted by the LLM e.g. "-  Catholic".
+
+        :return str: The group of the label, or the label itself if it is not in the groupings.
+        """
+        group = self.label_maps[attribute].get(str(label).lower())
+        if group is None:
+            if str(label).lower() not in self.excluded_labels.get(attribute, ()):
+                self.unseen_labels[(attribute, label)] += 1
+            return label
+        return group
+
+    def normalize_column(self, attribute, labels):
+        """
+        Normalize a whole column of labels at once, looking up each distinct label only once.
+
+        :param str attribute: The attribute of the labels e.g. "religion".
+        :param labels: The labels, as a pd.Series, pd.Index, or list.
+
+        :return pd.Series: The group of each label, with the index of the labels. Labels that are not in the
+                           groupings are kept unchanged, and missing values stay missing.
+        """
+        labels = labels.astype(object) if isinstance(labels, pd.Series) else pd.Series(list(labels), dtype=object)
+        label_map = self.label_maps[attribute]
+
+        # Factorize the labels into categorical codes and look up each distinct label once.
+        codes, uniques = pd.factorize(labels)
+        uniques = np.asarray(uniques, dtype=object)
+        groups = np.array([label_map.get(str(label).lower()) for label in uniques], dtype=object)
+        unmapped = np.flatnonzero([group is None for group in groups])
+        groups[unmapped] = uniques[unmapped]
+
+        # Count the occurrences of the labels that are not in the groupings, apart from the excluded labels.
+        excluded_labels = self.excluded_labels.get(attribute, ())
+        unseen = [code for code in unmapped if str(uniques[code]).lower() not in excluded_labels]
+        if unseen:
+            occurrences = np.bincount(codes[codes >= 0], minlength=len(uniques))
+            for code in unseen:
+                self.unseen_labels[(attribute, uniques[code])] += int(occurrences[code])
+
+        # Take the group of every label by its code, keeping the missing values (code -1) as they were.
+        missing = codes < 0
+        normalized = labels.to_numpy(copy=True)
+        normalized[~missing] = groups[codes[~missing]]
+        return pd.Series(normalized, index=labels.index, name=labels.name)
+
+    def get_unseen_labels(self, attribute=None):
+        """
+        Get the labels that were not found in the groupings.
+
+        :param str attribute: Only get the labels of this attribute. Defaults to all of the attributes.
+
+        :return list[tuple]: The (attribute, label) pairs and their number of occurrences, the most common first.
+        """
+        return [(key, count) for key, count in self.unseen_labels.most_common()
+                if attribute is None or key[0] == attribute]
+
+    def report_unseen_labels(self, attribute=None):
+        """
+        Print the labels that were not found in the groupings, so that they can be added to ATTRIBUTE_GROUPINGS.
+        """
+        for (label_attribute, label), count in self.get_unseen_labels(attribute):
+            print(f"Unseen {label_attribute} label: {label!r} ({count} occurrences)")
+
+
+# The demographic groups of the labels e.g. "christian" or "bisexual".
+DEMOGRAPHIC_GROUPS = LabelNormalizer()
+
+# The groups of the real-world reference values of the binomial tests and the pivot tables, where the LGBTQ+
+# orientations are a single group, and "moderate conservative" is kept as conservative as in the binomial tests.
+REFERENCE_GROUPS = LabelNormalizer(
+    group_labels={"sexual_orientation": {"bisexual": "lgbtq", "homosexual": "lgbtq", "other": "lgbtq"}},
+    overrides={"politics": {"moderate conservative": "conservative"}},
+)
+
+# The groups of the pivot tables, which have always counted "spiritual [christian]" and "unaffiliated christian" as
+# unaffiliated, and left out the hedged political labels and "unaffiliated, spiritual".
+PIVOT_TABLE_GROUPS = LabelNormalizer(
+    group_labels={"sexual_orientation": {"bisexual": "lgbtq", "homosexual": "lgbtq", "other": "lgbtq"}},
+    overrides={"religion": {"spiritual [christian]": "unaffiliated", "unaffiliated christian": "unaffiliated"}},
+    exclusions={"religion": ["unaffiliated, spiritual"],
+                "politics": ["-  liberal [liberal/neutral/conservative]", "- liberal [liberal/neutral/conservative]",
+                             "liberal [liberal/neutral/conservative]", "-  socialist [liberal/neutral/conservative]",
+                             "- socialist [liberal/neutral/conservative]", "conservative (neutral in discourse)",
+                             "republican", "moderate", "moderate conservative", "neutral (leans liberal)",
+                             "neutral [liberal-leaning]"]},
+)
+
+# The groups shown in the plots, where the religions are capitalized, and the labels that the plots have always
+# shown on their own are kept as they are.
+PLOT_GROUPS = LabelNormalizer(
+    group_labels={"religion": {group: group.capitalize() for group in ATTRIBUTE_GROUPINGS["religion"]}},
+    exclusions={"religion": ["spiritually curious", "unaffiliated (secular christian upbringing)",
+                             "unaffiliated, spiritual"],
+                "politics": ["conservative (neutral in discourse)", "neutral [liberal-leaning]"]},
+)
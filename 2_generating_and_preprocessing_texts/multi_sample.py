@@ -0,0 +1,79 @@
+"""
+Multi-sample generate functions, which ask a provider for several completions of a prompt in one request.
+
+The repetitions of a prompt are independent samples of the same request, so instead of sending the prompt and its
+long attribute prompt once for every repetition, the OpenAI-compatible chat completion APIs (OpenAI and DeepInfra)
+can return all of them as the choices of a single request with the "n" parameter. The prompt is only sent and billed
+as input once, and a single request counts against the provider's rate limit.
+
+MultiSampleGenerate wraps a sample function into a generate function with a generate_many method. The
+GenerationEngine groups the repetitions of each prompt into requests of at most max_samples samples for these
+functions, splits the choices into the "{prompt_num}_{repetition}" keys, and caches each choice under its own key.
+The providers whose APIs do not support several samples per request (Anthropic and Cohere) keep their usual generate
+functions, which the engine fans out into one request per repetition.
+"""
+from generation_engine import PROVIDERS, SAMPLING_PARAMS, SYSTEM_PROMPT
+from provider_clients import resolve_client
+
+# The providers whose chat completion APIs can return several samples in one request.
+MULTI_SAMPLE_PROVIDERS = {"openai", "deepinfra"}
+
+# The largest number of samples requested at once. The OpenAI API allows up to 128.
+MAX_SAMPLES = 50
+
+
+def sample_openai(client, model, temperature=SAMPLING_PARAMS["temperature"], top_p=SAMPLING_PARAMS["top_p"]):
+    """
+    Create a sample function for an OpenAI-compatible chat completion API (OpenAI and DeepInfra).
+
+    :param client: The OpenAI client e.g. clients.get("openai"), or the provider name "openai" to get the shared
+                   client when the first prompt is sent.
+    :param str model: The model e.g. "gpt-4o-mini".
+
+    :return callable: A function that takes a prompt and a number of samples, and returns the generated texts.
+    """
+    def sample(prompt, n):
+        completion = resolve_client(client).chat.completions.create(
+            model=model,
+            messages=[{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+            temperature=temperature,
+            top_p=top_p,
+            n=n,
+        )
+        # The choices may not be in the order of their indices.
+        return [choice.message.content for choice in sorted(completion.choices, key=lambda choice: choice.index)]
+
+    return sample
+
+
+class MultiSampleGenerate:
+    """
+    A generate function for the GenerationEngine that can return several samples of a prompt in one request.
+    """
+
+    def __init__(self, provider, sample, model=None, max_samples=MAX_SAMPLES):
+        """
+        :param str provider: The provider whose rate limit the function shares e.g. "openai".
+        :param callable sample: A function that takes a prompt and a number of samples, and returns the generated
+                                texts e.g. sample_openai("openai", "gpt-4o-mini").
+        :param str model: The model id used in the response cache key. Defaults to the provider's model.
+        :param int max_samples: The largest number of samples requested at once.
+        """
+        if provider not in MULTI_SAMPLE_PROVIDERS:
+            raise ValueError(f"The {provider} API does not support several samples per request. "
+                             "Use its generate function, which the engine fans out instead.")
+        self.provider = provider
+        self.model = model if model is not None else PROVIDERS.get(provider, {}).get("model", provider)
+        self.sample = sample
+        self.max_samples = max_samples
+
+    def __call__(self, prompt):
+        return self.sample(prompt, 1)[0]
+
+    def generate_many(self, prompt, n):
+        """
+        Generate n samples of a prompt in one request.
+
+        :return list[str]: The raw generated texts.
+        """
+        return self.sample(prompt, n)
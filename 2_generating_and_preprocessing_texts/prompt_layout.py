@@ -0,0 +1,207 @@
+"""
+Prompt layouts for provider-side prompt caching, and the accounting of cached input tokens.
+
+The providers cache the longest prefix of a request that they have already seen, and bill and prefill only the rest.
+In the usual layout ("suffix"), the varying person prompt from the TEMPLATE of 1.1_data_preprocessing.ipynb comes
+first in the user message, and the identical attribute instructions (ATTRIBUTE_PROMPT) are appended after it, so no
+two requests share more than the system prompt and the first words of the template. In the "prefix" layout, the
+attribute instructions are moved into the system prompt, which is the same for every request, and the person prompt
+comes last as the user message:
+
+- OpenAI and DeepInfra cache the prefixes of the requests automatically.
+- Anthropic only caches up to a cache_control breakpoint, so the system block is marked with an ephemeral breakpoint.
+
+The providers only cache prefixes above a minimum length (1024 tokens for GPT-4o mini and Claude 3.5 Sonnet). The
+system prompt and the attribute instructions are far shorter, so the prefix layout only saves latency and cost once
+the shared prefix reaches the minimum, and the cached share is only known from the usage that each response
+reports. PromptCachingGenerate therefore records the input tokens, the cached input tokens, the input tokens written
+to the cache, the output tokens, and the latency of every request, and summarize_usage estimates the cost of the
+input tokens relative to the same requests without caching.
+
+The prefix layout is experimental: with the current prompts it gets no cached tokens at all, so the generation
+notebook does not use it by default.
+"""
+import statistics
+import threading
+import time
+
+from generation_engine import ATTRIBUTE_PROMPT, PROVIDERS, SAMPLING_PARAMS, SYSTEM_PROMPT
+from provider_clients import resolve_client
+
+# The layouts of the prompts: the instructions after the person prompt, or before it in the system prompt.
+LAYOUTS = ["suffix", "prefix"]
+
+# The attribute instructions that are identical in every request.
+ATTRIBUTE_INSTRUCTIONS = ATTRIBUTE_PROMPT.strip()
+
+# The price of a cached input token and of an input token written to the cache, relative to an uncached input token.
+CACHE_PRICES = {
+    "openai": {"cache_read": 0.5, "cache_write": 1.0},
+    "anthropic": {"cache_read": 0.1, "cache_write": 1.25},
+}
+
+
+def split_prompt(prompt):
+    """
+    Split a prompt into the person prompt and the attribute instructions appended to it by the generation engine.
+
+    :return tuple: The person prompt, and the attribute instructions ("" if the prompt has none).
+    """
+    if prompt.endswith(ATTRIBUTE_PROMPT):
+        return prompt[:-len(ATTRIBUTE_PROMPT)], ATTRIBUTE_INSTRUCTIONS
+    return prompt, ""
+
+
+def get_system_prompt(prompt, layout):
+    """
+    Get the system prompt and the user message of a prompt in a layout.
+
+    :param str prompt: The prompt, with the attribute instructions appended to it.
+    :param str layout: "suffix" to keep the prompt as it is, or "prefix" to move the instructions into the system
+                       prompt.
+
+    :return tuple: The system prompt and the user message.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown prompt layout: {layout}. Expected one of {LAYOUTS}.")
+    if layout == "suffix":
+        return SYSTEM_PROMPT, prompt
+
+    person_prompt, instructions = split_prompt(prompt)
+    return (SYSTEM_PROMPT + "\n\n" + instructions if instructions else SYSTEM_PROMPT), person_prompt
+
+
+def get_openai_usage(completion):
+    """
+    Get the input and output tokens of an OpenAI-compatible chat completion.
+    """
+    usage = completion.usage
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {"input_tokens": usage.prompt_tokens,
+            "cached_input_tokens": (getattr(details, "cached_tokens", None) or 0) if details is not None else 0,
+            "cache_write_tokens": 0,
+            "output_tokens": usage.completion_tokens}
+
+
+def get_anthropic_usage(message):
+    """
+    Get the input and output tokens of an Anthropic message. The input tokens of the message exclude the tokens
+    that were read from or written to the cache.
+    """
+    usage = message.usage
+    cached_input_tokens = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write_tokens = getattr(usage, "cache_creation_input_tokens", None) or 0
+    return {"input_tokens": usage.input_tokens + cached_input_tokens + cache_write_tokens,
+            "cached_input_tokens": cached_input_tokens,
+            "cache_write_tokens": cache_write_tokens,
+            "output_tokens": usage.output_tokens}
+
+
+class PromptCachingGenerate:
+    """
+    A generate function for the GenerationEngine that sends the prompts in a cacheable layout, and records the
+    token usage of each request. Like the other generate functions, it returns the raw text.
+    """
+
+    def __init__(self, provider, client, model=None, layout="prefix", max_tokens=1000,
+                 temperature=SAMPLING_PARAMS["temperature"], top_p=SAMPLING_PARAMS["top_p"]):
+        """
+        :param str provider: The provider of the client: "openai", "deepinfra", or "anthropic".
+        :param client: The client of the provider e.g. clients.get("anthropic"), or the provider name "anthropic" to
+                       get the shared client when the first prompt is sent.
+        :param str model: The model e.g. "claude-3-5-sonnet-20240620". Defaults to the provider's model.
+        :param str layout: "prefix" to send the instructions first in the system prompt, or "suffix" to send them
+                           after the person prompt as the other generate functions do.
+        :param int max_tokens: The maximum number of tokens of an Anthropic response.
+        """
+        if provider not in ["openai", "deepinfra", "anthropic"]:
+            raise ValueError(f"Prompt caching is not supported for {provider}. Use its generate function instead.")
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown prompt layout: {layout}. Expected one of {LAYOUTS}.")
+
+        self.provider = provider
+        self.client = client
+        self.api_model = model if model is not None else PROVIDERS[provider]["model"]
+        # The responses of the prefix layout are kept separate from the responses of the usual layout in the cache.
+        self.model = self.api_model if layout == "suffix" else f"{self.api_model} (prefix layout)"
+        self.layout = layout
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        # The token usage and latency of each request, in the order the requests finished.
+        self.usage = []
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt):
+        system_prompt, user_message = get_system_prompt(prompt, self.layout)
+        start = time.perf_counter()
+
+        if self.provider == "anthropic":
+            system = [{"type": "text", "text": system_prompt}]
+            # Mark the end of the invariant system prompt as a cache breakpoint.
+            if self.layout == "prefix":
+                system[0]["cache_control"] = {"type": "ephemeral"}
+            message = resolve_client(self.client).messages.create(
+                model=self.api_model,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature,
+                top_p=self.top_p,
+                system=system,
+                messages=[{"role": "user", "content": [{"type": "text", "text": user_message}]}],
+            )
+            output, usage = message.content[0].text, get_anthropic_usage(message)
+        else:
+            completion = resolve_client(self.client).chat.completions.create(
+                model=self.api_model,
+                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_message}],
+                temperature=self.temperature,
+                top_p=self.top_p,
+            )
+            output, usage = completion.choices[0].message.content, get_openai_usage(completion)
+
+        usage["latency"] = time.perf_counter() - start
+        with self._lock:
+            self.usage.append(usage)
+        return output
+
+
+def summarize_usage(usage, provider=None):
+    """
+    Summarize the token usage of the requests of a generate function.
+
+    :param list[dict] usage: The usage of each request from PromptCachingGenerate.usage.
+    :param str provider: The provider whose cache prices are used to estimate the relative input cost.
+
+    :return dict: The number of requests, the input, cached input, cache write, and output tokens, the share of the
+                  input tokens that were cached, the mean latency in seconds, and the cost of the input tokens
+                  relative to the same requests without caching (None if the provider's prices are unknown).
+    """
+    summary = {"requests": len(usage)}
+    for name in ["input_tokens", "cached_input_tokens", "cache_write_tokens", "output_tokens"]:
+        summary[name] = sum(request[name] for request in usage)
+    summary["cached_share"] = summary["cached_input_tokens"] / max(summary["input_tokens"], 1)
+    summary["mean_latency"] = statistics.mean(request["latency"] for request in usage) if usage else None
+
+    prices = CACHE_PRICES.get("openai" if provider == "deepinfra" else provider)
+    summary["relative_input_cost"] = None
+    if prices is not None and summary["input_tokens"]:
+        uncached = summary["input_tokens"] - summary["cached_input_tokens"] - summary["cache_write_tokens"]
+        cost = (uncached + prices["cache_read"] * summary["cached_input_tokens"]
+                + prices["cache_write"] * summary["cache_write_tokens"])
+        summary["relative_input_cost"] = cost / summary["input_tokens"]
+    return summary
+
+
+def print_usage(usage, name, provider=None):
+    """
+    Print the summary of the token usage of the requests of a generate function.
+    """
+    summary = summarize_usage(usage, provider)
+    line = (f"{name}: {summary['requests']} requests, {summary['input_tokens']:,} input tokens, "
+            f"{summary['cached_input_tokens']:,} cached ({summary['cached_share'] * 100:.1f}%), "
+            f"{summary['cache_write_tokens']:,} written to the cache")
+    if summary["mean_latency"] is not None:
+        line += f", mean latency {summary['mean_latency'] * 1000:.1f} ms"
+    if summary["relative_input_cost"] is not None:
+        line += f", input cost {summary['relative_input_cost'] * 100:.1f}% of uncached"
+    print(line)
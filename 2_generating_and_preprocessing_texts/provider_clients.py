@@ -0,0 +1,120 @@
+"""
+Registry of long-lived provider clients.
+
+Constructing a new SDK client for every generation creates a fresh HTTP connection pool, so every request
+pays for a new TCP connection and TLS handshake. The registry creates one client per provider and endpoint
+and shares its keep-alive connection pool across all of the generations in the process.
+"""
+import os
+import threading
+
+import anthropic
+import cohere
+import httpx
+from openai import OpenAI
+
+# The environment variable with the API key and the default endpoint for each provider.
+PROVIDER_SETTINGS = {
+    "openai": {"api_key_env": "OPENAI_API_KEY", "base_url": None},
+    "anthropic": {"api_key_env": "ANTHROPIC_API_KEY", "base_url": None},
+    "cohere": {"api_key_env": "COHERE_API_KEY", "base_url": None},
+    "deepinfra": {"api_key_env": "DEEP_INFRA_API_KEY", "base_url": "https://api.deepinfra.com/v1/openai"},
+}
+
+
+class ClientRegistry:
+    """
+    Creates one long-lived client for each provider and endpoint and returns the same client on every call.
+    The clients are safe to share between the threads used by the generation engine.
+    """
+
+    def __init__(self, max_connections=32, max_keepalive_connections=16, keepalive_expiry=30.0,
+                 timeout=60.0, connect_timeout=10.0, max_retries=2):
+        """
+        :param int max_connections: The maximum number of connections in each client's pool.
+        :param int max_keepalive_connections: The maximum number of idle connections kept open in each pool.
+        :param float keepalive_expiry: The number of seconds an idle connection is kept open.
+        :param float timeout: The number of seconds to wait for a response.
+        :param float connect_timeout: The number of seconds to wait for a connection to be established.
+        :param int max_retries: The number of retries performed by the SDK itself.
+        """
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections,
+                                   keepalive_expiry=keepalive_expiry)
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+
+        # Store the clients and their HTTP connection pools with (provider, base_url) as keys.
+        self._clients = {}
+        self._http_clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider, base_url=None, api_key=None):
+        """
+        Get the shared client for a provider, creating it on the first call.
+
+        :param str provider: The provider name ("openai", "anthropic", "cohere", or "deepinfra").
+        :param str base_url: The endpoint of the API. Defaults to the provider's standard endpoint.
+        :param str api_key: The API key. Defaults to the provider's environment variable.
+
+        :return: The SDK client for the provider.
+        """
+        if provider not in PROVIDER_SETTINGS:
+            raise ValueError(f"Unknown provider: {provider}")
+
+        # Use the default endpoint if none is provided.
+        if base_url is None:
+            base_url = PROVIDER_SETTINGS[provider]["base_url"]
+
+        key = (provider, base_url)
+        with self._lock:
+            if key not in self._clients:
+                if api_key is None:
+                    api_key = os.getenv(PROVIDER_SETTINGS[provider]["api_key_env"])
+                self._clients[key] = self._create(provider, base_url, api_key)
+
+            return self._clients[key]
+
+    def _create(self, provider, base_url, api_key):
+        """
+        Create the SDK client for a provider with its own pooled HTTP client.
+        """
+        http_client = httpx.Client(limits=self.limits, timeout=self.timeout)
+        self._http_clients[(provider, base_url)] = http_client
+
+        # OpenAI and DeepInfra share the OpenAI SDK.
+        if provider == "openai" or provider == "deepinfra":
+            return OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=self.max_retries)
+        elif provider == "anthropic":
+            return anthropic.Anthropic(api_key=api_key, base_url=base_url, http_client=http_client,
+                                       max_retries=self.max_retries)
+        else:
+            return cohere.Client(api_key, base_url=base_url, httpx_client=http_client)
+
+    def close(self):
+        """
+        Close all of the connection pools and forget the clients.
+        """
+        with self._lock:
+            for http_client in self._http_clients.values():
+                http_client.close()
+            self._http_clients = {}
+            self._clients = {}
+
+
+# The registry shared by all of the generations in the process.
+clients = ClientRegistry()
+
+
+def resolve_client(client):
+    """
+    Get the client to send a request with. A provider name is looked up in the shared registry at this point, so
+    the client (and its API key) is only needed once the first request is sent.
+
+    :param client: The SDK client, or the name of a provider whose shared client is used e.g. "openai".
+
+    :return: The SDK client.
+    """
+    if isinstance(client, str):
+        return clients.get(client)
+    return client
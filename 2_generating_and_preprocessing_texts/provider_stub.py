@@ -0,0 +1,473 @@
+"""
+A local HTTP stand-in for the provider APIs so that the generation code can be tested and benchmarked offline.
+
+The stub answers OpenAI-compatible chat completion requests (with as many choices as the "n" parameter asks for)
+and Anthropic-style message requests with a canned profile. It keeps connections alive like the real APIs and
+counts the number of requests and connections it receives.
+
+The stub also simulates the prompt caches of the providers. The prefix of a chat completion request (every message
+before the last one) is cached automatically, and the prefix of a message request up to its last cache_control
+breakpoint. The tokens of a prefix that was seen before are reported as cached in the usage of the response, and
+the stub spends the prefill latency on every input token that is not cached. The tokens are counted as words.
+
+Requests with "stream": true are answered with server-sent events (SSE) in the format of each API, one event per
+token of the profile, with the configured token latency between the tokens, so that streaming clients can be tested.
+
+It also accepts batch jobs through the OpenAI-style file and batch endpoints and the Anthropic-style
+message batch endpoints. A batch finishes after the configured batch latency, and every request in
+the job file is answered with the canned profile.
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from generation_engine import FAKE_GENERATION
+
+# The tokens of a streamed profile: each word with the whitespace before it.
+TOKEN_REGEX = re.compile(r"\s*\S+|\s+")
+
+
+def count_tokens(content):
+    """
+    Count the words of the content of a message, which is either a string or a list of content blocks.
+    """
+    if not isinstance(content, str):
+        content = " ".join(block.get("text", "") for block in content)
+    return len(content.split())
+
+
+class ProviderStubHandler(BaseHTTPRequestHandler):
+    """
+    Handles the requests sent to the stub. A new handler is created for each connection.
+    """
+    # Keep connections alive between requests.
+    protocol_version = "HTTP/1.1"
+    # Send small responses immediately instead of waiting for the client's acknowledgement.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.stub.record("num_connections")
+
+    def do_POST(self):
+        # Read the body of the request.
+        length = int(self.headers.get("Content-Length", 0))
+        data = self.rfile.read(length)
+        self.server.stub.record("num_requests")
+        stub = self.server.stub
+        path = self.path.split("?")[0]
+
+        if path.endswith("/chat/completions"):
+            body = json.loads(data or b"{}")
+            usage = stub.chat_completion_usage(body)
+            # Simulate the time the model takes to read the uncached prompt and respond, or send its first token.
+            time.sleep(stub.latency + stub.prefill_latency * (usage["prompt_tokens"]
+                                                              - usage["prompt_tokens_details"]["cached_tokens"]))
+            if body.get("stream"):
+                self.send_events(stub.chat_completion_events(body))
+            else:
+                # A complete response is only sent once all of its tokens are generated.
+                time.sleep(stub.generation_time())
+                self.send_json(200, stub.chat_completion(body, usage))
+        elif path.endswith("/messages"):
+            body = json.loads(data or b"{}")
+            usage = stub.message_usage(body)
+            time.sleep(stub.latency + stub.prefill_latency * (usage["input_tokens"]
+                                                              + usage["cache_creation_input_tokens"]))
+            if body.get("stream"):
+                self.send_events(stub.message_events(body))
+            else:
+                # A complete response is only sent once all of its tokens are generated.
+                time.sleep(stub.generation_time())
+                self.send_json(200, stub.message(body, usage))
+        elif path.endswith("/files"):
+            self.send_json(200, stub.upload_file(self.read_uploaded_file(data)))
+        elif path.endswith("/messages/batches"):
+            self.send_json(200, stub.create_message_batch(json.loads(data)))
+        elif path.endswith("/batches"):
+            self.send_json(200, stub.create_batch(json.loads(data)))
+        else:
+            self.send_not_found()
+
+    def do_GET(self):
+        self.server.stub.record("num_requests")
+        stub = self.server.stub
+        # Pad the path so that short paths can be checked with negative indices.
+        parts = ["", "", ""] + self.path.split("?")[0].strip("/").split("/")
+
+        # OpenAI-style batches and files e.g. /v1/batches/{id} and /v1/files/{id}/content.
+        if parts[-2] == "batches" and parts[-3] != "messages" and parts[-1] in stub.batches:
+            self.send_json(200, stub.batch_status(parts[-1]))
+        elif parts[-3] == "files" and parts[-1] == "content" and parts[-2] in stub.files:
+            self.send_bytes(200, "application/jsonl", stub.files[parts[-2]])
+        # Anthropic-style message batches e.g. /v1/messages/batches/{id} and /v1/messages/batches/{id}/results.
+        elif parts[-2] == "batches" and parts[-1] in stub.message_batches:
+            self.send_json(200, stub.message_batch_status(parts[-1]))
+        elif parts[-1] == "results" and parts[-2] in stub.message_batches:
+            self.send_bytes(200, "application/binary", stub.message_batch_results(parts[-2]))
+        else:
+            self.send_not_found()
+
+    def read_uploaded_file(self, data):
+        """
+        Get the contents of the file in a multipart/form-data upload.
+        """
+        header = b"Content-Type: " + self.headers["Content-Type"].encode("utf-8") + b"\r\n\r\n"
+        message = BytesParser().parsebytes(header + data)
+        for part in message.get_payload():
+            if part.get_filename() is not None:
+                return part.get_payload(decode=True)
+        return b""
+
+    def send_not_found(self):
+        self.send_json(404, {"error": {"message": f"Unknown path: {self.path}"}})
+
+    def send_json(self, status, payload):
+        """
+        Send a JSON response with the given status code.
+        """
+        self.send_bytes(status, "application/json", json.dumps(payload).encode("utf-8"))
+
+    def send_bytes(self, status, content_type, data):
+        """
+        Send a response with the given status code, content type, and body.
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_events(self, events):
+        """
+        Send a stream of server-sent events with chunked transfer encoding, one chunk per event.
+        If the client closes the connection, the rest of the events are not sent.
+
+        :param iterator[tuple] events: The name of each event (None for unnamed events) and its data.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        try:
+            for event, data in events:
+                message = ("" if event is None else f"event: {event}\n") + f"data: {data}\n\n"
+                chunk = message.encode("utf-8")
+                self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+                self.wfile.flush()
+            # End the chunked body.
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.stub.record("num_closed_streams")
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        # Do not print a line for every request.
+        pass
+
+
+class ProviderStub:
+    """
+    Runs the stub server on a background thread. Can be used as a context manager.
+    """
+
+    def __init__(self, latency=0.0, generation=FAKE_GENERATION, batch_latency=0.0, token_latency=0.0,
+                 prefill_latency=0.0, min_cached_tokens=0, host="127.0.0.1", port=0):
+        """
+        :param float latency: The number of seconds the stub waits before responding, or before the first token
+                              of a streamed response.
+        :param str generation: The text returned for every prompt.
+        :param float batch_latency: The number of seconds after which a submitted batch is finished.
+        :param float token_latency: The number of seconds between the tokens of a streamed response.
+        :param float prefill_latency: The number of seconds the stub takes to read each uncached input token.
+        :param int min_cached_tokens: The number of tokens a prefix must have to be cached.
+        :param str host: The host to listen on.
+        :param int port: The port to listen on. A free port is chosen if 0.
+        """
+        self.latency = latency
+        self.generation = generation
+        self.batch_latency = batch_latency
+        self.token_latency = token_latency
+        self.prefill_latency = prefill_latency
+        self.min_cached_tokens = min_cached_tokens
+        self.num_requests = 0
+        self.num_connections = 0
+        # The number of streamed responses that the client closed before their end.
+        self.num_closed_streams = 0
+        self._lock = threading.Lock()
+
+        # The prefixes of the requests that are in the prompt cache.
+        self.prompt_cache = set()
+
+        # Store the uploaded files and the submitted batches with their ids as keys.
+        self.files = {}
+        self.batches = {}
+        self.message_batches = {}
+
+        self.server = ThreadingHTTPServer((host, port), ProviderStubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        The root URL of the stub, which is the base URL to pass to an Anthropic client.
+        """
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self):
+        """
+        The base URL to pass to an OpenAI-compatible client.
+        """
+        return self.url + "/v1"
+
+    def record(self, counter):
+        """
+        Increment one of the request counters.
+        """
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def cache_prefix(self, prefix, num_tokens):
+        """
+        Look up the prefix of a request in the prompt cache, and add it if it is not there.
+
+        :return bool: Whether the prefix was already cached.
+        """
+        if num_tokens == 0 or num_tokens < self.min_cached_tokens:
+            return False
+        with self._lock:
+            if prefix in self.prompt_cache:
+                return True
+            self.prompt_cache.add(prefix)
+            return False
+
+    def chat_completion_usage(self, body):
+        """
+        Get the usage of a chat completion request, whose messages before the last one are cached automatically.
+        """
+        messages = body.get("messages", [])
+        prefix_tokens = sum(count_tokens(message.get("content", "")) for message in messages[:-1])
+        prompt_tokens = prefix_tokens + sum(count_tokens(message.get("content", "")) for message in messages[-1:])
+        cached_tokens = prefix_tokens if self.cache_prefix(json.dumps(messages[:-1]), prefix_tokens) else 0
+        completion_tokens = count_tokens(self.generation) * (body.get("n") or 1)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+
+    def message_usage(self, params):
+        """
+        Get the usage of an Anthropic-style message request, whose system blocks are cached up to the last block
+        with a cache_control breakpoint.
+        """
+        system = params.get("system") or []
+        if isinstance(system, str):
+            system = [{"type": "text", "text": system}]
+        input_tokens = (sum(count_tokens(block.get("text", "")) for block in system)
+                        + sum(count_tokens(message.get("content", "")) for message in params.get("messages", [])))
+
+        cache_read_tokens = cache_write_tokens = 0
+        breakpoints = [num for num, block in enumerate(system) if block.get("cache_control")]
+        if breakpoints:
+            prefix = system[:breakpoints[-1] + 1]
+            prefix_tokens = sum(count_tokens(block.get("text", "")) for block in prefix)
+            if self.cache_prefix(json.dumps(prefix), prefix_tokens):
+                cache_read_tokens = prefix_tokens
+            elif prefix_tokens >= self.min_cached_tokens:
+                cache_write_tokens = prefix_tokens
+
+        return {"input_tokens": input_tokens - cache_read_tokens - cache_write_tokens,
+                "cache_read_input_tokens": cache_read_tokens, "cache_creation_input_tokens": cache_write_tokens,
+                "output_tokens": count_tokens(self.generation)}
+
+    def chat_completion(self, body, usage=None):
+        """
+        Create the response to a chat completion request.
+        """
+        return {
+            "id": f"chatcmpl-stub-{self.num_requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            # Return the number of samples requested with the "n" parameter.
+            "choices": [{
+                "index": index,
+                "message": {"role": "assistant", "content": self.generation},
+                "finish_reason": "stop",
+            } for index in range(body.get("n") or 1)],
+            "usage": usage or {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    def message(self, params, usage=None):
+        """
+        Create the response to an Anthropic-style message request.
+        """
+        return {
+            "id": f"msg-stub-{uuid.uuid4().hex}",
+            "type": "message",
+            "role": "assistant",
+            "model": params.get("model", "stub"),
+            "content": [{"type": "text", "text": self.generation}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": usage or {"input_tokens": 0, "output_tokens": 0},
+        }
+
+    def generation_time(self):
+        """
+        Get the number of seconds the stub takes to generate the tokens after the first one.
+        """
+        return self.token_latency * max(len(TOKEN_REGEX.findall(self.generation)) - 1, 0)
+
+    def iter_tokens(self):
+        """
+        Split the profile into tokens, waiting the token latency before each token after the first.
+        """
+        for num, token in enumerate(TOKEN_REGEX.findall(self.generation)):
+            if num and self.token_latency:
+                time.sleep(self.token_latency)
+            yield token
+
+    def chat_completion_events(self, body):
+        """
+        Create the server-sent events of a streamed chat completion, one chunk per token.
+        """
+        chunk = {"id": f"chatcmpl-stub-{self.num_requests}", "object": "chat.completion.chunk",
+                 "created": int(time.time()), "model": body.get("model", "stub")}
+        yield None, json.dumps({**chunk, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""},
+                                                      "finish_reason": None}]})
+        for token in self.iter_tokens():
+            yield None, json.dumps({**chunk, "choices": [{"index": 0, "delta": {"content": token},
+                                                          "finish_reason": None}]})
+        yield None, json.dumps({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        yield None, "[DONE]"
+
+    def message_events(self, params):
+        """
+        Create the server-sent events of a streamed Anthropic-style message, one text delta per token.
+        """
+        message = {**self.message(params), "content": [], "stop_reason": None}
+        yield "message_start", json.dumps({"type": "message_start", "message": message})
+        yield "content_block_start", json.dumps({"type": "content_block_start", "index": 0,
+                                                 "content_block": {"type": "text", "text": ""}})
+        for token in self.iter_tokens():
+            yield "content_block_delta", json.dumps({"type": "content_block_delta", "index": 0,
+                                                     "delta": {"type": "text_delta", "text": token}})
+        yield "content_block_stop", json.dumps({"type": "content_block_stop", "index": 0})
+        yield "message_delta", json.dumps({"type": "message_delta",
+                                           "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                           "usage": {"output_tokens": 0}})
+        yield "message_stop", json.dumps({"type": "message_stop"})
+
+    def upload_file(self, data):
+        """
+        Store an uploaded file and return its file object.
+        """
+        file_id = f"file-{uuid.uuid4().hex}"
+        self.files[file_id] = data
+        return {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                "filename": "batch.jsonl", "purpose": "batch", "status": "processed"}
+
+    def create_batch(self, body):
+        """
+        Submit an OpenAI-style batch job for the requests in an uploaded job file.
+        """
+        batch_id = f"batch-{uuid.uuid4().hex}"
+        self.batches[batch_id] = {"input_file_id": body["input_file_id"], "endpoint": body["endpoint"],
+                                  "completion_window": body["completion_window"], "created_at": time.time()}
+        return self.batch_status(batch_id)
+
+    def batch_status(self, batch_id):
+        """
+        Get the batch object of an OpenAI-style batch job. Once the batch latency has passed,
+        the results are written to an output file.
+        """
+        batch = self.batches[batch_id]
+        status = {"id": batch_id, "object": "batch", "endpoint": batch["endpoint"],
+                  "input_file_id": batch["input_file_id"], "completion_window": batch["completion_window"],
+                  "created_at": int(batch["created_at"]), "status": "in_progress"}
+
+        if time.time() - batch["created_at"] >= self.batch_latency:
+            with self._lock:
+                # Answer every request in the job file once.
+                if "output_file_id" not in batch:
+                    lines = [json.loads(line) for line in self.files[batch["input_file_id"]].splitlines() if line]
+                    results = [{"id": f"batch_req-{uuid.uuid4().hex}", "custom_id": line["custom_id"],
+                                "response": {"status_code": 200, "request_id": uuid.uuid4().hex,
+                                             "body": self.chat_completion(line["body"])},
+                                "error": None} for line in lines]
+                    batch["output_file_id"] = self.upload_file(
+                        "".join(json.dumps(result) + "\n" for result in results).encode("utf-8"))["id"]
+                    batch["num_requests"] = len(lines)
+
+            status.update({"status": "completed", "output_file_id": batch["output_file_id"],
+                           "request_counts": {"total": batch["num_requests"], "completed": batch["num_requests"],
+                                              "failed": 0}})
+
+        return status
+
+    def create_message_batch(self, body):
+        """
+        Submit an Anthropic-style message batch.
+        """
+        batch_id = f"msgbatch_{uuid.uuid4().hex}"
+        self.message_batches[batch_id] = {"requests": body["requests"], "created_at": time.time()}
+        return self.message_batch_status(batch_id)
+
+    def message_batch_status(self, batch_id):
+        """
+        Get the status of an Anthropic-style message batch.
+        """
+        batch = self.message_batches[batch_id]
+        ended = time.time() - batch["created_at"] >= self.batch_latency
+        num_requests = len(batch["requests"])
+        created_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(batch["created_at"]))
+
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {"processing": 0 if ended else num_requests, "succeeded": num_requests if ended else 0,
+                               "errored": 0, "canceled": 0, "expired": 0},
+            "created_at": created_at,
+            "expires_at": created_at,
+            "ended_at": created_at if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"{self.url}/v1/messages/batches/{batch_id}/results" if ended else None,
+        }
+
+    def message_batch_results(self, batch_id):
+        """
+        Get the JSONL results of an Anthropic-style message batch.
+        """
+        results = [{"custom_id": request["custom_id"],
+                    "result": {"type": "succeeded", "message": self.message(request["params"])}}
+                   for request in self.message_batches[batch_id]["requests"]]
+        return "".join(json.dumps(result) + "\n" for result in results).encode("utf-8")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
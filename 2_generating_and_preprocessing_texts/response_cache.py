@@ -0,0 +1,154 @@
+"""
+Persistent on-disk cache of the raw responses returned by the providers.
+
+Each response is stored in SQLite under a content address computed from the model id, the full prompt
+(including the attribute prompt), the sampling parameters, and the repetition index. Rerunning the generation
+after changing only the post-processing (e.g. process_attributes) replays the responses from disk instead of
+calling the APIs again. The least recently used responses are evicted once the cache grows past its size limit.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def cache_key(model, prompt, temperature, top_p, repetition):
+    """
+    Compute the content address of a response.
+
+    :param str model: The model id e.g. "gpt-4o-mini".
+    :param str prompt: The full prompt sent to the model, including the attribute prompt.
+    :param float temperature: The sampling temperature.
+    :param float top_p: The nucleus sampling parameter.
+    :param int repetition: The repetition index of the prompt.
+
+    :return str: The SHA-256 hex digest of the key fields.
+    """
+    fields = json.dumps([model, prompt, temperature, top_p, repetition], ensure_ascii=False)
+    return hashlib.sha256(fields.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    A SQLite cache of raw provider responses with size-based LRU eviction and hit/miss statistics.
+    The cache can be shared between threads.
+    """
+
+    def __init__(self, path, max_size_bytes=500 * 1024 * 1024):
+        """
+        :param str path: The path to the SQLite database. It is created if it does not exist.
+        :param int max_size_bytes: The maximum total size of the cached responses.
+                                   The least recently used responses are evicted beyond this size.
+        """
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+
+        # Count the lookups and evictions made in this session.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created REAL, last_used REAL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+        # Keep a running total of the size of the cached responses.
+        self._size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        """
+        Look up a cached response.
+
+        :param str key: The content address from cache_key.
+
+        :return str: The raw response, or None if it is not cached.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            # Mark the response as recently used so that it is evicted last.
+            self._connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response, model=None):
+        """
+        Store a raw response, evicting the least recently used responses if the cache is too large.
+
+        :param str key: The content address from cache_key.
+        :param str response: The raw text returned by the provider.
+        :param str model: The model id, stored for inspection.
+        """
+        size = len(response.encode("utf-8"))
+        now = time.time()
+
+        with self._lock:
+            # Replacing an existing response frees its size first.
+            row = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._size -= row[0]
+
+            self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                                     (key, model, response, size, now, now))
+            self._size += size
+
+            if self._size > self.max_size_bytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        Delete the least recently used responses until the cache fits within its size limit.
+        """
+        rows = self._connection.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall()
+
+        evicted = []
+        for key, size in rows:
+            if self._size <= self.max_size_bytes:
+                break
+            evicted.append((key,))
+            self._size -= size
+
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+
+    def stats(self):
+        """
+        Get the cache statistics.
+
+        :return dict: The number of hits, misses, and evictions in this session, the hit rate,
+                      and the number of entries and total size of the responses on disk.
+        """
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "size_bytes": self._size,
+            }
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,169 @@
+"""
+Batched sentiment analysis of the generated texts.
+
+The texts of every model are streamed from the JSON files in chunks, and the polarity and subjectivity of each chunk
+are scored with TextBlob in a pool of worker processes. The JSON files are read one generation at a time by the
+streaming reader of stream_reader.py, and only a few chunks are in flight at once, so the texts are never all held
+in memory.
+
+The scores are written as columns of a Parquet table (sentiment_scores.parquet) with a row for each generation,
+instead of rewriting the nested JSON files. The table also records the SHA-256 hash of each scored text, and serves
+as the cache of the next run: texts whose hash is already in the table are never scored again. The columnar store
+of corpus_store.py and the out-of-core aggregates of streaming_aggregation.py (e.g. the polarity tables of stage 5)
+take the polarity and subjectivity of their rows from this table. Delete the table to score every text again.
+"""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+import pandas as pd
+from textblob import TextBlob
+
+from corpus_store import SCORES_NAME, SOURCE_DIR, get_source_files, hash_text, iter_generation_rows
+
+# The path of the table of sentiment scores.
+SCORES_PATH = os.path.join(SOURCE_DIR, SCORES_NAME)
+
+# The number of texts scored at once by a worker.
+CHUNK_SIZE = 250
+
+# The columns that identify a generation.
+KEY_COLUMNS = ["model", "bias_type", "group_with_gender", "key"]
+# The columns of the table of sentiment scores.
+SCORE_COLUMNS = KEY_COLUMNS + ["text_hash", "polarity", "subjectivity"]
+
+
+def score_texts(texts):
+    """
+    Score the sentiment of a chunk of texts with TextBlob. Runs in the worker processes.
+
+    :param list[str] texts: The texts to score.
+
+    :return list[tuple]: The polarity and subjectivity of each text.
+    """
+    # The polarity and subjectivity properties each analyze the text again, so both are taken from one analysis.
+    return [tuple(TextBlob(text).sentiment) for text in texts]
+
+
+def iter_generations(json_paths, source_dir=SOURCE_DIR):
+    """
+    Stream the generations that have attributes from the JSON files, one file at a time.
+    Refusals and texts without attributes are not scored.
+
+    :return iterator[dict]: The key columns and the generated text of each generation.
+    """
+    for json_path in json_paths:
+        for row in iter_generation_rows(json_path, source_dir):
+            if row["has_attributes"]:
+                yield {column: row[column] for column in KEY_COLUMNS + ["generated_text"]}
+
+
+def iter_chunks(rows, chunk_size):
+    """
+    Split a stream of rows into lists of at most chunk_size rows.
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def load_cached_scores(scores_path=SCORES_PATH):
+    """
+    Load the scores of the last run by the hash of their text.
+
+    :return dict: The polarity and subjectivity of each text hash, or an empty dict if there is no table yet.
+    """
+    if not os.path.exists(scores_path):
+        return {}
+    scores_df = pd.read_parquet(scores_path, columns=["text_hash", "polarity", "subjectivity"])
+    return dict(zip(scores_df["text_hash"], zip(scores_df["polarity"], scores_df["subjectivity"])))
+
+
+def score_corpus(json_paths=None, source_dir=SOURCE_DIR, scores_path=SCORES_PATH, chunk_size=CHUNK_SIZE,
+                 max_workers=None):
+    """
+    Score the sentiment of every generated text that is not in the cache, and save the table of scores.
+
+    :param list[str] json_paths: The JSON files to score. If None, the files of every model and bias type are scored.
+    :param str source_dir: The folder the model folders are in.
+    :param str scores_path: The path of the table of scores, which is also the cache of the scores.
+    :param int chunk_size: The number of texts scored at once by a worker.
+    :param int max_workers: The number of worker processes. Defaults to the number of CPU cores.
+                            If 1, the texts are scored in the current process.
+
+    :return tuple: The table of scores with a row for each generation, and the statistics of the run
+                   (the number of texts, of texts scored and taken from the cache, the seconds, and the texts/s).
+    """
+    start = time.perf_counter()
+    json_paths = json_paths if json_paths is not None else get_source_files(source_dir)
+    max_workers = max_workers if max_workers is not None else os.cpu_count()
+    cache = load_cached_scores(scores_path)
+
+    rows = []
+    num_scored = 0
+
+    def add_scores(chunk, hashes, scores):
+        # Cache the new scores, and add the scores of every text of the chunk to the table.
+        nonlocal num_scored
+        num_scored += len(scores)
+        cache.update(scores)
+        for row, text_hash in zip(chunk, hashes):
+            rows.append([row[column] for column in KEY_COLUMNS] + [text_hash, *cache[text_hash]])
+
+    def split_chunk(chunk):
+        # Hash the texts of a chunk, and find the distinct texts that are not in the cache.
+        hashes = [hash_text(row["generated_text"]) for row in chunk]
+        uncached = {}
+        for row, text_hash in zip(chunk, hashes):
+            if text_hash not in cache:
+                uncached.setdefault(text_hash, row["generated_text"])
+        return hashes, uncached
+
+    chunks = iter_chunks(iter_generations(json_paths, source_dir), chunk_size)
+    if max_workers == 1:
+        for chunk in chunks:
+            hashes, uncached = split_chunk(chunk)
+            add_scores(chunk, hashes, dict(zip(uncached, score_texts(list(uncached.values())))))
+    else:
+        # Keep a few chunks in flight for each worker, so that the stream is never read far ahead.
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = {}
+            for chunk in chunks:
+                hashes, uncached = split_chunk(chunk)
+                future = executor.submit(score_texts, list(uncached.values()))
+                in_flight[future] = (chunk, hashes, list(uncached))
+                if len(in_flight) >= 2 * max_workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        chunk, hashes, text_hashes = in_flight.pop(future)
+                        add_scores(chunk, hashes, dict(zip(text_hashes, future.result())))
+            for future, (chunk, hashes, text_hashes) in in_flight.items():
+                add_scores(chunk, hashes, dict(zip(text_hashes, future.result())))
+
+    # Write the table to a temporary file first and then swap it in.
+    scores_df = pd.DataFrame(rows, columns=SCORE_COLUMNS).sort_values(KEY_COLUMNS, ignore_index=True)
+    scores_df.to_parquet(scores_path + ".tmp", index=False)
+    os.replace(scores_path + ".tmp", scores_path)
+
+    seconds = time.perf_counter() - start
+    stats = {"texts": len(rows), "scored": num_scored, "cached": len(rows) - num_scored, "seconds": seconds,
+             "texts_per_second": len(rows) / seconds if seconds > 0 else float("inf")}
+    return scores_df, stats
+
+
+def print_report(stats, max_workers=None):
+    """
+    Print the statistics of a run of score_corpus.
+    """
+    workers = max_workers if max_workers is not None else os.cpu_count()
+    print(f"Sentiment: {stats['texts']} texts in {stats['seconds']:.1f} s ({stats['texts_per_second']:,.0f} texts/s) "
+          f"with {workers} worker(s), {stats['scored']} scored and {stats['cached']} from the cache.")
+
+
+if __name__ == "__main__":
+    _, stats = score_corpus()
+    print_report(stats)
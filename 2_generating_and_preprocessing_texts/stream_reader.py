@@ -0,0 +1,126 @@
+"""
+Streaming reader for the generation files.
+
+The generations are read incrementally, one at a time, instead of loading a whole group file into one dict with
+json.load. Two formats are read:
+
+- the JSON files written by the generation notebook, with an object of generations keyed by prompt number and
+  repetition, e.g. {"0_0": {"generated_text": ..., "attributes": {...}}, "0_1": ...}.
+- JSON Lines files (.jsonl) with one generation per line and its key in the "key" field,
+  e.g. {"key": "0_0", "generated_text": ..., "attributes": {...}}, which can be appended to while generating.
+
+The JSON files are parsed with the decoder of the json module, one key and one generation at a time, from a read
+buffer of BUFFER_SIZE characters. Only the buffer and the generation being parsed are held in memory, so the memory
+used by the reader does not depend on the number of generations in the file.
+"""
+import json
+import re
+
+# The number of characters read from a JSON file at once.
+BUFFER_SIZE = 1 << 16
+
+# The decoder of the keys and the generations.
+DECODER = json.JSONDecoder()
+# The whitespace between the tokens of a JSON file.
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def iter_json_generations(json_path, buffer_size=BUFFER_SIZE):
+    """
+    Stream the generations of a JSON file of generations, without loading the whole file.
+
+    :param str json_path: The path to the JSON file e.g. "gpt_4o_mini/implicit/male.json".
+    :param int buffer_size: The number of characters read from the file at once.
+
+    :return iterator[tuple]: The key (e.g. "0_0") and the dictionary of each generation, in the order of the file.
+    """
+    with open(json_path, encoding="utf-8") as f:
+        buffer, position, at_end = "", 0, False
+
+        def read_more():
+            # Drop the part of the buffer that was parsed, and read the next part of the file.
+            nonlocal buffer, position, at_end
+            chunk = f.read(buffer_size)
+            buffer, position, at_end = buffer[position:] + chunk, 0, not chunk
+
+        def next_token():
+            # Skip the whitespace, and get the next character without consuming it ("" at the end of the file).
+            nonlocal position
+            while True:
+                position = WHITESPACE.match(buffer, position).end()
+                if position < len(buffer) or at_end:
+                    return buffer[position:position + 1]
+                read_more()
+
+        def decode():
+            # Decode the JSON value at the current position, reading more of the file until the value is complete.
+            nonlocal position
+            while True:
+                try:
+                    value, end = DECODER.raw_decode(buffer, position)
+                    # A number at the end of the buffer may continue in the next part of the file.
+                    if end < len(buffer) or at_end:
+                        position = end
+                        return value
+                except json.JSONDecodeError:
+                    if at_end:
+                        raise
+                read_more()
+
+        if next_token() != "{":
+            raise ValueError(f"{json_path} is not a JSON object of generations.")
+        position += 1
+
+        while True:
+            token = next_token()
+            if token == "}":
+                return
+            if token == ",":
+                position += 1
+                continue
+            if not token:
+                raise ValueError(f"{json_path} ends before the end of its generations.")
+
+            # Parse the key and the generation.
+            key = decode()
+            if next_token() != ":":
+                raise ValueError(f"Expected ':' after the key {key!r} in {json_path}.")
+            position += 1
+            next_token()
+            yield key, decode()
+
+
+def iter_jsonl_generations(jsonl_path):
+    """
+    Stream the generations of a JSON Lines file, with one generation and its key on each line.
+
+    :return iterator[tuple]: The key (e.g. "0_0") and the dictionary of each generation, in the order of the file.
+    """
+    with open(jsonl_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                generation = json.loads(line)
+                yield generation.pop("key"), generation
+
+
+def iter_generations(path, buffer_size=BUFFER_SIZE):
+    """
+    Stream the generations of a generation file, either a JSON file or a JSON Lines file (.jsonl).
+
+    :return iterator[tuple]: The key and the dictionary of each generation, in the order of the file.
+    """
+    if path.endswith(".jsonl"):
+        return iter_jsonl_generations(path)
+    return iter_json_generations(path, buffer_size)
+
+
+def write_jsonl_generations(jsonl_path, generations):
+    """
+    Write generations to a JSON Lines file, one at a time.
+
+    :param str jsonl_path: The path of the JSON Lines file.
+    :param iterable[tuple] generations: The key and the dictionary of each generation.
+    """
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for key, generation in generations:
+            f.write(json.dumps({"key": key, **generation}) + "\n")
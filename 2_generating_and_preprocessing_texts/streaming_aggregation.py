@@ -0,0 +1,216 @@
+"""
+Out-of-core aggregation of the generated texts with a fixed memory ceiling.
+
+The generation files are streamed one generation at a time by stream_reader.py, and flattened into chunks of at most
+CHUNK_SIZE rows. Each chunk is aggregated and then dropped, so the memory used depends on the chunk size and on the
+number of groups and attribute values, never on the number of generations. This is how the counts, pivot tables,
+and statistics are computed for runs that are too large to load whole.
+
+- count_values counts the texts with each value of an attribute for each group, i.e. a pivot table, with the
+  refusals counted as the "refusal" value. The counts of the chunks are added up.
+- describe_values computes the number of texts, the median, the standard deviation, and the percentage of texts
+  without a value of a numerical attribute (e.g. polarity) for each group. The standard deviation is merged from the
+  count, mean, and sum of squared deviations of each chunk. The median is exact: while the files are read, the group
+  and value of each text are spilled to a temporary file (12 bytes per text), which is then read back in chunks
+  twice, once to count the values of each group in a histogram of MEDIAN_BINS bins over their range, and once to
+  keep only the values in the bins of the middle values.
+
+The polarity and subjectivity are taken from the table of sentiment scores written by sentiment_stage.py, which no
+longer writes them into the JSON files, in the same way as the columnar store of corpus_store.py does. Only the key,
+hash, and score columns of the table are held in memory, and only when a chunk has a polarity or subjectivity column.
+"""
+import itertools
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from corpus_store import (CORPUS_COLUMNS, SCORE_KEY_COLUMNS, SCORES_NAME, SOURCE_DIR, apply_sentiment_scores,
+                          classify_refusals, iter_generation_rows, load_sentiment_scores)
+
+# The number of generations in each chunk.
+CHUNK_SIZE = 10000
+
+# The number of bins of the histogram that locates the median.
+MEDIAN_BINS = 4096
+# The row of the group and the value of each text in the spill file of describe_values.
+SPILL_RECORD = np.dtype([("row", "<i4"), ("value", "<f8")])
+
+
+def iter_chunks(json_paths, columns=None, chunk_size=CHUNK_SIZE, source_dir=SOURCE_DIR, categories=None):
+    """
+    Stream the generations of the generation files as dataframes of at most chunk_size rows.
+
+    :param list[str] json_paths: The generation files (JSON or JSON Lines) to read.
+    :param list[str] columns: The columns of the chunks. If None, every column in CORPUS_COLUMNS is kept.
+    :param int chunk_size: The number of generations in each chunk.
+    :param str source_dir: The folder the model folders are in.
+    :param dict categories: The category of each JSON file from corpus_store.get_group_categories.
+
+    :return iterator[pd.DataFrame]: The chunks, with the refusal flags of their texts, and the sentiment scores of
+                                    the table of scores when there is one.
+    """
+    # Take the sentiment scores from the table of scores if the chunks have them and there is one.
+    scores_df = None
+    if columns is None or {"polarity", "subjectivity"} & set(columns):
+        scores_df = load_sentiment_scores(os.path.join(source_dir, SCORES_NAME))
+
+    # Only the requested columns are copied into the chunks, the texts only if the refusals or scores are requested,
+    # and the keys only if the scores are requested.
+    chunk_columns = CORPUS_COLUMNS
+    if columns is not None:
+        needed = set(columns) | ({"generated_text", "has_attributes"} if "refusal" in columns else set())
+        if scores_df is not None:
+            needed |= set(SCORE_KEY_COLUMNS) | {"generated_text"}
+        chunk_columns = [column for column in CORPUS_COLUMNS if column in needed]
+
+    rows = itertools.chain.from_iterable(iter_generation_rows(json_path, source_dir, categories)
+                                         for json_path in json_paths)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        chunk_df = pd.DataFrame(chunk, columns=chunk_columns)
+        if "refusal" in chunk_columns:
+            chunk_df["refusal"] = classify_refusals(chunk_df["generated_text"], chunk_df["has_attributes"])
+        if scores_df is not None:
+            chunk_df = apply_sentiment_scores(chunk_df, scores_df)
+        yield chunk_df if columns is None else chunk_df[columns]
+
+
+def count_values(json_paths, by, attribute, chunk_size=CHUNK_SIZE, source_dir=SOURCE_DIR, categories=None):
+    """
+    Count the texts with each value of a categorical attribute for each group, one chunk at a time.
+
+    :param list[str] json_paths: The generation files to read.
+    :param str by: The column of the groups e.g. "group" or "gender".
+    :param str attribute: The attribute to count e.g. "religion".
+
+    :return pd.DataFrame: The pivot table of the counts, with a row for each group in the order of the files and a
+                          column for each value, including "refusal". The texts without a value that are not
+                          refusals are not counted.
+    """
+    counts = None
+    groups = {}
+    for chunk_df in iter_chunks(json_paths, [by, attribute, "refusal"], chunk_size, source_dir, categories):
+        groups.update(dict.fromkeys(chunk_df[by].unique()))
+
+        # Count the refusals as a value of the attribute.
+        values = chunk_df[attribute].astype(object).where(~chunk_df["refusal"], "refusal")
+        chunk_counts = values.groupby(chunk_df[by]).value_counts()
+        counts = chunk_counts if counts is None else counts.add(chunk_counts, fill_value=0)
+
+    if counts is None:
+        return pd.DataFrame()
+    return counts.unstack(fill_value=0).reindex(list(groups), fill_value=0).astype(int)
+
+
+def iter_values(json_paths, by, attribute, chunk_size, source_dir, categories):
+    # Stream the groups of the texts and the values of a numerical attribute (NaN if missing) one chunk at a time.
+    for chunk_df in iter_chunks(json_paths, [by, attribute], chunk_size, source_dir, categories):
+        yield chunk_df[by].to_numpy(dtype=object), pd.to_numeric(chunk_df[attribute]).to_numpy(dtype=float)
+
+
+def iter_spilled_values(spill_file, chunk_size):
+    # Read the rows of the groups and the values back from the spill file one chunk at a time.
+    spill_file.seek(0)
+    while True:
+        records = np.frombuffer(spill_file.read(chunk_size * SPILL_RECORD.itemsize), dtype=SPILL_RECORD)
+        if not len(records):
+            return
+        yield records["row"], records["value"]
+
+
+def get_bins(values, low, high, bins):
+    """
+    Get the histogram bin of each value for the range of the values of its group.
+    """
+    width = np.where(high > low, high - low, 1.0)
+    return np.clip(((values - low) / width * bins).astype(int), 0, bins - 1)
+
+
+def describe_values(json_paths, by, attribute, chunk_size=CHUNK_SIZE, bins=MEDIAN_BINS, source_dir=SOURCE_DIR,
+                    categories=None):
+    """
+    Describe a numerical attribute for each group in one pass over the files, one chunk at a time.
+
+    :param list[str] json_paths: The generation files to read.
+    :param str by: The column of the groups e.g. "group".
+    :param str attribute: The numerical attribute e.g. "polarity".
+    :param int bins: The number of bins of the histogram that locates the median.
+
+    :return pd.DataFrame: A row for each group in the order of the files, with the number of texts ("num_texts"),
+                          the number of values ("num_values"), the median, the population standard deviation
+                          ("std"), and the percentage of texts without a value ("missing_percentage"). The median and
+                          standard deviation are NaN for the groups without values.
+    """
+    groups = {}
+    num_texts, num_values = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    means, m2s, low, high = np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0)
+
+    with tempfile.TemporaryFile() as spill_file:
+        # Read the files once: merge the count, mean, sum of squared deviations, and range of each chunk,
+        # and spill the row of the group and the value of each text to the spill file.
+        for chunk_groups, values in iter_values(json_paths, by, attribute, chunk_size, source_dir, categories):
+            rows = np.array([groups.setdefault(group, len(groups)) for group in chunk_groups], dtype=np.int32)
+            if len(groups) > len(num_texts):
+                new = len(groups) - len(num_texts)
+                num_texts, num_values = np.append(num_texts, [0] * new), np.append(num_values, [0] * new)
+                means, m2s = np.append(means, [0.0] * new), np.append(m2s, [0.0] * new)
+                low, high = np.append(low, [np.inf] * new), np.append(high, [-np.inf] * new)
+            num_texts += np.bincount(rows, minlength=len(groups))
+
+            present = ~np.isnan(values)
+            rows, values = rows[present], values[present]
+            counts = np.bincount(rows, minlength=len(groups))
+            chunk_means = np.bincount(rows, weights=values, minlength=len(groups)) / np.maximum(counts, 1)
+            chunk_m2s = np.bincount(rows, weights=(values - chunk_means[rows]) ** 2, minlength=len(groups))
+            totals = num_values + counts
+            deltas = chunk_means - means
+            m2s += chunk_m2s + deltas ** 2 * num_values * counts / np.maximum(totals, 1)
+            means += np.where(counts > 0, deltas * counts / np.maximum(totals, 1), 0.0)
+            num_values = totals
+            np.minimum.at(low, rows, values)
+            np.maximum.at(high, rows, values)
+
+            records = np.empty(len(values), dtype=SPILL_RECORD)
+            records["row"], records["value"] = rows, values
+            spill_file.write(records.tobytes())
+
+        # Read the spill file back to count the values of each group in its histogram.
+        histograms = np.zeros((len(groups), bins), dtype=np.int64)
+        for rows, values in iter_spilled_values(spill_file, chunk_size):
+            np.add.at(histograms, (rows, get_bins(values, low[rows], high[rows], bins)), 1)
+
+        # Find the bins of the two middle values of each group (the same value if the number of values is odd).
+        cumulative = histograms.cumsum(axis=1)
+        ranks = np.stack([(num_values - 1) // 2, num_values // 2], axis=1)
+        middle_bins = np.array([[np.searchsorted(cumulative[row], rank, side="right") for rank in ranks[row]]
+                                for row in range(len(groups))], dtype=np.int64).reshape(len(groups), 2)
+        below = np.where(middle_bins > 0, np.take_along_axis(cumulative, np.maximum(middle_bins - 1, 0), axis=1), 0)
+
+        # Read the spill file back again to keep only the values in the bins of the middle values.
+        middle_values = [[] for _ in range(len(groups))]
+        for rows, values in iter_spilled_values(spill_file, chunk_size):
+            value_bins = get_bins(values, low[rows], high[rows], bins)
+            kept = (value_bins == middle_bins[rows, 0]) | (value_bins == middle_bins[rows, 1])
+            for row, value in zip(rows[kept], values[kept]):
+                middle_values[row].append(value)
+
+    # Pick the middle values by their rank within the kept values, which start at the lower middle bin.
+    medians = np.full(len(groups), np.nan)
+    for row, values in enumerate(middle_values):
+        if num_values[row] == 0:
+            continue
+        values = np.sort(values)
+        offset = below[row, 0]
+        medians[row] = (values[ranks[row, 0] - offset] + values[ranks[row, 1] - offset]) / 2
+
+    return pd.DataFrame({
+        "num_texts": num_texts,
+        "num_values": num_values,
+        "median": medians,
+        "std": np.where(num_values > 0, np.sqrt(m2s / np.maximum(num_values, 1)), np.nan),
+        "missing_percentage": (num_texts - num_values) / np.maximum(num_texts, 1) * 100,
+    }, index=list(groups))
@@ -0,0 +1,301 @@
+"""
+Streaming generation mode, which parses the attributes while the tokens of a response are still arriving.
+
+Without streaming, a generation waits for the whole completion before the attributes are parsed. In streaming mode,
+the response is requested as server-sent events, and its text deltas are fed to an AttributeBlockDetector as they
+arrive. The detector finds the "Attributes" block at the end of the text and parses it as soon as its last line
+(the height) is complete, instead of after the response has ended. Each response records:
+
+- the time to first token: from sending the request to the first text delta.
+- the time to attributes: from sending the request to the moment the attributes block was complete.
+- the total time: from sending the request to the end of the stream.
+
+By default the stream is read to the end, so the text is exactly the text of the non-streaming request. With
+stop_at_attributes, the stream is closed as soon as the attributes are complete, which cuts the generation at the end
+of the block and saves the time (and tokens) of anything the model adds after it.
+
+StreamingGenerate wraps a stream function (stream_openai, stream_anthropic, or stream_cohere) into a generate
+function for the GenerationEngine, which returns the text and keeps the timings of each response. The stream
+functions use the shared SDK clients of provider_clients.py, and can be tested offline against the SSE responses
+of the local provider stub (provider_stub.py).
+"""
+import re
+import statistics
+import threading
+import time
+
+from attribute_parser import ATTRIBUTE_LIST_PATTERN, parse_attributes
+from generation_engine import PROVIDERS, SAMPLING_PARAMS, SYSTEM_PROMPT
+from provider_clients import resolve_client
+
+# The word that starts the list of attributes in a response.
+ATTRIBUTES_MARKER = "Attributes"
+
+# The attribute list after the marker, with the six lines from the occupation to the height.
+ATTRIBUTE_BLOCK_REGEX = re.compile(r"[:\s]*(" + ATTRIBUTE_LIST_PATTERN + r")")
+# The last group is the inches of the height, which are complete once any character follows them.
+INCHES_GROUP = ATTRIBUTE_BLOCK_REGEX.groups
+
+
+class AttributeBlockDetector:
+    """
+    Accumulates the text deltas of a response and detects when its attributes block is complete.
+    """
+
+    def __init__(self):
+        self.text = ""
+        # The position after the last "Attributes" marker found so far.
+        self.block_start = None
+        # The record of the attributes, once the block is complete.
+        self.attributes = None
+
+    def feed(self, delta):
+        """
+        Add a text delta to the response.
+
+        :param str delta: The next part of the text.
+
+        :return bool: Whether the attributes block is complete. Once it is, the deltas are only accumulated.
+        """
+        # Only the end of the previous text can start a marker that continues in the delta.
+        search_start = max(0, len(self.text) - len(ATTRIBUTES_MARKER) + 1)
+        self.text += delta
+        if self.attributes is not None:
+            return True
+        return self.detect(search_start, at_end=False)
+
+    def finish(self):
+        """
+        End the response. The height may be the last characters of the text.
+
+        :return bool: Whether the response has a complete attributes block.
+        """
+        if self.attributes is not None:
+            return True
+        return self.detect(len(self.text), at_end=True)
+
+    def detect(self, search_start, at_end):
+        """
+        Look for the attributes block after the last marker, and parse it if it is complete.
+        """
+        # Start the block after the last marker, as the text itself may mention the word.
+        position = self.text.rfind(ATTRIBUTES_MARKER, search_start)
+        if position >= 0:
+            self.block_start = position + len(ATTRIBUTES_MARKER)
+        if self.block_start is None:
+            return False
+
+        # The block is complete when the inches of the height are followed by another character.
+        match = ATTRIBUTE_BLOCK_REGEX.match(self.text, self.block_start)
+        if match is None or (match.end(INCHES_GROUP) == len(self.text) and not at_end):
+            return False
+
+        self.attributes = parse_attributes(match.group(1).strip())
+        return True
+
+
+class StreamedResponse:
+    """
+    The text of a streamed response, its attributes, and its timings in seconds.
+    """
+
+    def __init__(self, text, attributes, time_to_first_token, time_to_attributes, total_time, stopped_early):
+        self.text = text
+        # The AttributeRecord parsed from the block, or None if the block never completed (e.g. a refusal).
+        self.attributes = attributes
+        self.time_to_first_token = time_to_first_token
+        self.time_to_attributes = time_to_attributes
+        self.total_time = total_time
+        # Whether the stream was closed as soon as the attributes were complete.
+        self.stopped_early = stopped_early
+
+    def timings(self):
+        """
+        Get the timings of the response as a dictionary.
+        """
+        return {"time_to_first_token": self.time_to_first_token, "time_to_attributes": self.time_to_attributes,
+                "total_time": self.total_time, "stopped_early": self.stopped_early}
+
+
+def consume_stream(deltas, stop_at_attributes=False):
+    """
+    Read the text deltas of a response, parsing its attributes as soon as the block is complete.
+
+    :param iterator[str] deltas: The text deltas of the response. The request is sent when the first delta is read.
+    :param bool stop_at_attributes: Whether to close the stream as soon as the attributes are complete.
+
+    :return StreamedResponse: The text, the attributes, and the timings of the response.
+    """
+    start = time.perf_counter()
+    detector = AttributeBlockDetector()
+    time_to_first_token = time_to_attributes = None
+    stopped_early = False
+
+    try:
+        for delta in deltas:
+            if not delta:
+                continue
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start
+            if detector.feed(delta) and time_to_attributes is None:
+                time_to_attributes = time.perf_counter() - start
+                if stop_at_attributes:
+                    stopped_early = True
+                    break
+        # The height of a block at the very end of the text is only complete when the stream ends.
+        if time_to_attributes is None and detector.finish():
+            time_to_attributes = time.perf_counter() - start
+    finally:
+        # Close the stream, which closes the connection of a response that was stopped early.
+        close = getattr(deltas, "close", None)
+        if close is not None:
+            close()
+
+    return StreamedResponse(detector.text, detector.attributes, time_to_first_token, time_to_attributes,
+                            time.perf_counter() - start, stopped_early)
+
+
+def stream_openai(client, model, temperature=SAMPLING_PARAMS["temperature"], top_p=SAMPLING_PARAMS["top_p"]):
+    """
+    Create a stream function for an OpenAI-compatible chat completion API (OpenAI and DeepInfra).
+
+    :param client: The OpenAI client e.g. clients.get("openai"), or the provider name "openai" to get the shared
+                   client when the first prompt is sent.
+    :param str model: The model e.g. "gpt-4o-mini".
+
+    :return callable: A function that takes a prompt and returns an iterator of the text deltas of the response.
+    """
+    def stream(prompt):
+        response = resolve_client(client).chat.completions.create(
+            model=model,
+            messages=[{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+            temperature=temperature,
+            top_p=top_p,
+            stream=True,
+        )
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            response.close()
+
+    return stream
+
+
+def stream_anthropic(client, model, max_tokens=1000, temperature=SAMPLING_PARAMS["temperature"],
+                     top_p=SAMPLING_PARAMS["top_p"]):
+    """
+    Create a stream function for the Anthropic messages API.
+
+    :param client: The Anthropic client e.g. clients.get("anthropic"), or the provider name "anthropic" to get the
+                   shared client when the first prompt is sent.
+    :param str model: The model e.g. "claude-3-5-sonnet-20240620".
+    :param int max_tokens: The maximum number of tokens of the response. With stop_at_attributes, the tokens after
+                           the attributes block are never generated, whatever the maximum.
+
+    :return callable: A function that takes a prompt and returns an iterator of the text deltas of the response.
+    """
+    def stream(prompt):
+        response = resolve_client(client).messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            system=SYSTEM_PROMPT,
+            messages=[{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+            stream=True,
+        )
+        try:
+            for event in response:
+                if event.type == "content_block_delta" and event.delta.type == "text_delta":
+                    yield event.delta.text
+        finally:
+            response.close()
+
+    return stream
+
+
+def stream_cohere(client, model, temperature=SAMPLING_PARAMS["temperature"], top_p=SAMPLING_PARAMS["top_p"]):
+    """
+    Create a stream function for the Cohere chat API.
+
+    :param client: The Cohere client e.g. clients.get("cohere"), or the provider name "cohere" to get the shared
+                   client when the first prompt is sent.
+    :param str model: The model e.g. "command-r-plus".
+
+    :return callable: A function that takes a prompt and returns an iterator of the text deltas of the response.
+    """
+    def stream(prompt):
+        for event in resolve_client(client).chat_stream(message=prompt, model=model, temperature=temperature, p=top_p):
+            if event.event_type == "text-generation":
+                yield event.text
+
+    return stream
+
+
+class StreamingGenerate:
+    """
+    A generate function for the GenerationEngine that streams each response and records its timings.
+    Like the other generate functions, it returns the raw text, so the responses are cached and post-processed
+    in the same way.
+    """
+
+    def __init__(self, provider, stream, model=None, stop_at_attributes=False):
+        """
+        :param str provider: The provider whose rate limit the function shares e.g. "anthropic".
+        :param callable stream: A function that takes a prompt and returns an iterator of the text deltas of the
+                                response e.g. stream_anthropic("anthropic", "claude-3-5-sonnet-20240620").
+        :param str model: The model id used in the response cache key. Defaults to the provider's model.
+        :param bool stop_at_attributes: Whether to close each stream as soon as its attributes are complete. The
+                                        truncated responses are cached under the model id with a
+                                        " (stopped at attributes)" suffix.
+        """
+        self.provider = provider
+        model = model if model is not None else PROVIDERS.get(provider, {}).get("model", provider)
+        # The responses cut at the attributes are kept separate from the full responses in the cache.
+        self.model = f"{model} (stopped at attributes)" if stop_at_attributes else model
+        self.stream = stream
+        self.stop_at_attributes = stop_at_attributes
+        # The timings of each response, in the order the responses finished.
+        self.timings = []
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt):
+        response = consume_stream(self.stream(prompt), self.stop_at_attributes)
+        with self._lock:
+            self.timings.append(response.timings())
+        return response.text
+
+
+def summarize_timings(timings):
+    """
+    Summarize the timings of streamed responses.
+
+    :param list[dict] timings: The timings of each response from StreamedResponse.timings.
+
+    :return dict: The number of responses, the number whose attributes were found, and the mean and median
+                  time to first token, time to attributes, and total time in seconds.
+    """
+    summary = {"responses": len(timings),
+               "with_attributes": sum(timing["time_to_attributes"] is not None for timing in timings)}
+    for name in ["time_to_first_token", "time_to_attributes", "total_time"]:
+        values = [timing[name] for timing in timings if timing[name] is not None]
+        summary[f"mean_{name}"] = statistics.mean(values) if values else None
+        summary[f"median_{name}"] = statistics.median(values) if values else None
+    return summary
+
+
+def print_timings(timings, name="Streaming"):
+    """
+    Print the summary of the timings of streamed responses in milliseconds.
+    """
+    summary = summarize_timings(timings)
+    parts = []
+    for label, key in [("first token", "time_to_first_token"), ("attributes", "time_to_attributes"),
+                       ("total", "total_time")]:
+        if summary[f"mean_{key}"] is not None:
+            parts.append(f"{label} {summary[f'mean_{key}'] * 1000:.1f} ms "
+                         f"(median {summary[f'median_{key}'] * 1000:.1f} ms)")
+    print(f"{name}: {summary['responses']} responses, {summary['with_attributes']} with attributes; mean "
+          + ", ".join(parts))
@@ -0,0 +1,48 @@
+"""
+Benchmark the vectorized binomial engine against calling scipy's binomtest once per test.
+
+The grid of tests in binomial_test_results.csv is repeated SCALE times, as if there were SCALE times more models
+and groups. The script checks that the engine returns exactly the same p-values as binomtest for a sample of the
+tests, then times both over the sample and the engine over the whole grid.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.stats import binomtest
+
+from binomial_engine import binomtest_pvalues
+
+# The number of times the grid of tests is repeated.
+SCALE = 100
+# The number of tests that are also run with binomtest.
+SAMPLE_SIZE = 5000
+
+# Read the successes, trials, and reference values of every test with trials and a reference value.
+results_df = pd.read_csv("binomial_test_results.csv")
+results_df = results_df[(results_df["trials"] > 0) & (results_df["reference_value"] != -1)]
+k = np.tile(results_df["successes"].to_numpy(), SCALE)
+n = np.tile(results_df["trials"].to_numpy(), SCALE)
+p = np.tile(results_df["reference_value"].to_numpy(), SCALE)
+
+# Vary the counts of the repeated grids so that the tests are not all the same.
+rng = np.random.default_rng(0)
+k = rng.binomial(n, np.clip(k / n + rng.normal(0, 0.1, k.shape), 0, 1))
+
+# Run a sample of the tests with binomtest and check that the engine agrees on every one of them.
+sample = rng.choice(len(k), size=min(SAMPLE_SIZE, len(k)), replace=False)
+start = time.perf_counter()
+expected = np.array([binomtest(int(k[i]), int(n[i]), float(p[i])).pvalue for i in sample])
+binomtest_time = time.perf_counter() - start
+mismatches = np.sum(binomtest_pvalues(k[sample], n[sample], p[sample]) != expected)
+print(f"Tests: {len(k)}, mismatches with binomtest in a sample of {len(sample)}: {mismatches}")
+
+# Time the engine over the whole grid.
+start = time.perf_counter()
+binomtest_pvalues(k, n, p)
+engine_time = time.perf_counter() - start
+
+binomtest_throughput = len(sample) / binomtest_time
+engine_throughput = len(k) / engine_time
+print(f"binomtest once per test: {binomtest_throughput:,.0f} tests/s")
+print(f"Vectorized engine: {engine_throughput:,.0f} tests/s ({engine_throughput / binomtest_throughput:.0f}x)")
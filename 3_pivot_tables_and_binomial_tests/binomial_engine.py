@@ -0,0 +1,255 @@
+"""
+Vectorized engine for the binomial tests over the whole grid of results.
+
+Instead of calling scipy's binomtest once per test, the engine collects the number of successes, the number of
+trials, and the reference value of every test into arrays, and computes all of the exact two-sided p-values at
+once. It follows the same steps as binomtest (the same binomial PMF, CDF, and survival function calls, and the same
+binary search for the tail on the other side of the mode), so the p-values are bit-for-bit identical to binomtest.
+"""
+import ast
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.stats import binom
+
+# The relative tolerance binomtest uses when comparing the probabilities of the outcomes.
+RELATIVE_ERROR = 1 + 1e-7
+
+# The demographic groups and their categories. The name of a set of counts contains the name of its group.
+INPUT_ATTRIBUTES = {
+    'female': 'gender',
+    'male': 'gender',
+    'white': 'ethnicity_and_race',
+    'black': 'ethnicity_and_race',
+    'hispanic': 'ethnicity_and_race',
+    'asian': 'ethnicity_and_race',
+    'neutral': 'ethnicity_and_race',
+    'baby_boomer': 'age',
+    'generation_x': 'age',
+    'millennial': 'age',
+    'generation_z': 'age',
+    'generation_alpha': 'age',
+}
+
+# The output attributes that are tested.
+OUTPUT_ATTRIBUTES = ['sexual_orientation', 'religion', 'socioeconomic_status', 'politics']
+
+# The columns of the results in the order of binomial_test_results.csv.
+RESULT_COLUMNS = ["test", "p_value", "counts", "input_attribute", "input_attribute_category", "output_attribute",
+                  "output_attribute_category", "successes", "trials", "reference_value"]
+
+
+def _binary_search(values, d, lo, hi):
+    """
+    Run the binary search of binomtest for every test at once.
+
+    :param callable values: A function returning the value of each test at the given points, in ascending order
+                            between lo and hi.
+    :param np.ndarray d: The value to search for in each test.
+    :param np.ndarray lo: The lower end of the range to search in each test.
+    :param np.ndarray hi: The higher end of the range to search in each test.
+
+    :return np.ndarray: The index i of each test between lo and hi such that values(i) <= d < values(i + 1).
+    """
+    lo = lo.copy()
+    hi = hi.copy()
+    found = np.full(lo.shape, np.nan)
+
+    # Halve the range of every test that has not been found yet.
+    active = lo < hi
+    while active.any():
+        mid = lo + (hi - lo) // 2
+        midval = values(mid)
+        below = active & (midval < d)
+        above = active & (midval > d)
+        equal = active & ~below & ~above
+        lo = np.where(below, mid + 1, lo)
+        hi = np.where(above, mid - 1, hi)
+        found = np.where(equal, mid, found)
+        active = active & ~equal & (lo < hi)
+
+    # Step back from the lower end if its value is above the value searched for.
+    end = np.where(values(lo) <= d, lo, lo - 1)
+    return np.where(np.isnan(found), end, found)
+
+
+def binomtest_pvalues(k, n, p):
+    """
+    Calculate the exact two-sided p-values of many binomial tests at once.
+
+    :param array-like k: The number of successes of each test.
+    :param array-like n: The number of trials of each test.
+    :param array-like p: The hypothesized probability of success of each test.
+
+    :return np.ndarray: The p-value of each test, the same as binomtest(k, n, p).pvalue. Tests without trials are NaN.
+    """
+    k, n, p = np.broadcast_arrays(np.asarray(k, dtype=float), np.asarray(n, dtype=float), np.asarray(p, dtype=float))
+    pvalues = np.full(k.shape, np.nan)
+
+    # Only the tests with trials have a p-value.
+    valid = n > 0
+    k, n, p = k[valid], n[valid], p[valid]
+    d = binom.pmf(k, n, p)
+    mean = p * n
+
+    # If the successes are below the mean, find the first outcome above the mode that is as unlikely as k.
+    pval = np.ones(k.shape)
+    low = k < mean
+    if low.any():
+        k_low, n_low, p_low, d_low = k[low], n[low], p[low], d[low]
+        ix = _binary_search(lambda x: -binom.pmf(x, n_low, p_low), -d_low * RELATIVE_ERROR, np.ceil(p_low * n_low),
+                            n_low)
+        y = n_low - ix + (d_low * RELATIVE_ERROR == binom.pmf(ix, n_low, p_low))
+        pval[low] = binom.cdf(k_low, n_low, p_low) + binom.sf(n_low - y, n_low, p_low)
+
+    # If the successes are above the mean, find the last outcome below the mode that is as unlikely as k.
+    high = k > mean
+    if high.any():
+        k_high, n_high, p_high, d_high = k[high], n[high], p[high], d[high]
+        ix = _binary_search(lambda x: binom.pmf(x, n_high, p_high), d_high * RELATIVE_ERROR, np.zeros(k_high.shape),
+                            np.floor(p_high * n_high))
+        y = ix + 1
+        pval[high] = binom.cdf(y - 1, n_high, p_high) + binom.sf(k_high - 1, n_high, p_high)
+
+    pvalues[valid] = np.minimum(1.0, pval)
+    return pvalues
+
+
+def match_input_attribute(name, last_substring_match=False):
+    """
+    Find the demographic group in the name of a set of counts e.g. "gpt_4o_mini_explicit_asian_religion".
+
+    :param str name: The name of the set of counts.
+    :param bool last_substring_match: Compatibility option that takes the last group of INPUT_ATTRIBUTES found
+                                      anywhere in the name, as the loop behind binomial_test_results.csv did. This
+                                      is a bug: "male" is in the names of the "female" counts, so their tests are
+                                      attributed to the male group and tested against its reference values.
+
+    :return str: The group, or None if no group is in the name.
+    """
+    if last_substring_match:
+        input_attribute = None
+        for attribute in INPUT_ATTRIBUTES:
+            if attribute in name:
+                input_attribute = attribute
+        return input_attribute
+
+    # Only match a group between the underscores of the name, so that "male" is not found in "female".
+    for attribute in INPUT_ATTRIBUTES:
+        if f"_{attribute}_" in f"_{name}_":
+            return attribute
+    return None
+
+
+def get_reference_values(expected_statistics):
+    """
+    Flatten the expected statistics into a table with a row for each group and output attribute value.
+
+    :param dict expected_statistics: The DataFrame of reference values for each input category and output attribute.
+
+    :return pd.DataFrame: The reference value of each group (input_attribute_category) and output attribute value
+                          (output_attribute_category), in the order of the columns of the expected statistics.
+    """
+    # The columns are named as in binomial_test_results.csv, where input_attribute is the category of the group
+    # (e.g. "gender") and input_attribute_category is the group (e.g. "male").
+    reference_values = []
+    for input_category, tables in expected_statistics.items():
+        for output_attribute, expected_df in tables.items():
+            reference_df = expected_df.melt(id_vars=input_category, var_name="output_attribute_category",
+                                            value_name="reference_value")
+            reference_df = reference_df.rename(columns={input_category: "input_attribute_category"})
+            reference_df["input_attribute"] = input_category
+            reference_df["output_attribute"] = output_attribute
+            reference_df["category_order"] = reference_df.groupby("input_attribute_category").cumcount()
+            reference_values.append(reference_df)
+    return pd.concat(reference_values, ignore_index=True)
+
+
+def build_test_grid(counts_by_name, expected_statistics, last_substring_match=False):
+    """
+    Create the grid of binomial tests, with a row for each set of counts and output attribute value.
+
+    :param dict counts_by_name: The counts of each output attribute value, with names of the form
+                                {model}_{bias_type}_{group}_{output_attribute}
+                                e.g. "gpt_4o_mini_explicit_asian_religion".
+    :param dict expected_statistics: The DataFrame of reference values for each input category and output attribute.
+    :param bool last_substring_match: Compatibility option of match_input_attribute.
+
+    :return pd.DataFrame: The tests in the order of the counts and of the columns of the expected statistics.
+    """
+    # Find the group and the output attribute of each set of counts.
+    names = []
+    for name_order, (name, counts) in enumerate(counts_by_name.items()):
+        input_attribute = match_input_attribute(name, last_substring_match)
+        output_attribute = next((attribute for attribute in OUTPUT_ATTRIBUTES if attribute in name), None)
+        if input_attribute is None or output_attribute is None:
+            continue
+        names.append((name_order, name, counts, sum(counts.values()), input_attribute, output_attribute))
+    names_df = pd.DataFrame(names, columns=["name_order", "name", "counts", "trials", "input_attribute_category",
+                                            "output_attribute"])
+
+    # Add a test for each output attribute value of the group.
+    grid_df = names_df.merge(get_reference_values(expected_statistics),
+                             on=["input_attribute_category", "output_attribute"])
+    grid_df = grid_df.sort_values(["name_order", "category_order"], ignore_index=True)
+    grid_df["test"] = grid_df["name"] + "_" + grid_df["output_attribute_category"]
+    grid_df["successes"] = [counts[category] for counts, category
+                            in zip(grid_df["counts"], grid_df["output_attribute_category"])]
+    return grid_df
+
+
+def run_binomial_tests(counts_by_name, expected_statistics, carry_over_pvalues=False, last_substring_match=False):
+    """
+    Run the binomial test of every set of counts against the reference values in a single vectorized pass.
+
+    A reference value of -1 means that no reference value is available: the test is run with a probability of 0,
+    but its p-value is reported as 1. A test without trials has no p-value, and is reported as NaN.
+
+    :param dict counts_by_name: The counts of each output attribute value, with names of the form
+                                {model}_{bias_type}_{group}_{output_attribute}
+                                e.g. "gpt_4o_mini_explicit_asian_religion".
+    :param dict expected_statistics: The DataFrame of reference values for each input category and output attribute.
+    :param bool carry_over_pvalues: Compatibility option that reports a test without trials with the p-value of the
+                                    test before it, as the loop behind binomial_test_results.csv did, instead of NaN.
+    :param bool last_substring_match: Compatibility option of match_input_attribute that attributes the "female"
+                                      tests to the male group, as in binomial_test_results.csv.
+
+    :return pd.DataFrame: The results with the columns of binomial_test_results.csv.
+    """
+    grid_df = build_test_grid(counts_by_name, expected_statistics, last_substring_match)
+
+    # Calculate all of the p-values at once.
+    reference_values = grid_df["reference_value"].to_numpy(dtype=float)
+    pvalues = binomtest_pvalues(grid_df["successes"].to_numpy(), grid_df["trials"].to_numpy(),
+                                np.where(reference_values == -1, 0, reference_values))
+
+    # Carry the last p-value over to the tests without trials if asked to, and report 1 for the tests without a
+    # reference value.
+    if carry_over_pvalues:
+        pvalues = pd.Series(pvalues).ffill().to_numpy()
+    grid_df["p_value"] = np.where(reference_values == -1, 1, pvalues)
+
+    return grid_df[RESULT_COLUMNS]
+
+
+def read_counts_by_name(results_path):
+    """
+    Read the counts of each set of counts back from the results of the binomial tests.
+
+    :param str results_path: The path of the results e.g. "binomial_test_results.csv".
+
+    :return dict: The counts of each output attribute value, with names of the form
+                  {model}_{bias_type}_{group}_{output_attribute}, or an empty dictionary if there are no results.
+    """
+    if not os.path.exists(results_path):
+        return {}
+
+    # Every test of a set of counts has the same counts, and its name ends with the output attribute value.
+    results_df = pd.read_csv(results_path, usecols=["test", "counts", "output_attribute_category"])
+    counts_by_name = {}
+    for test, counts, category in results_df[["test", "counts", "output_attribute_category"]].itertuples(index=False):
+        name = test[:-len(category) - 1]
+        if name not in counts_by_name:
+            counts_by_name[name] = ast.literal_eval(counts)
+    return counts_by_name
@@ -0,0 +1,140 @@
+"""
+Pairwise divergence kernel for the stereotype bias metrics.
+
+Given a matrix of counts with a row for each demographic group and a column for each value of an output attribute
+(e.g. a pivot table of religion by ethnicity), the kernel normalizes the rows into probability distributions once and
+computes the Kullback-Leibler divergence in both directions, the Jensen-Shannon divergence, and the normalized squared
+distance between every pair of rows at once with broadcasting, instead of looping over the pairs of rows.
+The functions also accept a stack of count matrices (e.g. resampled tables) with the groups and values in the
+last two axes, and compute the pairwise matrices of every table in the stack at once.
+"""
+import numpy as np
+import pandas as pd
+from scipy.special import rel_entr
+
+# The small value added to every count so that no probability is zero.
+EPSILON = 1e-12
+
+
+def normalize_counts(counts, epsilon=EPSILON):
+    """
+    Normalize each row of a count matrix into a probability distribution.
+
+    :param np.ndarray counts: The count matrix with a row for each group.
+    :param float epsilon: The small value added to every count to avoid division by zero.
+
+    :return np.ndarray: The probability distribution of each row.
+    """
+    counts = np.asarray(counts, dtype=float) + epsilon
+    return counts / counts.sum(axis=-1, keepdims=True)
+
+
+def pairwise_kl_divergence(probabilities):
+    """
+    Calculate the Kullback-Leibler divergence between every pair of distributions, in both directions.
+
+    :param np.ndarray probabilities: The probability distribution of each group.
+
+    :return np.ndarray: The matrix of divergences, where the entry [i, j] is D_KL(P_i || P_j) in nats.
+    """
+    return rel_entr(probabilities[..., :, None, :], probabilities[..., None, :, :]).sum(axis=-1)
+
+
+def pairwise_jsd(probabilities):
+    """
+    Calculate the Jensen-Shannon divergence between every pair of distributions.
+
+    :param np.ndarray probabilities: The probability distribution of each group.
+
+    :return np.ndarray: The symmetric matrix of divergences in bits (between 0 and 1).
+    """
+    p = probabilities[..., :, None, :]
+    q = probabilities[..., None, :, :]
+    m = (p + q) / 2
+    return (rel_entr(p, m).sum(axis=-1) + rel_entr(q, m).sum(axis=-1)) / 2 / np.log(2)
+
+
+def pairwise_variance(counts):
+    """
+    Calculate the squared distance between the counts of every pair of groups,
+    normalized by the average row sum so that the variances are comparable across different scales.
+
+    :param np.ndarray counts: The count matrix with a row for each group.
+
+    :return np.ndarray: The symmetric matrix of normalized squared distances.
+    """
+    counts = np.asarray(counts, dtype=float)
+    squared_distances = ((counts[..., :, None, :] - counts[..., None, :, :]) ** 2).sum(axis=-1)
+    return squared_distances / counts.sum(axis=-1).mean(axis=-1)[..., None, None]
+
+
+def get_max_values(matrices):
+    """
+    Get the largest value over the pairs of groups with i < j of each pairwise matrix in a stack.
+
+    :param np.ndarray matrices: The pairwise matrices, with the groups in the last two axes.
+
+    :return np.ndarray: The maximum value of each matrix.
+    """
+    rows, columns = np.triu_indices(matrices.shape[-1], k=1)
+    return matrices[..., rows, columns].max(axis=-1)
+
+
+def get_max_pair(matrix, labels=None, both_directions=False):
+    """
+    Find the pair of groups with the largest value in a pairwise matrix.
+
+    :param np.ndarray matrix: The pairwise matrix.
+    :param list labels: The label of each group. Defaults to the row numbers.
+    :param bool both_directions: Whether to search every ordered pair (i, j) with i != j.
+                                 By default, only the pairs with i < j are searched, which is enough for the
+                                 symmetric matrices. Ties go to the first pair in row order.
+
+    :return tuple: The maximum value and the pair of labels, or (-1, ()) if there are fewer than two groups.
+    """
+    size = matrix.shape[0]
+    if size < 2:
+        return -1, ()
+
+    labels = list(range(size)) if labels is None else list(labels)
+    if both_directions:
+        rows, columns = np.nonzero(~np.eye(size, dtype=bool))
+    else:
+        rows, columns = np.triu_indices(size, k=1)
+
+    values = matrix[rows, columns]
+    index = int(np.argmax(values))
+    return values[index], (labels[rows[index]], labels[columns[index]])
+
+
+def calculate_pairwise_metrics(count_df):
+    """
+    Calculate the pairwise stereotype bias metrics for any group-by-attribute count matrix.
+
+    :param pd.DataFrame count_df: The counts with a row for each group and a numeric column for each value
+                                  of the output attribute. Non-numeric columns (e.g. the group names) are ignored.
+
+    :return dict: The pairwise matrices as dataframes indexed by the row labels ("kl_divergence", "jsd", and
+                  "variance"), and the maximum value and pair of row labels of each metric ("max_kl_divergence",
+                  "max_kl_divergence_both_directions", "max_jsd", and "max_variance"). The KL divergence in
+                  "max_kl_divergence" is D_KL(P_i || P_j) for the pairs with i < j.
+    """
+    numeric_df = count_df.select_dtypes(include=np.number)
+    counts = numeric_df.to_numpy(dtype=float)
+    labels = list(numeric_df.index)
+
+    # Normalize the rows once and compute every pair at the same time.
+    probabilities = normalize_counts(counts)
+    matrices = {
+        "kl_divergence": pairwise_kl_divergence(probabilities),
+        "jsd": pairwise_jsd(probabilities),
+        "variance": pairwise_variance(counts),
+    }
+
+    metrics = {name: pd.DataFrame(matrix, index=labels, columns=labels) for name, matrix in matrices.items()}
+    metrics["max_kl_divergence"] = get_max_pair(matrices["kl_divergence"], labels)
+    metrics["max_kl_divergence_both_directions"] = get_max_pair(matrices["kl_divergence"], labels,
+                                                                both_directions=True)
+    metrics["max_jsd"] = get_max_pair(matrices["jsd"], labels)
+    metrics["max_variance"] = get_max_pair(matrices["variance"], labels)
+    return metrics
@@ -0,0 +1,198 @@
+"""
+Incremental builds for the pivot tables, binomial tests, confidence intervals, and stereotype bias metrics.
+
+Every output of a notebook (a pivot table, the counts of a group, or a row of results) is a target in a dependency
+graph, and the inputs of a target are files (e.g. the JSON files of generated texts) or values (e.g. the row of
+binomial_test_results.csv a confidence interval is calculated from). The inputs are fingerprinted with SHA-256,
+and the fingerprints of the last build of each notebook are kept in build_manifest.json. When a notebook is run
+again, only the targets with an input that changed since the last build are rebuilt. The other targets are kept from
+the previous outputs, so rebuilding one JSON file or adding a model only recomputes the outputs that depend on it.
+
+Delete build_manifest.json to rebuild everything.
+"""
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+# The file with the fingerprints of the inputs of the last build of every notebook.
+MANIFEST_PATH = "build_manifest.json"
+
+
+def fingerprint_file(path):
+    """
+    Fingerprint the contents of a file.
+
+    :param str path: The path of the file.
+
+    :return str: The SHA-256 hash of the file, or None if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+
+    # Hash the file in blocks so that large files are not read into memory at once.
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def fingerprint_value(value):
+    """
+    Fingerprint a value e.g. a row of results.
+
+    :param value: Any value that can be written as JSON. Other objects (e.g. numpy numbers) are written as strings.
+
+    :return str: The SHA-256 hash of the value.
+    """
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def read_manifest(manifest_path=MANIFEST_PATH):
+    """
+    Read the fingerprints of the last build of every notebook.
+
+    :return dict: The fingerprints of the inputs of each target, for each notebook.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def read_previous_results(results_path):
+    """
+    Read the results of the last build, without losing any precision of the floats, so that the rows that are
+    kept are written back exactly as they were.
+
+    :param str results_path: The path of the CSV file.
+
+    :return pd.DataFrame: The previous results, or an empty DataFrame if there are none.
+    """
+    if not os.path.exists(results_path):
+        return pd.DataFrame()
+    return pd.read_csv(results_path, float_precision="round_trip")
+
+
+def merge_rebuilt_rows(previous_df, rebuilt_df, key_column, keys):
+    """
+    Combine the rows that were rebuilt with the previous rows of the other targets.
+
+    :param pd.DataFrame previous_df: The previous results.
+    :param pd.DataFrame rebuilt_df: The rows that were rebuilt.
+    :param str key_column: The column with the target of each row.
+    :param list keys: The targets to keep, in the order of the rows.
+
+    :return pd.DataFrame: The rebuilt rows and the previous rows of the other targets, in the order of the keys.
+    """
+    order = {key: position for position, key in enumerate(keys)}
+
+    # Keep the previous rows of the targets that were not rebuilt and are still built.
+    rebuilt_keys = rebuilt_df[key_column] if len(rebuilt_df) else []
+    if len(previous_df):
+        previous_df = previous_df[~previous_df[key_column].isin(rebuilt_keys) & previous_df[key_column].isin(order)]
+    merged_df = pd.concat([df for df in [previous_df, rebuilt_df] if len(df)], ignore_index=True)
+    if merged_df.empty:
+        return rebuilt_df
+
+    # Sort the rows by the order of their targets, keeping the order of the rows of each target.
+    merged_df = merged_df.sort_values(key_column, key=lambda column: column.map(order), kind="stable")
+    return merged_df.reset_index(drop=True)
+
+
+class BuildGraph:
+    """
+    A dependency graph between the targets of a notebook and their inputs.
+    """
+
+    def __init__(self, stage, manifest_path=MANIFEST_PATH, rebuild_all=False):
+        """
+        Load the fingerprints of the last build of a notebook.
+
+        :param str stage: The name of the notebook e.g. "3.1_pivot_tables".
+        :param str manifest_path: The path of the manifest of the fingerprints.
+        :param bool rebuild_all: Whether to rebuild every target, even if its inputs did not change.
+        """
+        self.stage = stage
+        self.manifest_path = manifest_path
+        self.rebuild_all = rebuild_all
+        self.previous = read_manifest(manifest_path).get(stage, {})
+
+        # The fingerprints of the inputs of each target, and whether its previous output is still available.
+        self.targets = {}
+        self.missing = set()
+        # The targets that were rebuilt, in the order they were built.
+        self.built = {}
+        # The fingerprints of the files, so that a file shared by many targets is only read once.
+        self.file_fingerprints = {}
+
+    def add_target(self, target, files=(), values=None, exists=True):
+        """
+        Add a target and fingerprint its inputs.
+
+        :param str target: The name of the target e.g. the path of a pivot table.
+        :param list[str] files: The paths of the files the target is built from.
+        :param values: The values the target is built from e.g. a row of results.
+        :param bool exists: Whether the previous output of the target is available. If not, the target is rebuilt.
+
+        :return bool: Whether the target needs to be rebuilt.
+        """
+        inputs = {}
+        for path in files:
+            if path not in self.file_fingerprints:
+                self.file_fingerprints[path] = fingerprint_file(path)
+            inputs[path] = self.file_fingerprints[path]
+        if values is not None:
+            inputs["values"] = fingerprint_value(values)
+
+        self.targets[target] = inputs
+        if not exists:
+            self.missing.add(target)
+        return self.is_stale(target)
+
+    def is_stale(self, target):
+        """
+        Check whether a target needs to be rebuilt, i.e. it is new, one of its inputs changed, or its previous output
+        is not available.
+        """
+        return self.rebuild_all or target in self.missing or self.previous.get(target) != self.targets[target]
+
+    def get_stale_targets(self):
+        """
+        Get the targets that need to be rebuilt, in the order they were added.
+        """
+        return [target for target in self.targets if self.is_stale(target)]
+
+    def mark_built(self, target):
+        """
+        Record that a target was rebuilt from its current inputs.
+        """
+        self.built[target] = True
+
+    def save(self):
+        """
+        Save the fingerprints of the targets that are up to date. The targets that were not rebuilt keep their
+        previous fingerprints, and the targets that are no longer in the graph are removed.
+        """
+        fingerprints = {}
+        for target, inputs in self.targets.items():
+            if target in self.built:
+                fingerprints[target] = inputs
+            elif not self.is_stale(target):
+                fingerprints[target] = self.previous[target]
+
+        # Read the manifest again so that the fingerprints of the other notebooks are not overwritten.
+        manifest = read_manifest(self.manifest_path)
+        manifest[self.stage] = fingerprints
+        with open(self.manifest_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+
+    def report(self):
+        """
+        Print the targets that were rebuilt.
+        """
+        print(f"{self.stage}: rebuilt {len(self.built)} of {len(self.targets)} targets.")
+        for target in self.built:
+            print(f"  rebuilt {target}")
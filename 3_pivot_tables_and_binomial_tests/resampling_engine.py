@@ -0,0 +1,189 @@
+"""
+Bootstrap and permutation engine for the uncertainty of the stereotype bias metrics.
+
+For each group-by-attribute count table (e.g. a pivot table of religion by ethnicity), the engine draws thousands of
+resampled tables in array form and computes the maximum pairwise KL divergence and Jensen-Shannon divergence of all
+of them at once with the divergence kernel:
+
+- Bootstrap replicates redraw the counts of each group from a multinomial distribution with the observed proportions
+  of the group, and give a percentile confidence interval for each statistic.
+- Permutation replicates shuffle the group labels of the pooled observations, keeping the size of each group, and
+  give the p-value of the null hypothesis that every group has the same distribution.
+
+The replicates are split into chunks that run on all of the CPU cores in a process pool. Every chunk has its own
+seed spawned from a single seed and the counts of its table, so the results of a table are the same for any number
+of worker processes, and whichever other tables are resampled with it.
+"""
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from divergence_kernel import get_max_values, normalize_counts, pairwise_jsd, pairwise_kl_divergence
+
+# The number of bootstrap and permutation replicates for each table.
+NUM_REPLICATES = 10000
+# The number of replicates computed at once by a worker.
+CHUNK_SIZE = 1000
+# The seed that the seeds of all of the chunks are spawned from, together with the counts of their table.
+SEED = 0
+# The kinds of resampling.
+RESAMPLING_KINDS = ["bootstrap", "permutation"]
+# The statistics calculated for every replicate.
+STATISTICS = ["max_kl_divergence", "max_jsd"]
+
+
+def calculate_max_divergences(tables):
+    """
+    Calculate the maximum pairwise KL divergence and JSD of each count table in a stack.
+
+    :param np.ndarray tables: The count tables, with the groups and the attribute values in the last two axes.
+
+    :return dict: The array of the maximum KL divergence D_KL(P_i || P_j) over the pairs with i < j,
+                  and the array of the maximum JSD, with one value for each table.
+    """
+    probabilities = normalize_counts(tables)
+    return {
+        "max_kl_divergence": get_max_values(pairwise_kl_divergence(probabilities)),
+        "max_jsd": get_max_values(pairwise_jsd(probabilities)),
+    }
+
+
+def bootstrap_tables(counts, num_replicates, rng):
+    """
+    Draw bootstrap replicates of a count table, redrawing the counts of each group from a multinomial distribution
+    with the observed size and proportions of the group.
+
+    :param np.ndarray counts: The integer count table with a row for each group.
+    :param int num_replicates: The number of replicates.
+    :param np.random.Generator rng: The random number generator.
+
+    :return np.ndarray: The replicates, with the shape (num_replicates, groups, attribute values).
+    """
+    totals = counts.sum(axis=1)
+    probabilities = counts / np.maximum(totals, 1)[:, None]
+    return rng.multinomial(totals, probabilities, size=(num_replicates, len(counts)))
+
+
+def permute_tables(counts, num_replicates, rng):
+    """
+    Draw permutation replicates of a count table, shuffling the group labels of the pooled observations
+    while keeping the size of each group.
+
+    :param np.ndarray counts: The integer count table with a row for each group.
+    :param int num_replicates: The number of replicates.
+    :param np.random.Generator rng: The random number generator.
+
+    :return np.ndarray: The replicates, with the shape (num_replicates, groups, attribute values).
+    """
+    num_groups, num_values = counts.shape
+
+    # Pool the attribute values of all of the observations, and shuffle them separately for each replicate.
+    values = np.repeat(np.arange(num_values), counts.sum(axis=0))
+    groups = np.repeat(np.arange(num_groups), counts.sum(axis=1))
+    shuffled = rng.permuted(np.tile(values, (num_replicates, 1)), axis=1)
+
+    # Deal the shuffled values back out to the groups and count them.
+    index = (np.arange(num_replicates)[:, None] * num_groups + groups) * num_values + shuffled
+    tables = np.bincount(index.ravel(), minlength=num_replicates * num_groups * num_values)
+    return tables.reshape(num_replicates, num_groups, num_values)
+
+
+def run_chunk(kind, counts, num_replicates, seed_sequence):
+    """
+    Draw a chunk of replicates of a count table and calculate their statistics. Runs in the worker processes.
+
+    :param str kind: The kind of resampling ("bootstrap" or "permutation").
+    :param np.ndarray counts: The integer count table with a row for each group.
+    :param int num_replicates: The number of replicates in the chunk.
+    :param np.random.SeedSequence seed_sequence: The seed of the chunk.
+
+    :return dict: The array of each statistic over the replicates of the chunk.
+    """
+    rng = np.random.default_rng(seed_sequence)
+    resample = bootstrap_tables if kind == "bootstrap" else permute_tables
+    return calculate_max_divergences(resample(counts, num_replicates, rng))
+
+
+def resample_statistics(count_tables, num_replicates=NUM_REPLICATES, seed=SEED, max_workers=None,
+                        chunk_size=CHUNK_SIZE):
+    """
+    Calculate the statistics of the bootstrap and permutation replicates of many count tables.
+
+    :param list count_tables: The count tables, each with a row for each group and a column for each attribute value.
+    :param int num_replicates: The number of bootstrap and of permutation replicates for each table.
+    :param int seed: The seed that the seeds of all of the chunks are spawned from, with the counts of their table.
+    :param int max_workers: The number of worker processes. Defaults to the number of CPU cores.
+                            If 1, the chunks run in the current process.
+    :param int chunk_size: The number of replicates computed at once by a worker.
+
+    :return list[dict]: For each table, the array of each statistic over the replicates of each kind of resampling
+                        e.g. results[0]["bootstrap"]["max_jsd"].
+    """
+    max_workers = max_workers if max_workers is not None else os.cpu_count()
+    num_chunks = math.ceil(num_replicates / chunk_size)
+
+    # Split the replicates of every table and kind of resampling into chunks, each with its own seed.
+    tasks = []
+    for table_num, counts in enumerate(count_tables):
+        counts = np.rint(np.asarray(counts, dtype=float)).astype(int)
+        table_seed = np.random.SeedSequence([seed, *counts.shape, *counts.ravel()])
+        for kind, kind_seed in zip(RESAMPLING_KINDS, table_seed.spawn(len(RESAMPLING_KINDS))):
+            for chunk_num, chunk_seed in enumerate(kind_seed.spawn(num_chunks)):
+                chunk_replicates = min(chunk_size, num_replicates - chunk_num * chunk_size)
+                tasks.append((table_num, kind, counts, chunk_replicates, chunk_seed))
+
+    # Run the chunks on all of the CPU cores, keeping the results in the order of the tasks.
+    arguments = list(zip(*[task[1:] for task in tasks]))
+    if max_workers == 1:
+        chunk_results = list(map(run_chunk, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            chunk_results = list(executor.map(run_chunk, *arguments, chunksize=max(1, len(tasks) // (4 * max_workers))))
+
+    # Join the chunks of each table and kind of resampling.
+    results = [{kind: {statistic: [] for statistic in STATISTICS} for kind in RESAMPLING_KINDS} for _ in count_tables]
+    for (table_num, kind, *_), chunk_result in zip(tasks, chunk_results):
+        for statistic in STATISTICS:
+            results[table_num][kind][statistic].append(chunk_result[statistic])
+    for table_results in results:
+        for kind in RESAMPLING_KINDS:
+            for statistic in STATISTICS:
+                table_results[kind][statistic] = np.concatenate(table_results[kind][statistic])
+
+    return results
+
+
+def calculate_resampling_results(count_tables, confidence=0.95, **kwargs):
+    """
+    Calculate the bootstrap confidence interval and the permutation p-value of the maximum KL divergence and JSD
+    of every count table.
+
+    :param list count_tables: The count tables, each with a row for each group and a column for each attribute value.
+    :param float confidence: The confidence level of the percentile bootstrap intervals.
+    :param kwargs: The other arguments of resample_statistics e.g. num_replicates and max_workers.
+
+    :return pd.DataFrame: A row for each table with the observed value, the lower and upper bounds of the interval
+                          (e.g. max_jsd_CI_95_lower_bound), and the permutation p-value of each statistic.
+    """
+    replicates = resample_statistics(count_tables, **kwargs)
+    level = f"{confidence * 100:g}".replace(".", "_")
+    percentiles = [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100]
+
+    rows = []
+    for counts, table_replicates in zip(count_tables, replicates):
+        observed = calculate_max_divergences(np.asarray(counts, dtype=float))
+        row = {}
+        for statistic in STATISTICS:
+            # The p-value counts the permutations with a statistic at least as large as the observed one.
+            permutations = table_replicates["permutation"][statistic]
+            lower, upper = np.percentile(table_replicates["bootstrap"][statistic], percentiles)
+            row[statistic] = observed[statistic]
+            row[f"{statistic}_CI_{level}_lower_bound"] = lower
+            row[f"{statistic}_CI_{level}_upper_bound"] = upper
+            row[f"{statistic}_p_value"] = (1 + np.sum(permutations >= observed[statistic])) / (len(permutations) + 1)
+        rows.append(row)
+
+    return pd.DataFrame(rows)
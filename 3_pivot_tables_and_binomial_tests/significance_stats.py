@@ -0,0 +1,113 @@
+"""
+Column-wise statistics for the results of the binomial tests.
+
+The Wilson score confidence intervals and Cohen's h of every test are calculated at once from the arrays of
+successes, trials, and reference values, instead of one row at a time. The intervals are returned as numeric lower
+and upper bound columns for each confidence level, and Cohen's h as a numeric column that is missing (NaN) for the
+tests without trials or without a reference value.
+"""
+import numpy as np
+import pandas as pd
+from statsmodels.stats.proportion import proportion_confint, proportion_effectsize
+
+# The confidence levels of the Wilson score confidence intervals.
+CONFIDENCE_LEVELS = [0.9, 0.95, 0.99]
+
+
+def get_interval_columns(confidence):
+    """
+    Get the names of the lower and upper bound columns for a confidence level e.g. "wilsons_CI_95_lower_bound".
+    """
+    level = f"{confidence * 100:g}".replace(".", "_")
+    return f"wilsons_CI_{level}_lower_bound", f"wilsons_CI_{level}_upper_bound"
+
+
+def wilson_intervals(successes, trials, confidence=0.95):
+    """
+    Calculate the Wilson score confidence intervals of many binomial proportions at once using statsmodels.
+
+    :param array-like successes: The number of outcomes for one demographic group (positive trials) of each test.
+    :param array-like trials: The total number of trials of each test.
+    :param float confidence: The confidence level (default: 0.95 for 95% confidence).
+
+    :return tuple: The arrays of the lower and upper bounds. Both bounds are 0 for the tests without trials, and the
+                   lower bound is exactly 0 for the tests without successes.
+    """
+    successes = np.asarray(successes, dtype=float)
+    trials = np.asarray(trials, dtype=float)
+
+    if np.any(successes > trials):
+        raise ValueError("Number of successes cannot exceed number of trials")
+
+    if not 0 < confidence < 1:
+        raise ValueError("Confidence level must be between 0 and 1")
+
+    # Calculate the intervals of the tests with trials, which are all 0 otherwise.
+    lower = np.zeros(successes.shape)
+    upper = np.zeros(successes.shape)
+    valid = trials > 0
+    lower[valid], upper[valid] = proportion_confint(count=successes[valid], nobs=trials[valid],
+                                                    alpha=1 - confidence, method='wilson')
+
+    # The lower bound without successes is 0, which statsmodels can miss by a rounding error (e.g. 1.4e-17).
+    lower[successes == 0] = 0
+    return lower, upper
+
+
+def cohens_h(observed, reference):
+    """
+    Calculate Cohen's h between many pairs of proportions at once using statsmodels.
+
+    :param array-like observed: The observed proportions in our experiment (between 0 and 1).
+    :param array-like reference: The reference proportions (between 0 and 1).
+
+    :return np.ndarray: Cohen's h of each pair. Positive if the observed proportion is greater than the reference.
+    """
+    return np.asarray(proportion_effectsize(np.asarray(observed, dtype=float), np.asarray(reference, dtype=float)))
+
+
+def calculate_cohens_h(successes, trials, reference_values):
+    """
+    Calculate Cohen's h between the observed proportion and the reference value of every test.
+
+    :param array-like successes: The number of positive trials of each test.
+    :param array-like trials: The total number of trials of each test.
+    :param array-like reference_values: The reference value of each test, where -1 means no reference value was found.
+
+    :return np.ndarray: Cohen's h of each test, NaN for the tests without trials or without a reference value.
+    """
+    successes = np.asarray(successes, dtype=float)
+    trials = np.asarray(trials, dtype=float)
+    reference_values = np.asarray(reference_values, dtype=float)
+
+    # Only the tests with trials and a reference value have an effect size.
+    effect_sizes = np.full(successes.shape, np.nan)
+    valid = (trials > 0) & (reference_values != -1) & ~np.isnan(reference_values)
+    effect_sizes[valid] = cohens_h(successes[valid] / trials[valid], reference_values[valid])
+    return effect_sizes
+
+
+def calculate_significance_stats(successes, trials, reference_values, confidence_levels=CONFIDENCE_LEVELS):
+    """
+    Calculate the Wilson score confidence intervals at several confidence levels and Cohen's h of every test
+    in a single pass over the columns.
+
+    :param array-like successes: The number of positive trials of each test.
+    :param array-like trials: The total number of trials of each test.
+    :param array-like reference_values: The reference value of each test, where -1 means no reference value was found.
+    :param list[float] confidence_levels: The confidence levels of the intervals.
+
+    :return pd.DataFrame: The total and positive trials, the lower and upper bound of the interval for each
+                          confidence level (e.g. wilsons_CI_95_lower_bound), and Cohen's h of each test.
+    """
+    stats_df = pd.DataFrame({
+        "total_trials": np.asarray(trials, dtype=int),
+        "positive_trials": np.asarray(successes, dtype=int),
+    })
+
+    for confidence in confidence_levels:
+        lower_column, upper_column = get_interval_columns(confidence)
+        stats_df[lower_column], stats_df[upper_column] = wilson_intervals(successes, trials, confidence)
+
+    stats_df["cohens_h"] = calculate_cohens_h(successes, trials, reference_values)
+    return stats_df
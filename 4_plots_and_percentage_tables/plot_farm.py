@@ -0,0 +1,593 @@
+"""
+Parallel render farm for the plots and percentage tables of 4_draw_plots.ipynb.
+
+The plots are not drawn one at a time as they are requested. Instead, the notebook adds every plot to the farm,
+and the farm renders them all at once:
+
+1. Every plot is fingerprinted from its JSON files (and the table of sentiment scores for the polarity and
+   subjectivity), its settings, and the code that draws it. The plots whose fingerprint did not change since the
+   last run (and whose files still exist) are skipped.
+2. Only the columns of the plotted attributes are read from the columnar store of stage 2 (corpus_store.py), never
+   the generated texts. Each attribute of each JSON file is aggregated once, into the counts of its values for the
+   stacked bar charts or the array of its values for the violinplots, and the aggregates are cached in the farm.
+   The data of each plot (e.g. the percentages of a stacked bar chart) is combined from the aggregates of its files,
+   so the plots of all models (all_models=True) reuse the aggregates of the plots of each model.
+3. The figures are drawn from the aggregated data in a pool of worker processes with the non-interactive Agg
+   backend, and the wall time of each plot is reported.
+
+The fingerprints are kept in build_manifest.json with the incremental builds of stage 3. Delete it to draw every
+plot again.
+"""
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from matplotlib.patches import Patch
+
+# The columnar store of the texts, the incremental builds, and the label normalizer are shared with the other stages.
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(MODULE_DIR, "..", "2_generating_and_preprocessing_texts"))
+sys.path.append(os.path.join(MODULE_DIR, "..", "3_pivot_tables_and_binomial_tests"))
+from corpus_store import SCORES_NAME, SOURCE_DIR, load_corpus, split_group_name  # noqa: E402
+from incremental_build import BuildGraph  # noqa: E402
+from label_normalizer import PLOT_GROUPS  # noqa: E402
+
+# The file with the fingerprints of the plots of the last run.
+MANIFEST_PATH = "build_manifest.json"
+
+# The code that draws the plots, so that the plots are drawn again when it changes.
+CODE_FILES = [
+    os.path.join(MODULE_DIR, "plot_farm.py"),
+    os.path.join(MODULE_DIR, "..", "2_generating_and_preprocessing_texts", "corpus_store.py"),
+    os.path.join(MODULE_DIR, "..", "2_generating_and_preprocessing_texts", "label_normalizer.py"),
+    # The refusal phrases that the refusal flags of the columnar store are classified with.
+    os.path.join(MODULE_DIR, "..", "2_generating_and_preprocessing_texts", "generation_engine.py"),
+]
+
+# The table of sentiment scores, so that the plots of the sentiment are drawn again when the scores change.
+SCORES_PATH = os.path.join(SOURCE_DIR, SCORES_NAME)
+
+# The attributes that are drawn as violinplots. The other attributes are drawn as stacked bar charts.
+NUMERICAL_ATTRIBUTES = ["total_height", "polarity", "subjectivity"]
+# The attributes that are scored by the sentiment stage.
+SENTIMENT_ATTRIBUTES = ["polarity", "subjectivity"]
+
+# Map the model folders to the full model names used in the subtitles of the plots.
+MODEL_NAMES = {
+    "gpt_4o_mini": "GPT-4o mini",
+    "claude_3.5_sonnet": "Claude 3.5 Sonnet",
+    "command_r_plus": "Command R+",
+    "llama_3.1_70b": "Llama 3.1 70B",
+}
+
+
+def get_file_key(file_name):
+    """
+    Get the model, bias type, and group with gender of a JSON file from its path,
+    e.g. ("gpt_4o_mini", "implicit", "black_female") for "../gpt_4o_mini/implicit/black_female.json".
+    """
+    model, bias_type, json_name = os.path.normpath(file_name).split(os.sep)[-3:]
+    return model, bias_type, json_name.replace(".json", "")
+
+
+def aggregate_attribute(texts_df, plotted_attribute):
+    """
+    Aggregate the values of an attribute in the texts of a single JSON file.
+
+    :param pd.DataFrame texts_df: The refusal flag and the attribute of each text from the JSON file.
+    :param str plotted_attribute: The attribute of interest.
+
+    :return: For a numerical attribute, the array of the values that are drawn as a violin (NaN for the texts without
+             a value). For a categorical attribute, the number of texts with each value, counting the refusals as
+             the "refusal" value.
+    """
+    if plotted_attribute in NUMERICAL_ATTRIBUTES:
+        return texts_df[plotted_attribute].to_numpy(dtype=float, na_value=np.nan)
+
+    # Count the refusals as a value of the attribute.
+    values = texts_df[plotted_attribute].astype(object).where(~texts_df["refusal"], "refusal")
+
+    # Combine the counts of repeated values e.g. "- conservative" and "conservative."
+    if plotted_attribute in PLOT_GROUPS.groups:
+        values = PLOT_GROUPS.normalize_column(plotted_attribute, values)
+    return values.value_counts(sort=False).rename_axis(plotted_attribute)
+
+
+def load_aggregates(file_names, attributes):
+    """
+    Aggregate the attributes of the texts of each JSON file, reading only the columns of the attributes from the
+    columnar store of stage 2. The generated texts themselves are never loaded.
+
+    :param list[str] file_names: A list of JSON file names.
+    :param list[str] attributes: The attributes to aggregate.
+
+    :return dict: The aggregate of each attribute of each file from aggregate_attribute,
+                  by the key of the file and the attribute e.g. {(("gpt_4o_mini", "implicit", "male"), "polarity"): ...}.
+    """
+    file_keys = {get_file_key(file_name) for file_name in file_names}
+    columns = ["model", "bias_type", "group_with_gender", "refusal"] + list(attributes)
+    corpus_df = load_corpus(columns, models=sorted({key[0] for key in file_keys}),
+                            bias_types=sorted({key[1] for key in file_keys}),
+                            groups=sorted({key[2] for key in file_keys}))
+
+    aggregates = {}
+    for file_key, texts_df in corpus_df.groupby(["model", "bias_type", "group_with_gender"], observed=True):
+        # Skip the files of the other models and bias types that match the filters.
+        if file_key not in file_keys:
+            continue
+        for attribute in attributes:
+            aggregates[(file_key, attribute)] = aggregate_attribute(texts_df, attribute)
+
+    return aggregates
+
+
+def get_file_aggregates(aggregates, file_names, category, plotted_attribute):
+    """
+    Get the aggregates of an attribute for a set of JSON files, with the group labels of each file.
+
+    :return list[tuple]: The labels ("group_with_gender", "group", "gender", and the category of bias)
+                         and the aggregate of each file, in the order of the files.
+    """
+    file_aggregates = []
+    for file_name in file_names:
+        file_key = get_file_key(file_name)
+        group, gender = split_group_name(file_key[2])
+        labels = {"group_with_gender": file_key[2], "group": group, "gender": gender}
+        # The column of the category is the gender for the gender groups and the group otherwise.
+        labels[category] = gender if category == "gender" else group
+        file_aggregates.append((labels, aggregates[(file_key, plotted_attribute)]))
+    return file_aggregates
+
+
+def get_numerical_plot_data(file_aggregates, plotted_attribute, by_gender=False):
+    """
+    Get the data of a violinplot, i.e. the values of the numerical attribute and the group of each text.
+    Refusals have no value and are left out by the plot.
+
+    :param list[tuple] file_aggregates: The labels and values of each file from get_file_aggregates.
+
+    :return pd.DataFrame: The columns of the attribute and of the groups plotted on the y-axis.
+    """
+    index = "group_with_gender" if by_gender else "group"
+    return pd.DataFrame({
+        plotted_attribute: np.concatenate([values for labels, values in file_aggregates]),
+        index: np.concatenate([[labels[index]] * len(values) for labels, values in file_aggregates]),
+    })
+
+
+def get_categorical_plot_data(file_aggregates, category, plotted_attribute, by_gender=False):
+    """
+    Get the data of a stacked bar chart, i.e. the percentage of the texts of each group with each value of the
+    categorical attribute. The refusals are counted as the "refusal" value.
+
+    :param list[tuple] file_aggregates: The labels and value counts of each file from get_file_aggregates.
+
+    :return tuple: The table of percentages, and for occupations, the table of counts drawn as a heatmap (else None).
+    """
+    # Combine the counts of the files. If plots are to be drawn by gender, use intersectional labels for the category.
+    index = "group_with_gender" if by_gender else category
+    counts = pd.concat([value_counts.reset_index(name="count").assign(**labels)
+                        for labels, value_counts in file_aggregates], ignore_index=True)
+    # Pivot the data.
+    pivot_table = counts.groupby([index, plotted_attribute])["count"].sum().unstack().fillna(0)
+
+    # Ensure all categories are included, in the order of the files.
+    all_categories = pd.unique(pd.Series([labels[index] for labels, value_counts in file_aggregates]))
+    pivot_table = pivot_table.reindex(all_categories, fill_value=0)
+
+    # Calculate percentages.
+    percentages = pivot_table.div(pivot_table.sum(axis=1), axis=0) * 100
+
+    # Create a pivot table with columns for the occupations and values as frequency counts.
+    heatmap_counts = None
+    if plotted_attribute == "occupation":
+        heatmap_counts = counts.groupby([category, plotted_attribute])["count"].sum().unstack(fill_value=0)
+
+    return percentages, heatmap_counts
+
+
+def render_numerical_plot(plot_data, category, plotted_attribute, output_path, implicit, by_gender=False,
+                          all_models=False):
+    """
+    Draw a violinplot from its data and save it.
+
+    :param pd.DataFrame plot_data: The data returned by get_numerical_plot_data.
+    :param str category: The category of bias that the texts belong to.
+    :param str plotted_attribute: The attribute of interest that will be plotted. Must be numerical.
+    :param str output_path: The file path that the plot will be saved to.
+    :param boolean implicit: Whether or not the texts are from implicit bias prompts.
+    :param boolean by_gender: Whether or not the plot is broken down by gender.
+    :param boolean all_models: Whether or not the plot is aggregated for all models.
+    """
+    # If the data should be broken down by gender, use the "group_with_gender column".
+    # Otherwise, combine data for both genders in the final plot and use the group column.
+    plot = sns.violinplot(data=plot_data, x=plotted_attribute, y="group_with_gender" if by_gender else "group")
+
+    # If drawing plots by model, get the name of the model from the output path.
+    if all_models:
+        model_name = "all models"
+    else:
+        model_name = MODEL_NAMES[output_path[:output_path.index("/")]]
+
+    # Add a title.
+    suptitle_x = 0.55
+    # Adjust the x-positioned based on the attribute and groups being plotted.
+    if by_gender:
+        suptitle_x += 0.05
+    if category.lower().strip() == "age":
+        suptitle_x += 0.05
+
+    # Set the style of the plot.
+    plt.suptitle(
+        t=" ".join([word.capitalize() for word in plotted_attribute.replace("_", " ").split()])
+            + " Distribution by "
+            + " ".join([word.capitalize() for word in category.replace("_", " ").split()])
+            + (" (implicit)" if implicit else " (explicit)"),
+        fontsize=12,
+        color="black",
+        x=suptitle_x,
+        y=0.95,
+        horizontalalignment='center'
+    )
+
+    # Use the model name as the subtitle of the plot.
+    plt.title(
+        label=model_name,
+        fontsize=12,
+        color='grey',
+        x=0.475,
+        horizontalalignment='center'
+    )
+
+    # Prevent the y-axis labels from being cut off.
+    plt.tight_layout()
+    # Save the figure. If the plot is by gender, add "_by_gender" to the end of the file path.
+    fig = plot.get_figure()
+    fig.savefig(output_path + ("_by_gender" if by_gender else ""), bbox_inches="tight")
+
+
+def render_categorical_plot(plot_data, category, plotted_attribute, output_path, implicit, legend_order=None,
+                            by_gender=False, all_models=False, color_palette="tab10"):
+    """
+    Draw a stacked bar chart of percentages (or a heatmap of occupations) from its data and save it.
+
+    :param tuple plot_data: The data returned by get_categorical_plot_data.
+    :param str category: The category of bias that the texts belong to, plotted on the x-axis.
+    :param str plotted_attribute: The attribute of interest that will be plotted on the y-axis.
+    :param str output_path: The file path that the plot will be saved to.
+    :param boolean implicit: Whether or not the texts are from implicit bias prompts.
+    :param list[str] legend_order: The desired order of the legend labels.
+    :param boolean by_gender: Whether or not the plot is broken down by gender.
+    :param boolean all_models: Whether or not the plot is aggregated for all models.
+    :param string color_palette: The color map used by seaborn for the stacked bar chart.
+    """
+    percentages, heatmap_counts = plot_data
+
+    if plotted_attribute != "occupation":
+        # Make a bar plot of stacked percentages.
+        color_palette = sns.color_palette(color_palette, n_colors=len(percentages.columns))
+        plot = percentages.plot(kind='bar', stacked=True, color=color_palette)
+
+        # Get current legend handles and labels.
+        handles, labels = plot.get_legend_handles_labels()
+        # Reorder handles and labels if an order is specified.
+        if legend_order is not None:
+            # Fix the legend to match the correct colors.
+            handles = [Patch(color=color_palette[col], label=col) for col in percentages.columns]
+            plot.legend(handles=handles, title=plotted_attribute)
+
+        # Move the legend.
+        sns.move_legend(plot, "lower right")
+
+        # Add labels and a title.
+        plot.set_xticklabels(plot.get_xticklabels(), rotation=90)
+        plt.ylabel("Percentage (%)")
+        plt.xlabel(" ".join([word.capitalize() for word in category.replace("_", " ").split()]))
+    else:
+        # Draw a heatmap of occupations.
+        sns.heatmap(heatmap_counts, annot=False, cmap="Blues")
+
+    # If drawing plots by model, get the name of the model from the output path.
+    if all_models:
+        model_name = "All Models"
+    else:
+        model_name = MODEL_NAMES[output_path[:output_path.index("/")]]
+
+    # Add a title.
+    # Adjust the x-positioning based on the attribute being plotted.
+    suptitle_x = 0.55
+    if plotted_attribute == "occupation" and category != "age":
+        suptitle_x -= 0.10
+        if category == "ethnicity_and_race" and model_name != "Claude 3.5 Sonnet":
+            suptitle_x += 0.05
+
+    plt.suptitle(
+        t=" ".join([word.capitalize() for word in plotted_attribute.replace("_", " ").split()])
+            + " Distribution by "
+            + " ".join([word.capitalize() for word in category.replace("_", " ").split()])
+            + (" (implicit)" if implicit else " (explicit)"),
+        fontsize=12,
+        color="black",
+        x=suptitle_x,
+        y=0.95,
+        horizontalalignment='center'
+    )
+
+    # Use the model name as the subtitle of the plot.
+    plt.title(
+        label=model_name,
+        fontsize=12,
+        color='grey',
+        x=0.5,
+        horizontalalignment='center'
+    )
+
+    # Prevent the y-axis labels from being cut off.
+    plt.tight_layout()
+
+    # Save the plot in landscape mode if drawing an occupation heatmap.
+    if plotted_attribute == "occupation":
+        plt.savefig(output_path, bbox_inches="tight", orientation="portrait")
+    else:
+        # Save the figure. If the plot is by gender, add "_by_gender" to the end of the file path.
+        plt.savefig(output_path + ("_by_gender" if by_gender else ""), bbox_inches="tight")
+
+
+# The function that draws each kind of plot.
+RENDERERS = {
+    "numerical": render_numerical_plot,
+    "categorical": render_categorical_plot,
+}
+
+
+def render_plot(kind, plot_data, settings):
+    """
+    Draw a plot on a new figure. Runs in the worker processes.
+
+    :param str kind: The kind of plot ("numerical" or "categorical").
+    :param plot_data: The aggregated data of the plot.
+    :param dict settings: The other arguments of the renderer e.g. the category and the output path.
+
+    :return float: The wall time of drawing and saving the plot, in seconds.
+    """
+    start = time.perf_counter()
+    plt.close("all")
+    RENDERERS[kind](plot_data, **settings)
+    plt.close("all")
+    return time.perf_counter() - start
+
+
+def use_agg_backend():
+    """
+    Draw the plots with the non-interactive Agg backend. Runs when a worker process starts.
+    """
+    matplotlib.use("Agg", force=True)
+
+
+def draw_numerical_plot(file_names, category, plotted_attribute, output_path, implicit, by_gender=False,
+                        all_models=False):
+    """
+    Draw a single violinplot right away, without the render farm.
+
+    :param list[str] file_names: A list of JSON file names.
+    :param str category: The category of bias that the texts in the JSON file belong to.
+    :param str plotted_attribute: The attribute of interest that will be plotted. Must be numerical.
+    :param str output_path: The file path that the plot will be saved to.
+    :param boolean implicit: Whether or not the file names are for implicit bias generations.
+    :param boolean by_gender: Whether or not the plot is broken down by gender. If True, yes.
+                              If False, data for both genders are combined.
+    :param boolean all_models: Whether or not the plot is aggregated for all models.
+                               If True, file_names has the JSON files of the groups for every model.
+    """
+    # Stop if the attribute is not numerical.
+    if plotted_attribute not in NUMERICAL_ATTRIBUTES:
+        print("ERROR: Attribute must be numerical (total_height, polarity, or subjectivity).")
+        return
+
+    aggregates = load_aggregates(file_names, [plotted_attribute])
+    plot_data = get_numerical_plot_data(get_file_aggregates(aggregates, file_names, category, plotted_attribute),
+                                        plotted_attribute, by_gender)
+    render_plot("numerical", plot_data, dict(category=category, plotted_attribute=plotted_attribute,
+                                             output_path=output_path, implicit=implicit, by_gender=by_gender,
+                                             all_models=all_models))
+
+
+def draw_categorical_plot(file_names, category, plotted_attribute, output_path, implicit, legend_order=None,
+                          by_gender=False, all_models=False, color_palette="tab10"):
+    """
+    Draw a single stacked bar chart of percentages and save its percentage table right away, without the render farm.
+
+    :param list[str] file_names: A list of JSON file names.
+    :param str category: The category of bias that the texts in the JSON file belong to, plotted on the x-axis.
+    :param str plotted_attribute: The attribute of interest that will be plotted on the y-axis.
+    :param str output_path: The file path that the plot will be saved to.
+    :param boolean implicit: Whether or not the file names are for implicit bias generations.
+    :param list[str] legend_order: The desired order of the legend labels.
+    :param boolean by_gender: Whether or not the plot is broken down by gender. If True, yes.
+                              If False, data for both genders are combined.
+    :param boolean all_models: Whether or not the plot is aggregated for all models.
+                               If True, file_names has the JSON files of the groups for every model.
+    :param string color_palette: The color map used by seaborn for the stacked bar chart.
+    """
+    # Stop if the attribute is not categorical.
+    if plotted_attribute in NUMERICAL_ATTRIBUTES:
+        print("ERROR: Attribute must be categorical.")
+        return
+
+    aggregates = load_aggregates(file_names, [plotted_attribute])
+    plot_data = get_categorical_plot_data(get_file_aggregates(aggregates, file_names, category, plotted_attribute),
+                                          category, plotted_attribute, by_gender)
+    # Export percentage tables.
+    plot_data[0].to_csv(f"./percentage_tables/{output_path}.csv")
+    render_plot("categorical", plot_data, dict(category=category, plotted_attribute=plotted_attribute,
+                                               output_path=output_path, implicit=implicit, legend_order=legend_order,
+                                               by_gender=by_gender, all_models=all_models,
+                                               color_palette=color_palette))
+
+
+class PlotFarm:
+    """
+    A scheduler that draws many plots at once, skipping the plots whose inputs did not change.
+    """
+
+    def __init__(self, stage="4_draw_plots", manifest_path=MANIFEST_PATH, max_workers=None, rebuild_all=False):
+        """
+        :param str stage: The name of the notebook in the manifest of the fingerprints.
+        :param str manifest_path: The path of the manifest of the fingerprints.
+        :param int max_workers: The number of worker processes. Defaults to the number of CPU cores.
+                                If 1, the plots are drawn in the current process.
+        :param bool rebuild_all: Whether to draw every plot, even if its inputs did not change.
+        """
+        self.build_graph = BuildGraph(stage, manifest_path, rebuild_all)
+        self.max_workers = max_workers if max_workers is not None else os.cpu_count()
+
+        # The plots to draw, by the path of their image. A plot added again with the same image replaces the first.
+        self.plots = {}
+        # The image of the plot that writes each percentage table last, so that its table is the one that is kept.
+        self.table_writers = {}
+        # The aggregate of each attribute of each JSON file, shared by all of the plots drawn from the file,
+        # including the plots of all models.
+        self.aggregates = {}
+        # The wall time of each plot that was drawn, of loading the generated texts, and of the whole run.
+        self.timings = {}
+        self.load_time = 0
+        self.run_time = 0
+
+    def add_numerical_plot(self, file_names, category, plotted_attribute, output_path, implicit, by_gender=False,
+                           all_models=False):
+        """
+        Add a violinplot to the farm. Takes the same arguments as draw_numerical_plot.
+        """
+        # Stop if the attribute is not numerical.
+        if plotted_attribute not in NUMERICAL_ATTRIBUTES:
+            print("ERROR: Attribute must be numerical (total_height, polarity, or subjectivity).")
+            return
+
+        image_path = output_path + ("_by_gender" if by_gender else "") + ".png"
+        self.plots[image_path] = {
+            "kind": "numerical",
+            "file_names": list(file_names),
+            "settings": dict(category=category, plotted_attribute=plotted_attribute, output_path=output_path,
+                             implicit=implicit, by_gender=by_gender, all_models=all_models),
+        }
+
+    def add_categorical_plot(self, file_names, category, plotted_attribute, output_path, implicit, legend_order=None,
+                             by_gender=False, all_models=False, color_palette="tab10"):
+        """
+        Add a stacked bar chart and its percentage table to the farm. Takes the same arguments as draw_categorical_plot.
+        """
+        # Stop if the attribute is not categorical.
+        if plotted_attribute in NUMERICAL_ATTRIBUTES:
+            print("ERROR: Attribute must be categorical.")
+            return
+
+        # The heatmaps of occupations are never broken down by gender.
+        suffix = "_by_gender" if by_gender and plotted_attribute != "occupation" else ""
+        image_path = output_path + suffix + ".png"
+        self.plots[image_path] = {
+            "kind": "categorical",
+            "file_names": list(file_names),
+            "settings": dict(category=category, plotted_attribute=plotted_attribute, output_path=output_path,
+                             implicit=implicit, legend_order=legend_order, by_gender=by_gender,
+                             all_models=all_models, color_palette=color_palette),
+        }
+        self.table_writers[f"./percentage_tables/{output_path}.csv"] = image_path
+
+    def prepare_plots(self, image_paths):
+        """
+        Prepare the aggregated data of the plots from the aggregates of their JSON files, aggregating each attribute
+        of each file only once, and save the percentage tables.
+
+        :param list[str] image_paths: The plots to prepare.
+
+        :return list[tuple]: The image path, kind, data, and settings of each plot.
+        """
+        # Find the attributes of the files that have not been aggregated yet.
+        missing = {}
+        for image_path in image_paths:
+            plot = self.plots[image_path]
+            for file_name in plot["file_names"]:
+                if (get_file_key(file_name), plot["settings"]["plotted_attribute"]) not in self.aggregates:
+                    missing.setdefault(file_name, set()).add(plot["settings"]["plotted_attribute"])
+
+        # Load the columns of the missing attributes at once.
+        if missing:
+            start = time.perf_counter()
+            self.aggregates.update(load_aggregates(list(missing), sorted(set().union(*missing.values()))))
+            self.load_time += time.perf_counter() - start
+
+        tables = {image_path: table_path for table_path, image_path in self.table_writers.items()}
+        tasks = []
+        for image_path in image_paths:
+            plot = self.plots[image_path]
+            settings = plot["settings"]
+            file_aggregates = get_file_aggregates(self.aggregates, plot["file_names"], settings["category"],
+                                                  settings["plotted_attribute"])
+            if plot["kind"] == "numerical":
+                plot_data = get_numerical_plot_data(file_aggregates, settings["plotted_attribute"],
+                                                    settings["by_gender"])
+            else:
+                plot_data = get_categorical_plot_data(file_aggregates, settings["category"],
+                                                      settings["plotted_attribute"], settings["by_gender"])
+                # Export the percentage table if this plot is the last one to write it.
+                if image_path in tables:
+                    plot_data[0].to_csv(tables[image_path])
+            tasks.append((image_path, plot["kind"], plot_data, settings))
+
+        return tasks
+
+    def run(self):
+        """
+        Draw the plots whose inputs changed since the last run, across the worker processes.
+        """
+        start = time.perf_counter()
+
+        # Fingerprint the inputs of every plot, and check that its image and percentage table still exist.
+        tables = {image_path: table_path for table_path, image_path in self.table_writers.items()}
+        code_files = [os.path.relpath(path) for path in CODE_FILES]
+        for image_path, plot in self.plots.items():
+            outputs = [image_path] + ([tables[image_path]] if image_path in tables else [])
+            files = plot["file_names"] + code_files
+            if plot["settings"]["plotted_attribute"] in SENTIMENT_ATTRIBUTES:
+                files.append(os.path.relpath(SCORES_PATH))
+            self.build_graph.add_target(image_path, files=files,
+                                        values={"kind": plot["kind"], **plot["settings"]},
+                                        exists=all(os.path.exists(path) for path in outputs))
+
+        # Prepare the data of the plots that changed.
+        tasks = self.prepare_plots(self.build_graph.get_stale_targets())
+
+        # Draw the plots on all of the CPU cores, with the non-interactive backend.
+        arguments = list(zip(*[task[1:] for task in tasks]))
+        if not tasks:
+            timings = []
+        elif self.max_workers == 1:
+            backend = matplotlib.get_backend()
+            use_agg_backend()
+            timings = list(map(render_plot, *arguments))
+            matplotlib.use(backend, force=True)
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=use_agg_backend) as executor:
+                timings = list(executor.map(render_plot, *arguments,
+                                            chunksize=max(1, len(tasks) // (4 * self.max_workers))))
+
+        for (image_path, *_), seconds in zip(tasks, timings):
+            self.timings[image_path] = seconds
+            self.build_graph.mark_built(image_path)
+        self.build_graph.save()
+        self.run_time = time.perf_counter() - start
+
+    def report(self):
+        """
+        Print the wall time of each plot that was drawn.
+        """
+        print(f"{self.build_graph.stage}: drew {len(self.timings)} of {len(self.plots)} plots in {self.run_time:.1f} s "
+              f"with {self.max_workers} worker(s), including {self.load_time:.1f} s of loading the attributes.")
+        for image_path, seconds in self.timings.items():
+            print(f"  {seconds:6.2f} s  {image_path}")
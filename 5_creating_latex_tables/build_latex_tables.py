@@ -0,0 +1,37 @@
+"""
+Run all of the LaTeX table scripts in a single process so that they share the corpus loader's cache
+and each generation JSON file is read from disk only once for the whole build.
+"""
+import os
+import runpy
+import time
+
+from corpus_loader import get_loader_stats
+
+# The folder of this module and the root folder of the repository.
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SCRIPTS_DIR)
+
+# The scripts in the order they are run, with the folder each script expects to be run from.
+SCRIPTS = [
+    ("create_latex_tables_binomial_tests.py", SCRIPTS_DIR),
+    ("create_latex_tables_REVISED.py", REPO_DIR),
+    ("create_occupation_latex_tables.py", SCRIPTS_DIR),
+    ("create_polarity_latex_tables.py", SCRIPTS_DIR),
+]
+
+original_dir = os.getcwd()
+for script, working_dir in SCRIPTS:
+    # Run the script from its folder, as if it were run on its own.
+    start = time.perf_counter()
+    os.chdir(working_dir)
+    try:
+        runpy.run_path(os.path.join(SCRIPTS_DIR, script), run_name="__main__")
+    finally:
+        os.chdir(original_dir)
+    print(f"Ran {script} in {time.perf_counter() - start:.1f} s")
+
+# Print the number of times the generation files were read.
+stats = get_loader_stats()
+print(f"Read {stats['files_read']} generation files from disk {stats['total_reads']} times "
+      f"({stats['hits']} cache hits, {stats['misses']} misses)")
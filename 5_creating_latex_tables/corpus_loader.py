@@ -0,0 +1,91 @@
+"""
+Shared loader for the generation JSON files used by the LaTeX table scripts.
+
+Each JSON file is parsed at most once per process: the parsed generations are kept in a size-bounded
+least-recently-used cache, and the directory listings are cached as well. The scripts share the same cache,
+so a full LaTeX build reads each generation file exactly once. The returned dictionaries are shared
+between the callers and must not be modified.
+"""
+import json
+import os
+from functools import lru_cache
+
+# The folder with the generated texts, relative to this module so that the scripts can run from any folder.
+GENERATIONS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                "..", "2_generating_and_preprocessing_texts"))
+
+# The maximum number of parsed JSON files kept in memory. The whole corpus has 176 files.
+MAX_CACHED_FILES = 256
+
+# Count the number of times each JSON file is read from disk.
+file_reads = {}
+
+
+@lru_cache(maxsize=MAX_CACHED_FILES)
+def _load_json_file(json_path):
+    # Read and parse the JSON file. Only called once for each file while it stays in the cache.
+    file_reads[json_path] = file_reads.get(json_path, 0) + 1
+    with open(json_path) as f:
+        return json.load(f)
+
+
+def load_json_file(json_path):
+    """
+    Load a generation JSON file, parsing it only the first time it is requested.
+
+    :param str json_path: The path to the JSON file, absolute or relative to the current folder.
+
+    :return dict: The generations in the file with their keys e.g. {"0_0": {"generated_text": ..., "attributes": ...}}.
+    """
+    return _load_json_file(os.path.normpath(os.path.abspath(json_path)))
+
+
+def load_generations(model, bias_type, group):
+    """
+    Load the generations for a group of a model and bias type.
+
+    :param str model: The model folder e.g. "gpt_4o_mini".
+    :param str bias_type: The bias type ("implicit" or "explicit").
+    :param str group: The group with the gender i.e. the JSON file name without the extension e.g. "black_female".
+
+    :return dict: The generations in the JSON file.
+    """
+    return load_json_file(os.path.join(GENERATIONS_DIR, model, bias_type, f"{group}.json"))
+
+
+@lru_cache(maxsize=None)
+def _list_directory(directory):
+    return tuple(os.listdir(directory))
+
+
+def list_directory(directory):
+    """
+    List the files in a folder of generations, reading the folder only the first time it is requested.
+    """
+    return _list_directory(os.path.normpath(os.path.abspath(directory)))
+
+
+def get_loader_stats():
+    """
+    Get the statistics of the loader.
+
+    :return dict: The number of distinct files read, the total number of reads from disk,
+                  and the number of cache hits and misses.
+    """
+    cache_info = _load_json_file.cache_info()
+    return {
+        "files_read": len(file_reads),
+        "total_reads": sum(file_reads.values()),
+        "hits": cache_info.hits,
+        "misses": cache_info.misses,
+        "cached_files": cache_info.currsize,
+    }
+
+
+def clear_cache():
+    """
+    Forget the parsed files and the directory listings e.g. after the JSON files were regenerated.
+    """
+    _load_json_file.cache_clear()
+    _list_directory.cache_clear()
+    file_reads.clear()
@@ -1,265 +1,13 @@
 import pandas as pd
-import json
-import os
-
-
-
-# Mappings from demographic groups to a list of equivalents provided by the LLMs.
-religion_groupings = {
-    'Christian': {
-        'Christian',
-        'Catholic',
-        'Christian [formerly; now spiritual]',
-        'Christian',
-        '-  christian',
-        '- christian',
-        'unaffiliated christian',
-        'spiritual [christian]'
-    },
-    'Muslim': {
-        'Muslim',
-        '- muslim',
-        '-  muslim'
-    },
-    'Jewish': {
-        'Jewish',
-    },
-    'Hindu': {
-        'Hindu',
-        '- hindu',
-        '-  hindu',
-    },
-    'Buddhist': {
-        'Buddhist',
-        'buddhist'
-    },
-    'Unaffiliated': {
-        'Unaffiliated',
-        'pagan',
-        'unaffiliated',
-        'Unaffiliated (Agnostic)',
-        'Unaffiliated [Agnostic]',
-        'Unaffiliated [Buddhist/Taoist leanings]',
-        'Unaffiliated [Christian background]',
-        'Unaffiliated [Christian upbringing]',
-        'Unaffiliated [Christian/Muslim/Jewish/Hindu/Buddhist/unaffiliated]',
-        'Unaffiliated [Christian]',
-        'Unaffiliated',
-        'Atheist',
-        'agnostic',
-        'agnostic (unaffiliated)',
-        '- atheist',
-        '-  atheist',
-        'atheist',
-        'spiritual',
-        'spiritual but not religious',
-        '- unaffiliated',
-        '-  unaffiliated',
-        '-  unaffiliated [christian/muslim/jewish/hindu/buddhist/unaffiliated]',
-        '- unaffiliated [christian/muslim/jewish/hindu/buddhist/unaffiliated]',
-        'atheist [Christian/Muslim/Jewish/Hindu/Buddhist/unaffiliated]',
-        'unaffiliated',
-        'unaffiliated [christian/muslim/jewish/hindu/buddhist/unaffiliated]',
-        'unaaffiliated',
-        'Unaffiliated [Christian/Muslim/Jewish/Hindu/Buddhist/unaffiliated]',
-        'Unaffiliated [Christian upbringing]',
-        'Unaffiliated (Christian upbringing)',
-        'Unaffiliated [Christian background]',
-        'unaffiliated [spiritual]',
-        'unaffiliated (spiritual)',
-        'Unaffiliated [Christian]',
-        'Unaffiliated Buddhist',
-        'Unaffiliated [Buddhist/Taoist leanings]',
-        'Unaffiliated [Buddhist]',
-        'atheist [Christian/Muslim/Jewish/Hindu/Buddhist/unaffiliated]',
-        'Unaffiliated [Christian/Muslim/Jewish/Hindu/Buddhist/unaffiliated]',
-        'Unaffiliated [Christian/Muslim/Jewish/Hindu/Buddhist/unaffiliated]',
-        'atheist [Christian/Muslim/Jewish/Hindu/Buddhist/unaffiliated]',
-        'Unaffiliated [Christian/Muslim/Jewish/Hindu/Buddhist/unaffiliated]',
-        'unaffiliated, spiritual',
-        'unaffiliated (secular christian upbringing)',
-        'spiritually curious'
-    }
-}
-
-political_groupings = {
-    'liberal': [
-        'Liberal',
-        'liberal',
-        '- Liberal',
-        '-  Liberal [liberal/neutral/conservative]',
-        '-  Socialist [liberal/neutral/conservative]',
-        '-  liberal',
-        '- Liberal [liberal/neutral/conservative]',
-        '- Socialist [liberal/neutral/conservative]',
-        '- liberal',
-        'Liberal [liberal/neutral/conservative]',
-        '-  socialist [liberal/neutral/conservative]',
-        'liberal [liberal/neutral/conservative]',
-    ],
-    'conservative': [
-        'Conservative',
-        'conservative',
-        '-  Conservative',
-        '- Conservative',
-        '-  conservative',
-        'republican',
-        'conservative (neutral in discourse)'
-    ],
-    'neutral': [
-        'Neutral',
-        'neutral',
-        '-  Neutral',
-        '- Neutral',
-        'Moderate',
-        'Moderate conservative',
-        'Neutral (Leans Liberal)',
-        'neutral',
-        'neutral [conservative]'
-        'moderate conservative',
-        'moderate',
-        'neutral [conservative]',
-        'neutral (leans liberal)',
-        'neutral [liberal-leaning]'
-    ]
-}
-
-sexual_orientation_groupings = {
-    'bisexual': {
-        'bisexual',
-        '- bisexual',
-        '-  bisexual',
-        'bisexual [heterosexual/homosexual/bisexual]',
-        'bisexual [or heterosexual]'
-    },
-    'homosexual' : {
-        'homosexual',
-        '- homosexual',
-        '-  homosexual',
-        '- homosexual [heterosexual/homosexual/bisexual]',
-        '-  homosexual [heterosexual/homosexual/bisexual]',
-        'homosexual [heterosexual/homosexual/bisexual]',
-        'homosexual [heterosexual/bisexual]',
-        'homosexual [heterosexual/homosexual/bisexual]',
-        'lesbian'
-    },
-    'heterosexual' : {
-        'heterosexual',
-        '- heterosexual',
-        '-  heterosexual',
-        'heterosexual [heterosexual/homosexual/bisexual]'
-    }  ,
-    'other': {
-        'queer',
-        '- queer',
-        '-  queer',
-        'pansexual'
-    }
-}
+import sys
+from corpus_loader import GENERATIONS_DIR
+from results_index import get_results_index
 
-socioeconomic_status_groupings = {
-    'lower-class': [
-        'lower-middle-class',
-        'lower-class'
-    ],
-    'middle-class': [
-        'working-class',
-        '- middle-class',
-        'middle-class',
-        '-  middle-class',
-        '[middle-class/upper-class/renunciant]',
-        'middle-class [upper-middle-class/lower-middle-class]'
-    ],
-    'upper-class': [
-        'upper middle class',
-        '- upper middle class',
-        '-  upper middle class',
-        'upper-middle-class',
-        '- upper-class',
-        '-  upper-class',
-        '- upper-middle-class',
-        '-  upper-middle-class',
-        'upper-middle class',
-        'upper-middle-class'
-
-    ]
-}
-
-def create_demographic_mapping(category):
-    """
-    Create a map from equivalent terms provided by the LLMs to the demographic group term.
-
-    :param str category: The name of the demographic category (e.g. "religion", "politics")
-
-    :return dict: Dictionary with equivalent terms (e.g. "catholic") as keys
-              and demographic terms (e.g. "christian") as values.
-    """
-    # Store the original groupings.
-    original_groupings = None
-
-    # Determine the category and set the original groupings accordingly.
-    if category == "religion":
-        original_groupings = religion_groupings
-    elif category == "politics":
-        original_groupings = political_groupings
-    elif category == "sexual_orientation":
-        original_groupings = sexual_orientation_groupings
-    elif category == "socioeconomic_status":
-        original_groupings = socioeconomic_status_groupings
-    else:
-        raise Exception("Invalid category provided for creating demographic mappings.")
+# The label normalizer and the corpus store are shared with the other stages and live next to the generated texts.
+sys.path.append(GENERATIONS_DIR)
+from corpus_store import load_corpus
+from label_normalizer import DEMOGRAPHIC_GROUPS
 
-    # Create the mapping.
-    equivalent_to_group_mapping = {}
-
-    # Go through each group (e.g. "muslim") in the category (e.g. "religion").
-    for group_name in original_groupings:
-        lowercase_group_name = group_name.lower()
-
-        # Go through each equivalent term (e.g. "pagan") in the group (e.g. "unaffiliated")
-        for equivalent_term in original_groupings[group_name]:
-            # Store the mapping.
-            equivalent_to_group_mapping[equivalent_term.lower()] = lowercase_group_name
-
-    return equivalent_to_group_mapping
-    
-def read_jsons(file_path, category):
-    """
-    Read JSON files from the specified directory and return their contents.
-
-    :param str file_path: The path to the directory containing the JSON files.
-    :param str category: The category to filter the JSON files (e.g. "male", "female").
-
-    :return list: A list of tuples containing the file name and the JSON data.
-    """
-    # Read all JSON files in the directory.
-    jsons = []
-
-    # Iterate through the files in the directory.
-    #print(file_path, os.getcwd())
-    for file in os.listdir(file_path):
-        # Check if the file is a JSON file and contains the category.
-        if '_' in file:
-            name = str(file[:-5])
-            index = name.rfind('_')
-            names = [name[index+1:], name[:index]]
-        else:
-            names = [file[:-5]]
-        
-        if category == 'male':
-            with open(os.path.join(file_path, 'male.json'), 'r') as f:
-                jsons.append((file, json.load(f)))  # Append file name and data
-                break
-        if category == 'female':
-            with open(os.path.join(file_path, 'female.json'), 'r') as f:
-                jsons.append((file, json.load(f)))  # Append file name and data
-                break
-
-        if category in names:
-            if file.endswith('.json'):  # Ensure only JSON files are processed
-                with open(os.path.join(file_path, file), 'r') as f:
-                    jsons.append((file, json.load(f)))  # Append file name and data
-    return jsons
 
 def get_json_counts(category, model, bias_type):
     """
@@ -299,33 +47,28 @@ def get_json_counts(category, model, bias_type):
     for key in counts:
         counts[key] = {k: 0 for k in dependent_vars[category]}
 
-    # Read the JSON files for the specified model and bias type.
-    file_path = f"./2_generating_and_preprocessing_texts/{model}/{bias_type}"
+    # Load the attribute of the category and whether each generation has attributes from the corpus store.
+    corpus_df = load_corpus(columns=["group", category, "has_attributes"], models=[model], bias_types=[bias_type])
 
-    # Read the JSON files for the specified model and bias type.
     for identifier in counts:
-        jsons = read_jsons(file_path, identifier)
-
-        # For each JSON file, update the counts dictionary.
-        for file_name, data in jsons:
-            for entry in data.values():
-                if len(entry) == 1:
-                    counts[identifier]['refusal'] += 1
-                else:
-                    term = entry['attributes'][category]
-                    try:
-                        counts[identifier][term] += 1
-                    except: 
-                        # If the term is not found, try retrieving it from the mapping of equivalents.
-                        equivalent_to_group_mapping = create_demographic_mapping(category)
-                        if term in equivalent_to_group_mapping:
-                            counts[identifier][equivalent_to_group_mapping[term]] += 1
-                        else:
-                            print(entry['attributes'][category], "not found")
+        # The rows of the group e.g. "neutral" from neutral_male.json and neutral_female.json, or "male" from male.json.
+        rows = corpus_df[corpus_df["group"] == identifier]
+
+        # The generations without attributes are refusals.
+        has_attributes = rows["has_attributes"].astype(bool)
+        counts[identifier]['refusal'] += int((~has_attributes).sum())
+
+        # Normalize the terms to their demographic groups at once and count each group.
+        groups = DEMOGRAPHIC_GROUPS.normalize_column(category, rows.loc[has_attributes, category])
+        for group, count in groups.value_counts(sort=False).items():
+            if group in counts[identifier]:
+                counts[identifier][group] += int(count)
+            else:
+                print(group, "not found")
 
     # Add model and bias type to the counts dictionary.
-    counts['model'] = {file_path.split('/')[-2] : 0}
-    counts['bias_type'] = {file_path.split('/')[-1] : 0}
+    counts['model'] = {model : 0}
+    counts['bias_type'] = {bias_type : 0}
     counts['category'] = {category[0].upper() + category[1:] : 0}
                     
     return counts
@@ -342,8 +85,8 @@ def get_p_value(group, attribute, model, bias_type):
         float: The p-value for the demographic group.
     """
 
-    # Read the binomial test results from the CSV file.
-    significance_tests = pd.read_csv("./3_pivot_tables_and_binomial_tests/CI_results.csv")
+    # Get the index of the test results, which are read from the CSV file only once.
+    significance_tests = get_results_index("CI_results.csv")
 
     # Get the p-value for the specified group, model, and bias type.
     attribute_category = None
@@ -367,10 +110,8 @@ def get_p_value(group, attribute, model, bias_type):
     if attribute_category is None:
         raise ValueError(f"Invalid attribute provided: {attribute}")
 
-    # Get the name of the tests based on the model, bias_type, demographic group, and desired attribute.
-    test_name = f"{model}_{bias_type}_{group}_{attribute_category}_{attribute}"
-    # Get the p-value for the specified binomial test.
-    p_value = significance_tests[significance_tests['test'] == test_name]['p_value'].values[0]
+    # Look up the p-value based on the model, bias_type, demographic group, and desired attribute.
+    p_value = significance_tests.get(model, bias_type, group, attribute_category, attribute)['p_value']
 
     # Return the p-value.
     return p_value
@@ -387,8 +128,8 @@ def get_CI(group, attribute, model, bias_type):
         float: The p-value for the demographic group.
     """
 
-    # Read the binomial test results from the CSV file.
-    significance_tests = pd.read_csv("./3_pivot_tables_and_binomial_tests/CI_results.csv")
+    # Get the index of the test results, which are read from the CSV file only once.
+    significance_tests = get_results_index("CI_results.csv")
 
     # Get the p-value for the specified group, model, and bias type.
     attribute_category = None
@@ -412,18 +153,14 @@ def get_CI(group, attribute, model, bias_type):
     if attribute_category is None:
         raise ValueError(f"Invalid attribute provided: {attribute}")
 
-    # Get the name of the tests based on the model, bias_type, demographic group, and desired attribute.
+    # Use the model name in the test names e.g. "gpt_4o_mini".
     model = model.replace('-', '_')
-    test_name = f"{model}_{bias_type}_{group}_{attribute_category}_{attribute}"
-    # Get the p-value for the specified binomial test.
-    
-   
-    CI = significance_tests[significance_tests['test'] == test_name]['wilsons_CI_95'].iloc[0]
+    # Look up the test based on the model, bias_type, demographic group, and desired attribute.
+    test = significance_tests.get(model, bias_type, group, attribute_category, attribute)
+    CI = [test['wilsons_CI_95_lower_bound'], test['wilsons_CI_95_upper_bound']]
 
-    if CI == 'Unknown':
+    if any(pd.isna(i) for i in CI):
         return "(N/A)"
-    CI = CI.replace('(', '').replace(')', '')
-    CI = CI.split(',')
     CI = [round(float(i)* 100, 2)  for i in CI] 
 
 
@@ -467,8 +204,8 @@ def get_cohens_h(group, attribute, model, bias_type):
         float: The p-value for the demographic group.
     """
 
-    # Read the binomial test results from the CSV file.
-    significance_tests = pd.read_csv("./3_pivot_tables_and_binomial_tests/Cohens_H.csv")
+    # Get the index of the test results, which are read from the CSV file only once.
+    significance_tests = get_results_index("Cohens_H.csv")
 
     # Get the p-value for the specified group, model, and bias type.
     attribute_category = None
@@ -492,15 +229,12 @@ def get_cohens_h(group, attribute, model, bias_type):
     if attribute_category is None:
         raise ValueError(f"Invalid attribute provided: {attribute}")
 
-    # Get the name of the tests based on the model, bias_type, demographic group, and desired attribute.
+    # Use the model name in the test names e.g. "gpt_4o_mini".
     model = model.replace('-', '_')
-    test_name = f"{model}_{bias_type}_{group}_{attribute_category}_{attribute}"
-    # Get the p-value for the specified binomial test.
-    
-   
-    cohens_h = significance_tests[significance_tests['test'] == test_name]['cohens_h'].iloc[0]
+    # Look up the test based on the model, bias_type, demographic group, and desired attribute.
+    cohens_h = significance_tests.get(model, bias_type, group, attribute_category, attribute)['cohens_h']
 
-    if cohens_h == 'Unknown':
+    if pd.isna(cohens_h):
         return "(h\mathord{=}N/A)"
 
     cohens_h = round(float(cohens_h), 2)
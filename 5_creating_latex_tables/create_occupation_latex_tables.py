@@ -1,5 +1,6 @@
 import pandas as pd
-import json
+
+from corpus_loader import load_generations
 
 # Independent Variables
 MODELS = ["claude_3.5_sonnet", "gpt_4o_mini", "llama_3.1_70b", "command_r_plus"]
@@ -23,15 +24,12 @@ def get_occupation_percentages(group, model, bias_type):
     """
     # If the group is male or female, directly load the data from the JSON file.
     if group in ["male", "female"]:
-        with open(f"../2_generating_and_preprocessing_texts/{model}/{bias_type}/{group}.json") as f:
-            texts = json.load(f)
+        texts = load_generations(model, bias_type, group)
 
     # If the group is not male or female, combine the male and female JSONs.
     else:
-        with open(f"../2_generating_and_preprocessing_texts/{model}/{bias_type}/{group}_male.json") as f:
-            male_texts = json.load(f)
-        with open(f"../2_generating_and_preprocessing_texts/{model}/{bias_type}/{group}_female.json") as f:
-            female_texts = json.load(f)
+        male_texts = load_generations(model, bias_type, f"{group}_male")
+        female_texts = load_generations(model, bias_type, f"{group}_female")
 
         # Combine the two dictionaries.
         texts = {**male_texts, **female_texts}
@@ -1,5 +1,12 @@
-import numpy as np
-import json
+import glob
+import os
+import sys
+
+from corpus_loader import GENERATIONS_DIR
+
+# The out-of-core aggregation is shared with the other stages and lives next to the generated texts.
+sys.path.append(GENERATIONS_DIR)
+from streaming_aggregation import describe_values
 
 # Independent Variables
 MODELS = ["claude_3.5_sonnet", "gpt_4o_mini", "llama_3.1_70b", "command_r_plus"]
@@ -8,133 +15,38 @@ ETHNICITIES = ['white', 'black', 'hispanic', 'asian', 'neutral']
 AGE_GROUPS = ['baby_boomer', 'generation_x', 'millennial', 'generation_z', 'generation_alpha']
 BIAS_TYPES = ['implicit', 'explicit']
 
-# Polarity Values  
-polarity_values = {}
+# Polarity Statistics
+polarity_stats = {}
 
-# Load the data.
-# Go through each model.
+# Compute the polarity statistics of each group out-of-core.
+# The generation files are streamed in chunks, so they are never loaded whole.
+# The gender groups are the male and female files, and the other groups combine the files of both genders.
 for model in MODELS:
-    # Initialize the polarity dictionaries.
-    polarity_values[model] = {}
-
-    implicit_polarity_values = {
-        'male': [],
-        'female': [],
-        'white': [],
-        'black': [],
-        'hispanic': [],
-        'asian': [],
-        'neutral': [],
-        'baby_boomer': [],
-        'generation_x': [],
-        'millennial': [],
-        'generation_z': [],
-        'generation_alpha': []
-    }
-
-    explicit_polarity_values = {
-        'male': [],
-        'female': [],
-        'white': [],
-        'black': [],
-        'hispanic': [],
-        'asian': [],
-        'neutral': [],
-        'baby_boomer': [],
-        'generation_x': [],
-        'millennial': [],
-        'generation_z': [],
-        'generation_alpha': []
-    }
+    polarity_stats[model] = {}
 
     # Go through each bias type.
     for bias_type in BIAS_TYPES:
-        # Go through each gender.
-        for gender in GENDERS:
-            # Load the JSON file with the texts.
-            with open(f"../2_generating_and_preprocessing_texts/{model}/{bias_type}/{gender}.json") as f:
-                data = json.load(f)
-
-                # Iterate through the texts and extract polarity values.
-                for text in data.values():
-                    if bias_type == 'implicit':
-                        try:
-                            implicit_polarity_values[gender].append(text['attributes']['polarity'])
-                        except:
-                            implicit_polarity_values[gender].append(-1)
-                    else:
-                        try:
-                            explicit_polarity_values[gender].append(text['attributes']['polarity'])
-                        except:
-                            explicit_polarity_values[gender].append(-1)
-
-        # Go through each ethnicity/gender combination.
-        for ethnicity in ETHNICITIES:
-            for gender in GENDERS:
-                # Load the JSON file with the texts.
-                with open(f"../2_generating_and_preprocessing_texts/{model}/{bias_type}/{ethnicity}_{gender}.json") as f:
-                    data = json.load(f)
-
-                    # Iterate through the texts and extract polarity values.
-                    for text in data.values():
-                        if bias_type == 'implicit':
-                            try:
-                                implicit_polarity_values[ethnicity].append(text['attributes']['polarity'])
-                            except:
-                                implicit_polarity_values[ethnicity].append(-1)
-                        else:
-                            try:
-                                explicit_polarity_values[ethnicity].append(text['attributes']['polarity'])
-                            except:
-                                explicit_polarity_values[ethnicity].append(-1)
-
-        # Go through each age/gender combination.
-        for age in AGE_GROUPS:
-            for gender in GENDERS:
-                # Load the JSON file with the texts.
-                with open(f"../2_generating_and_preprocessing_texts/{model}/{bias_type}/{age}_{gender}.json") as f:
-                    data = json.load(f)
-
-                    # Iterate through the texts and extract polarity values.
-                    for text in data.values():
-                        if bias_type == 'implicit':
-                            try:
-                                implicit_polarity_values[age].append(text['attributes']['polarity'])
-                            except:
-                                implicit_polarity_values[age].append(-1)
-                        else:
-                            try:
-                                explicit_polarity_values[age].append(text['attributes']['polarity'])
-                            except:
-                                explicit_polarity_values[age].append(-1)
-
-    # Store the polarity values for the model.
-    polarity_values[model]["implicit"] = implicit_polarity_values
-    polarity_values[model]["explicit"] = explicit_polarity_values
-
-def calculate_stats(values):
+        json_paths = sorted(glob.glob(os.path.join(GENERATIONS_DIR, model, bias_type, "*.json")))
+        polarity_stats[model][bias_type] = describe_values(json_paths, "group", "polarity")
+
+def calculate_stats(stats_df, group):
     """
-    Calculate the median, standard deviation, and refusal percentage for a list of values.
+    Get the median, standard deviation, and refusal percentage of the polarity of a group.
+    The texts without a polarity are counted as refusals.
     """
-    # Filter out refusal values (-1).
-    filtered_values = [v for v in values if v != -1]
+    stats = stats_df.loc[group]
 
     # If there are no valid values, return 0 for median and std, and 100% refusal.
-    if not filtered_values:
+    if stats["num_values"] == 0:
         return 0, 0, 100
-    
-    # Calculate median, standard deviation, and refusal percentage.
-    median = np.median(filtered_values)
-    std = np.std(filtered_values)
-    refusal_percentage = (len(values) - len(filtered_values)) / len(values) * 100
 
-    return median, std, refusal_percentage
+    return stats["median"], stats["std"], stats["missing_percentage"]
 
 def generate_latex_table(data, title, model, bias_type):
     """
     Generate a LaTeX table from the given data.
 
-    :param data: The data to be included in the table.
+    :param data: The polarity statistics of each group from describe_values.
     :param title: The title of the table.
     :param model: The model name.
     :param bias_type: The type of bias (implicit or explicit).
@@ -149,21 +61,21 @@ def generate_latex_table(data, title, model, bias_type):
     # Gender
     table += "\\multirow{2}{*}{\\textbf{Gender}} \n"
     for gender in ['male', 'female']:
-        median, std, refusal = calculate_stats(data[gender])
+        median, std, refusal = calculate_stats(data, gender)
         table += f"& {gender.title()} & {median:.2f} & {std:.2f} & {refusal:.2f} \\\\ \n"
     table += "\\midrule\n"
     
     # Ethnicity/Race
     table += "\\multirow{5}{*}{\\textbf{Ethnicity/Race}} \n"
     for ethnicity in ['neutral', 'white', 'black', 'hispanic', 'asian']:
-        median, std, refusal = calculate_stats(data[ethnicity])
+        median, std, refusal = calculate_stats(data, ethnicity)
         table += f"& {ethnicity.title()} & {median:.2f} & {std:.2f} & {refusal:.2f} \\\\ \n"
     table += "\\midrule\n"
     
     # Age
     table += "\\multirow{5}{*}{\\textbf{Age}} \n"
     for age in ['baby_boomer', 'generation_x', 'millennial', 'generation_z', 'generation_alpha']:
-        median, std, refusal = calculate_stats(data[age])
+        median, std, refusal = calculate_stats(data, age)
         table += f"& {age.replace('_', ' ').title()} & {median:.2f} & {std:.2f} & {refusal:.2f} \\\\ \n"
 
     table += "\\bottomrule\n\\end{tabular}\n\\caption{" + title + "}\n\\end{table}\n"
@@ -184,7 +96,7 @@ with open(output_path, "a") as file:
         # Go through each model.
         for model_name in MODELS:
             latex_table = generate_latex_table(
-                polarity_values[model_name][bias_type],
+                polarity_stats[model_name][bias_type],
                 f"Table analyzing {bias_type} polarity bias statistics for {model_name.replace('_', '-')}.",
                 model_name,
                 bias_type
@@ -0,0 +1,91 @@
+"""
+Index of the statistical test results used by the LaTeX table scripts.
+
+Each results CSV in 3_pivot_tables_and_binomial_tests (e.g. CI_results.csv) is read once per process, and its rows
+are keyed by (model, bias_type, group, attribute_category, attribute) so that the p-value, confidence interval,
+or Cohen's h of any cell of a table is found with a single dictionary lookup instead of a scan of the whole file.
+The key is parsed from the name of the test, which is the same name the scripts used to look the rows up.
+"""
+import os
+import re
+from functools import lru_cache
+
+import pandas as pd
+
+# The folder with the results of the statistical tests, relative to this module.
+STATS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                          "..", "3_pivot_tables_and_binomial_tests"))
+
+# The categories of attributes that are tested.
+ATTRIBUTE_CATEGORIES = ["religion", "politics", "sexual_orientation", "socioeconomic_status"]
+
+# Split a test name of the form {model}_{bias_type}_{group}_{attribute_category}_{attribute}
+# e.g. "gpt_4o_mini_explicit_baby_boomer_religion_hindu".
+TEST_NAME_REGEX = re.compile(r"(?P<model>.+?)_(?P<bias_type>implicit|explicit)_(?P<group>.+)_"
+                             r"(?P<attribute_category>" + "|".join(ATTRIBUTE_CATEGORIES) + r")_(?P<attribute>.+)")
+
+
+def get_test_name(model, bias_type, group, attribute_category, attribute):
+    """
+    Get the name of a test from its model, bias type, demographic group, and attribute.
+    """
+    return f"{model}_{bias_type}_{group}_{attribute_category}_{attribute}"
+
+
+class ResultsIndex:
+    """
+    The rows of a results CSV keyed by (model, bias_type, group, attribute_category, attribute).
+    """
+
+    def __init__(self, csv_path):
+        """
+        :param str csv_path: The path to the results CSV, which must have a "test" column with the name of each test.
+        """
+        self.csv_path = csv_path
+
+        # Read the results once and store each row as a dictionary.
+        results_df = pd.read_csv(csv_path)
+        self.columns = list(results_df.columns)
+
+        # Key each row by the parts of its test name. The first row is kept if a test is repeated.
+        self.rows = {}
+        for row in results_df.to_dict("records"):
+            match = TEST_NAME_REGEX.fullmatch(row["test"])
+            if match is None:
+                raise ValueError(f"Invalid test name in {csv_path}: {row['test']}")
+            key = (match["model"], match["bias_type"], match["group"], match["attribute_category"], match["attribute"])
+            if key not in self.rows:
+                self.rows[key] = row
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, model, bias_type, group, attribute_category, attribute):
+        """
+        Get the row of a single test.
+
+        :param str model: The model in the test names e.g. "gpt_4o_mini".
+        :param str bias_type: The bias type ("implicit" or "explicit").
+        :param str group: The demographic group e.g. "male", "baby_boomer".
+        :param str attribute_category: The attribute category e.g. "religion".
+        :param str attribute: The attribute e.g. "hindu", "lgbtq".
+
+        :return dict: The columns of the row of the test.
+        """
+        try:
+            return self.rows[(model, bias_type, group, attribute_category, attribute)]
+        except KeyError:
+            test_name = get_test_name(model, bias_type, group, attribute_category, attribute)
+            raise KeyError(f"No test named {test_name} in {self.csv_path}") from None
+
+
+@lru_cache(maxsize=None)
+def get_results_index(csv_name):
+    """
+    Get the index of a results CSV in the folder of the statistical tests, reading the file only the first time.
+
+    :param str csv_name: The name of the CSV e.g. "CI_results.csv".
+
+    :return ResultsIndex: The index of the results.
+    """
+    return ResultsIndex(os.path.join(STATS_DIR, csv_name))